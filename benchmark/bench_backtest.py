@@ -0,0 +1,179 @@
+"""回测重放：逐采样循环与全部币种向量化计算的对比，48小时窗口
+
+python -m benchmark.bench_backtest [币种数] [采样间隔秒]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+# 先导入record，避免与trading_data循环导入
+import src.record
+import src.store as store
+from src.backtest import PAD, load_history, replay, funding_settling, REPLAY_FIELDS
+from src.utils import *
+
+
+def synthetic_market(coins: List[str], start: int, end: int, interval: int, seed=0):
+    """写入均值回复的期现差价及随机挂单量，约十分之一的采样没有挂单量
+    """
+    rng = np.random.default_rng(seed)
+    for coin in coins:
+        timestamp = np.arange(start + rng.integers(1, interval * 1000), end, interval * 1000, dtype=np.int64)
+        n = len(timestamp)
+        price = 10 ** rng.uniform(-1, 3) * np.exp(np.cumsum(rng.normal(0, 3e-4, n)))
+        premium = np.empty(n)
+        premium[0] = 0.
+        noise = rng.normal(0, 4e-4, n)
+        for i in range(1, n):
+            premium[i] = 0.98 * premium[i - 1] + noise[i]
+        spread = price * 2e-4
+        spot_bid, spot_ask = price - spread / 2, price + spread / 2
+        swap_bid, swap_ask = spot_bid * (1 + premium), spot_ask * (1 + premium)
+        store.PremiumStore.get(coin).append(dict(
+            timestamp=timestamp, spot_bid=spot_bid, spot_ask=spot_ask, swap_bid=swap_bid, swap_ask=swap_ask,
+            open_pd=(swap_bid - spot_ask) / spot_ask, close_pd=(swap_ask - spot_bid) / spot_bid))
+        keep = rng.random(n) > 0.1
+        store.DepthStore.get(coin).append(dict(
+            timestamp=timestamp[keep], **{name: (rng.lognormal(0, 1, n) * 200 / price)[keep] for name in
+                                          ('spot_bid_sz', 'spot_ask_sz', 'swap_bid_sz', 'swap_ask_sz')}))
+
+
+def synthetic_funding(count: int, start: int, end: int, seed=0):
+    """每8小时一次资金费率
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(-(-start // 28_800_000) * 28_800_000, end + 1, 28_800_000, dtype=np.int64)
+    return dict(timestamp=np.broadcast_to(times, (count, len(times))).copy(),
+                funding=rng.normal(1e-4, 2e-4, (count, len(times))))
+
+
+def window_stat(timestamp, values, lo, hi, k, side):
+    mask = (timestamp > lo) & (timestamp <= hi)
+    if not mask.any():
+        return np.nan
+    return values[mask].mean() + side * k * values[mask].std(ddof=1) if mask.sum() > 1 else np.nan
+
+
+def sequential(row: dict, funding: dict, start: int, usdt_size, leverage, open_diff, close_diff, window, k,
+               accelerate_after, hold, lot, fee_rate):
+    """按AddPosition.add、ReducePosition.reduce逐采样判断、下单
+    """
+    valid = row['timestamp'] != PAD
+    ts = row['timestamp'][valid]
+    spot_bid, spot_ask, swap_bid, swap_ask = (row[n][valid] for n in ('spot_bid', 'spot_ask', 'swap_bid', 'swap_ask'))
+    sizes = {n: row[n][valid] for n in ('spot_bid_sz', 'spot_ask_sz', 'swap_bid_sz', 'swap_ask_sz')}
+    open_pd, close_pd = (swap_bid - spot_ask) / spot_ask, (swap_ask - spot_bid) / spot_bid
+    period = int(accelerate_after * 3600_000)
+
+    def threshold(t, since, price_diff, values, side):
+        if period and t > since + period:
+            j = (t - since - 1) // period
+            return window_stat(ts, values, since + (j - 1) * period, since + j * period, k, side)
+        if price_diff is None:
+            return window_stat(ts, values, since - int(window * 3600_000), since, k, side)
+        return price_diff
+
+    # 有lot时按手数计
+    unit = lot or 1.
+
+    def floor(x):
+        return np.floor(x / unit) if lot else x
+
+    target = None
+    opened = closed = 0.
+    open_time = close_time = 0
+    spot_notional = swap_notional = fee = 0.
+    holding = np.zeros(len(ts))
+    close_since = None
+    for i, t in enumerate(ts.tolist()):
+        holding[i] = (opened - closed) * unit
+        if t <= start:
+            continue
+        if target is None:
+            target = floor(usdt_size * leverage / (leverage + 1) / spot_ask[i])
+        if funding_settling(np.int64(t)):
+            continue
+        if opened < target:
+            if swap_bid[i] >= spot_ask[i] * (1 + threshold(t, start, open_diff, open_pd, 1)):
+                size = min(target - opened, floor(min(sizes['spot_ask_sz'][i], sizes['swap_bid_sz'][i])))
+                if size > 0:
+                    # 成交剩余全部时直接记为目标，避免舍入留下零头
+                    opened = target if size == target - opened else opened + size
+                    spot_notional -= size * unit * spot_ask[i]
+                    swap_notional += size * unit * swap_bid[i]
+                    fee -= fee_rate * size * unit * spot_ask[i]
+                    if opened >= target:
+                        open_time = t
+                        close_since = t + int(hold * 3600_000)
+        elif target > 0 and closed < opened and close_since is not None and t > close_since:
+            if swap_ask[i] <= spot_bid[i] * (1 + threshold(t, close_since, close_diff, close_pd, -1)):
+                size = min(opened - closed, floor(min(sizes['spot_bid_sz'][i], sizes['swap_ask_sz'][i])))
+                if size > 0:
+                    closed = opened if size == opened - closed else closed + size
+                    spot_notional += size * unit * spot_bid[i]
+                    swap_notional -= size * unit * swap_ask[i]
+                    fee -= fee_rate * size * unit * spot_bid[i]
+                    if closed >= opened:
+                        close_time = t
+        holding[i] = (opened - closed) * unit
+    income = 0.
+    for ft, rate in zip(funding['timestamp'].tolist(), funding['funding'].tolist()):
+        if ft != PAD and (i := int(np.searchsorted(ts, ft, 'right')) - 1) >= 0:
+            income += rate * holding[i] * swap_bid[i]
+    remaining = (opened - closed) * unit
+    unrealized = remaining * (spot_bid[-1] * (1 - fee_rate) - swap_ask[-1]) if remaining > 0 else 0.
+    pnl = spot_notional + swap_notional + fee + income + unrealized
+    return dict(target=(target or 0.) * unit, opened=opened * unit, open_time=open_time, closed=closed * unit,
+                close_time=close_time, spot_notional=spot_notional, swap_notional=swap_notional, fee=fee,
+                funding=income, unrealized=unrealized, rebalances=0, rebalance_cost=0., pnl=pnl,
+                rate=pnl / usdt_size)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    store.store_dir = tempfile.mkdtemp()
+    end = int(time.time() * 1000)
+    start = end - 48 * 3600_000
+    window = 4.
+    coins = [f'C{i:04d}' for i in range(count)]
+    synthetic_market(coins, start - int(window * 3600_000) - 60_000, end, interval)
+    funding = synthetic_funding(count, start, end)
+    lot = np.where(np.arange(count) % 2, 0., 0.01)
+    cases = [dict(open_diff=0.0005, close_diff=-0.0002),
+             dict(open_diff=None, close_diff=None, k=1.),
+             dict(open_diff=0.002, close_diff=None, accelerate_after=2., hold=1.)]
+
+    # 前20个币种与逐采样循环比较
+    history = asyncio.run(load_history(coins[:20], start - int(window * 3600_000), end))
+    part = {name: arr[:20] for name, arr in funding.items()}
+    for kwargs in cases:
+        params = {**dict(usdt_size=1000., leverage=2., open_diff=0.002, close_diff=0., window=window, k=2.,
+                         accelerate_after=0., hold=0., fee_rate=0.0015), **kwargs}
+        result = replay(history, part, start, lot=lot[:20], **params)
+        for i in range(20):
+            expected = sequential({n: arr[i] for n, arr in history.items()}, {n: arr[i] for n, arr in part.items()},
+                                  start, lot=lot[i], **params)
+            for name in REPLAY_FIELDS:
+                assert np.isclose(result[name][i], expected[name], rtol=1e-9, atol=1e-9), (kwargs, i, name)
+    loop = timeit.timeit(lambda: [sequential({n: arr[i] for n, arr in history.items()},
+                                             {n: arr[i] for n, arr in part.items()}, start, 1000., 2., None, None,
+                                             window, 2., 2., 0., lot[i], 0.0015) for i in range(20)], number=1)
+
+    def run(chunk=32):
+        results = []
+        for i in range(0, count, chunk):
+            history = asyncio.run(load_history(coins[i:i + chunk], start - int(window * 3600_000), end))
+            results.append(replay(history, {name: arr[i:i + chunk] for name, arr in funding.items()}, start,
+                                  open_diff=None, close_diff=None, window=window, accelerate_after=2.,
+                                  lot=lot[i:i + chunk]))
+        return results
+
+    vectorized = timeit.timeit(run, number=1)
+    rows = sum(len(store.PremiumStore.get(coin)) for coin in coins)
+    print(f'coins={count}  interval={interval}s  rows={rows}')
+    print(f'per-sample loop {loop / 20 * count:.1f} s (extrapolated from 20 coins)  vectorized {vectorized:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""波动率筛选：逐币种列表计算平均相对振幅与K线缓存加二维数组一次计算对比
+
+python -m benchmark.bench_candles [币种数] [天数]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+# 先导入record，避免与trading_data循环导入
+import src.record
+import src.store as store
+from src.trading_data import Stat, average_true_range, stacked_true_range
+from src.utils import *
+
+
+class FakePublicAPI:
+    """每次请求耗时latency秒，返回早于after的至多limit根4H K线，按时间倒序
+    """
+
+    def __init__(self, instIds: List[str], latency=0.05):
+        duration = 4 * 3600_000
+        now = int(time.time() * 1000) // duration * duration
+        self.latency = latency
+        self.requests = 0
+        self.candles = dict()
+        for instId in instIds:
+            # 只含已完结K线
+            timestamp = now - np.arange(1, 601) * duration
+            close = 100 * np.exp(np.cumsum(np.random.normal(0, 0.01, len(timestamp))))
+            high, low = close * 1.005, close * 0.995
+            self.candles[instId] = [[str(t), str(c), str(h), str(l), str(c), '0', '0', '0', '1']
+                                    for t, c, h, l in zip(timestamp.tolist(), close, high, low)]
+
+    async def get_history_candles(self, instId, after, bar, limit):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return [n for n in self.candles[instId] if int(n[0]) < int(after)][:int(limit)]
+
+    async def get_candles_for_days(self, instId, days, bar):
+        count = days * 6 + 1
+        candles = []
+        after = str(int(time.time() * 1000))
+        while len(candles) < count:
+            page = await self.get_history_candles(instId, after, bar, '100')
+            candles += page
+            after = page[-1][0]
+        return candles[:count]
+
+
+async def per_coin(api: FakePublicAPI, funding_rate_list, days):
+    """原先的方式：每次运行逐币种取K线，逐个转换数组计算
+    """
+    gather_result = await asyncio.gather(
+        *[api.get_candles_for_days(n['instrument'] + '-USDT', days, '4H') for n in funding_rate_list])
+    for n in range(len(funding_rate_list)):
+        atr = average_true_range(gather_result[n], days, '4H')
+        funding_rate_list[n]['profitability'] = int(funding_rate_list[n]['funding_rate'] / np.sqrt(atr) * 10000)
+    return funding_rate_list
+
+
+def main():
+    coins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    store.store_dir = tempfile.mkdtemp()
+    funding_rate_list = [dict(instrument=f'C{n:03d}', funding_rate=0.0003) for n in range(coins)]
+    api = FakePublicAPI([n['instrument'] + '-USDT' for n in funding_rate_list])
+    Stat.publicAPI = api
+    stat = Stat()
+    print(f"{'mode':14s}{'total ms':>10s}{'requests':>10s}")
+    coinlist = [n['instrument'] for n in funding_rate_list]
+    funding_rate = np.array([n['funding_rate'] for n in funding_rate_list])
+    for name, func in (('per coin', lambda: per_coin(api, [dict(n) for n in funding_rate_list], days)),
+                       ('cold cache', lambda: stat.profitability(coinlist, funding_rate, days)),
+                       ('warm cache', lambda: stat.profitability(coinlist, funding_rate, days))):
+        api.requests = 0
+        start = time.perf_counter()
+        result = asyncio.run(func())
+        print(f'{name:14s}{(time.perf_counter() - start) * 1000:10.0f}{api.requests:10d}')
+        if name == 'per coin':
+            expected = [n['profitability'] for n in result]
+        else:
+            assert result.tolist() == expected
+    # 只比较计算部分
+    count = days * 6 + 1
+    lists = [api.candles[n['instrument'] + '-USDT'][:count] for n in funding_rate_list]
+    number = 20
+    old = timeit.timeit(lambda: [average_true_range(n, days, '4H') for n in lists], number=number) / number
+    arr = np.asarray([[n[:5] for n in reversed(candles)] for candles in lists], dtype=np.float64)
+    new = timeit.timeit(lambda: np.mean(stacked_true_range(arr[..., 2], arr[..., 3], arr[..., 4]), axis=1),
+                        number=number) / number
+    print(f'ATR  per coin {old * 1000:.2f} ms  stacked {new * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
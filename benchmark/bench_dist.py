@@ -0,0 +1,107 @@
+"""期现差价分布：原先五次查询与一次取数组单次计算的对比，48小时窗口
+
+本地MongoDB可用时写入临时库OKEx_bench比较完整路径，否则只比较计算部分。
+python -m benchmark.bench_dist [采样间隔秒]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+import pymongo
+import src.store as store
+from src.record import Record
+from src.trading_data import Stat, stat_cache
+from src.utils import *
+
+
+async def five_queries(coin: str, hours=48):
+    """原先open_dist的四次聚合加gaussian_dist取全部文档
+    """
+    Ticker = Record('Ticker')
+    timestamp = datetime.utcnow() - timedelta(hours=hours)
+    pipeline = [{'$match': {'instrument': coin, 'timestamp': {'$gt': timestamp}}},
+                {'$group': {'_id': '$instrument', 'avg': {'$avg': '$open_pd'}, 'std': {'$stdDevSamp': '$open_pd'},
+                            'max': {'$max': '$open_pd'}, 'min': {'$min': '$open_pd'}, 'count': {'$sum': 1}}}]
+    result = (await Ticker.acol.aggregate(pipeline))[0]
+    avg, std, total = result['avg'], result['std'], result['count']
+    frequency = []
+    for k in (1, 2, 3):
+        pipeline = [{'$match': {'instrument': coin, 'timestamp': {'$gt': timestamp},
+                                'open_pd': {'$lt': avg + k * std, '$gt': avg - k * std}}},
+                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
+        frequency.append((await Ticker.acol.aggregate(pipeline))[0]['count'] / total)
+    pipeline = [{'$match': {'instrument': coin, 'timestamp': {'$gt': timestamp}}}]
+    arr = np.asarray([x['open_pd'] for x in await Ticker.acol.aggregate(pipeline)], dtype=float)
+    return avg, std, frequency, arr
+
+
+def multi_pass(arr: np.ndarray, bin_num=40):
+    """原先的计算方式：逐个标准差区间过滤，直方图逐区间累加
+    """
+    avg, std = arr.mean(), arr.std(ddof=1)
+    frequency = [np.count_nonzero((arr < avg + k * std) & (arr > avg - k * std)) / len(arr) for k in (1, 2, 3)]
+    low, high = np.min(arr), np.max(arr)
+    width = (high - low) / bin_num
+    binning = np.asarray((arr - low) // width, dtype=int)
+    prob = np.zeros(bin_num)
+    bins, counts = np.unique(binning, return_counts=True)
+    for n in range(len(bins)):
+        if bins[n] == bin_num:
+            prob[bin_num - 1] += counts[n]
+        else:
+            prob[bins[n]] = counts[n]
+    return avg, std, frequency, prob / np.sum(counts)
+
+
+def mongo_available():
+    client = pymongo.MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+        return True
+    except pymongo.errors.PyMongoError:
+        return False
+
+
+def main():
+    interval = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    hours = 48
+    now = int(time.time() * 1000)
+    timestamp = np.arange(now - hours * 3600_000 + interval * 1000, now, interval * 1000, dtype=np.int64)
+    open_pd = 0.001 + np.cumsum(np.random.normal(0, 1e-5, len(timestamp)))
+    stat = Stat('BTC')
+    number = 10
+    if mongo_available():
+        Record.myclient = pymongo.MongoClient('mongodb://localhost:27017/')
+        Record.mydb = Record.myclient['OKEx_bench']
+        # 空的列式存储，迫使Stat走Mongo
+        store.store_dir = tempfile.mkdtemp()
+        Record.myclient.drop_database('OKEx_bench')
+        try:
+            Record('Ticker').mycol.insert_many(
+                [dict(instrument='BTC', timestamp=utcfrommillisecs(t), open_pd=p, close_pd=p)
+                 for t, p in zip(timestamp.tolist(), open_pd.tolist())])
+            Record.ensure_indexes()
+            old = timeit.timeit(lambda: asyncio.run(five_queries('BTC', hours)), number=number) / number
+            new = timeit.timeit(lambda: (stat_cache.invalidate(), stat.premium_dist(hours)), number=number) / number
+            print(f'mongo  rows={len(timestamp)}  five queries {old * 1000:.1f} ms  one query {new * 1000:.1f} ms')
+        finally:
+            Record.myclient.drop_database('OKEx_bench')
+    else:
+        print('MongoDB unavailable, comparing computation only')
+    store.store_dir = tempfile.mkdtemp()
+    ones = np.ones(len(timestamp))
+    store.PremiumStore.get('BTC').append(dict(timestamp=timestamp, spot_bid=ones, spot_ask=ones, swap_bid=ones,
+                                              swap_ask=ones, open_pd=open_pd, close_pd=open_pd))
+    dist = stat.premium_dist(hours - 1)
+    arr = stat.store_window(hours - 1, ('open_pd',))['open_pd']
+    avg, std, frequency, prob = multi_pass(arr)
+    assert np.isclose(dist['avg'], avg) and np.isclose(dist['std'], std)
+    assert np.allclose([dist['frequency1'], dist['frequency2'], dist['frequency3']], frequency)
+    assert np.allclose(dist['prob'], prob)
+    old = timeit.timeit(lambda: multi_pass(np.array(arr)), number=number) / number
+    new = timeit.timeit(lambda: (stat_cache.invalidate(), stat.premium_dist(hours - 1)), number=number) / number
+    print(f'store  rows={len(arr)}  multi-pass {old * 1000:.2f} ms  single call {new * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
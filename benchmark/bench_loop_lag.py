@@ -0,0 +1,74 @@
+"""同步pymongo与线程池异步Record对事件循环延迟的影响
+
+本地MongoDB可用时查询真实数据库，否则用每次耗时latency秒的模拟集合。
+python -m benchmark.bench_loop_lag [协程数] [秒数]
+"""
+import sys
+import pymongo
+from src.record import AsyncCollection, Record
+from src.utils import *
+
+
+class SlowCollection:
+    """模拟一次往返耗时latency秒的集合
+    """
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+
+    def aggregate(self, pipeline, **kwargs):
+        time.sleep(self.latency)
+        return iter([])
+
+    def insert_one(self, document, **kwargs):
+        time.sleep(self.latency)
+
+
+def collection():
+    client = pymongo.MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError:
+        print('MongoDB unavailable, using simulated 5 ms collection')
+        return SlowCollection()
+    return client['OKEx']['Ledger']
+
+
+async def worker(col, use_executor: bool, deadline: float):
+    """模拟监控协程：反复查询账本
+    """
+    acol = AsyncCollection(col, Record.executor)
+    pipeline = [{'$match': {'account': 1, 'instrument': 'BTC'}},
+                {'$group': {'_id': '$instrument', 'sum': {'$sum': '$funding'}}}]
+    count = 0
+    while time.monotonic() < deadline:
+        if use_executor:
+            await acol.aggregate(pipeline)
+        else:
+            list(col.aggregate(pipeline))
+        count += 1
+        await asyncio.sleep(0)
+    return count
+
+
+async def measure(col, use_executor: bool, ncoro: int, seconds: float):
+    lag = LoopLag(0.005).start()
+    deadline = time.monotonic() + seconds
+    counts = await asyncio.gather(*[worker(col, use_executor, deadline) for _ in range(ncoro)])
+    lag.stop()
+    return sum(counts), lag
+
+
+def main():
+    ncoro = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    col = collection()
+    loop = asyncio.get_event_loop()
+    print(f"{'mode':10s}{'queries':>9s}{'mean lag ms':>13s}{'max lag ms':>12s}")
+    for mode, use_executor in (('sync', False), ('executor', True)):
+        queries, lag = loop.run_until_complete(measure(col, use_executor, ncoro, seconds))
+        print(f'{mode:10s}{queries:9d}{lag.mean * 1000:13.3f}{lag.max * 1000:12.3f}')
+
+
+if __name__ == '__main__':
+    main()
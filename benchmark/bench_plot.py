@@ -0,0 +1,72 @@
+"""绘图对事件循环的影响：进程内pyplot与绘图进程Agg输出文件对比，48小时采样
+
+python -m benchmark.bench_plot [采样间隔秒]
+"""
+import os
+import sys
+import tempfile
+import matplotlib
+import numpy as np
+# 先导入record，避免与trading_data循环导入
+import src.record
+import src.store as store
+import src.trading_data as trading_data
+from src.trading_data import Stat
+from src.utils import *
+from benchmark.bench_rollup import synthetic_premium
+
+
+def inline_plot(data: dict, path: str):
+    """原先的方式：在事件循环所在线程用pyplot画图，此处以savefig代替show
+    """
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(16, 8))
+    timestamp = data['timestamp'].astype('datetime64[ms]')
+    plt.plot(timestamp, data['open_pd'], '.', color='g')
+    plt.plot(timestamp, data['close_pd'], '.', color='r')
+    plt.savefig(path)
+    plt.close()
+
+
+async def measure(coro_func):
+    lag = LoopLag(interval=0.01).start()
+    start = time.perf_counter()
+    await coro_func()
+    elapsed = time.perf_counter() - start
+    # 让到期的测量回调执行
+    await asyncio.sleep(0.05)
+    lag.stop()
+    return elapsed, lag.max
+
+
+async def run(hours: int):
+    stat = Stat('BTC')
+    data = {name: np.array(arr) for name, arr in (await stat.recent_arrays(hours)).items()}
+    # 预热绘图进程
+    await stat.gaussian_dist(1, 'o')
+    path = os.path.join(trading_data.plot_dir, 'inline.png')
+    elapsed, lag = await measure(lambda: asyncio.sleep(0, inline_plot(data, path)))
+    print(f"{'inline pyplot':16s}{elapsed * 1000:10.0f}{lag * 1000:12.0f}")
+    elapsed, lag = await measure(lambda: asyncio.gather(stat.plot(hours), stat.gaussian_dist(hours, 'o'),
+                                                        stat.gaussian_dist(hours, 'c')))
+    print(f"{'worker process':16s}{elapsed * 1000:10.0f}{lag * 1000:12.0f}")
+
+
+def main():
+    interval = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    hours = 48
+    store.store_dir = tempfile.mkdtemp()
+    trading_data.plot_dir = tempfile.mkdtemp()
+    raw = synthetic_premium(2, interval)
+    store.PremiumStore.get('BTC').append(raw)
+    store.append_premium({'instrument': ['BTC'], **{name: arr[-1:] + 0 for name, arr in raw.items()},
+                          'timestamp': raw['timestamp'][-1:] + interval * 1000})
+    print(f"points={len(raw['timestamp'])}")
+    print(f"{'mode':16s}{'total ms':>10s}{'max lag ms':>12s}")
+    asyncio.run(run(hours - 1))
+    print(f'output: {trading_data.plot_dir}')
+
+
+if __name__ == '__main__':
+    main()
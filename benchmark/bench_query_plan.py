@@ -0,0 +1,139 @@
+"""Stat与menu查询的执行计划检查及耗时，出现COLLSCAN时以非零状态退出
+
+需要本地MongoDB，数据写入临时库OKEx_bench，结束后删除。
+python -m benchmark.bench_query_plan [币种数] [小时数]
+"""
+import random
+import sys
+import tempfile
+import timeit
+import pymongo
+from pymongo import monitoring
+import src.store as store
+from src.record import Record
+from src.trading_data import Stat
+from src.utils import *
+
+
+class AggregateListener(monitoring.CommandListener):
+    """记录发出的aggregate命令
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name == 'aggregate':
+            self.commands.append(dict(event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(ncoins: int, hours: int, account=1):
+    """写入模拟行情、资金费和账本
+    """
+    now = datetime.utcnow()
+    coins = [f'C{i:03d}' for i in range(ncoins)]
+    for coin in coins:
+        docs = []
+        for i in range(hours * 360):
+            open_pd = random.gauss(0.001, 0.0005)
+            docs.append(dict(instrument=coin, timestamp=now - timedelta(seconds=10 * i), spot_bid=1., spot_ask=1.,
+                             swap_bid=1., swap_ask=1., open_pd=open_pd, close_pd=open_pd - 0.0005))
+        Record('Ticker').mycol.insert_many(docs)
+        Record('Funding').mycol.insert_many(
+            [dict(instrument=coin, timestamp=now - timedelta(hours=8 * i), funding=0.0001) for i in range(270)])
+        Record('Ledger').mycol.insert_many(
+            [dict(account=account, instrument=coin, timestamp=now - timedelta(days=30), title='开仓')] +
+            [dict(account=account, instrument=coin, timestamp=now - timedelta(hours=8 * i), title='资金费',
+                  funding=0.1) for i in range(90)])
+    return coins
+
+
+def winning_plans(explain: dict):
+    """递归取出全部winningPlan
+    """
+    for key, value in explain.items():
+        if key == 'winningPlan':
+            yield value
+        elif isinstance(value, dict):
+            yield from winning_plans(value)
+        elif isinstance(value, list):
+            for n in value:
+                if isinstance(n, dict):
+                    yield from winning_plans(n)
+
+
+def stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for n in plan:
+            yield from stages(n)
+
+
+def main():
+    ncoins = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    hours = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+    account = 1
+    listener = AggregateListener()
+    Record.myclient = pymongo.MongoClient('mongodb://localhost:27017/', event_listeners=[listener])
+    Record.mydb = Record.myclient['OKEx_bench']
+    # 空的列式存储，迫使Stat走Mongo查询
+    store.store_dir = tempfile.mkdtemp()
+    Record.myclient.drop_database('OKEx_bench')
+    try:
+        coins = seed(ncoins, hours)
+        Record.ensure_indexes()
+        stat = Stat(coins[0])
+        queries = dict(
+            recent_open_stat=lambda: stat.recent_open_stat(4),
+            recent_close_stat=lambda: stat.recent_close_stat(4),
+            recent_ticker=lambda: stat.recent_ticker(4),
+            open_dist=lambda: stat.open_dist(4),
+            close_dist=lambda: stat.close_dist(4),
+            open_time=lambda: stat.open_time(account),
+            close_time=lambda: stat.close_time(account),
+            history_funding=lambda: stat.history_funding(account),
+            history_cost=lambda: stat.history_cost(account, 7),
+            # menu.get_coinlist, history_profit, cumulative_profit
+            coinlist=lambda: list(Record('Ledger').mycol.aggregate(
+                [{'$match': {'account': account}}, {'$group': {'_id': '$instrument'}}])),
+            # menu.back_track_all
+            db_ledger=lambda: list(Record('Ledger').mycol.aggregate(
+                [{'$match': {'account': account, 'instrument': coins[0], 'title': '资金费'}}])),
+            # record.record_funding
+            db_funding=lambda: list(Record('Funding').mycol.aggregate(
+                [{'$match': {'instrument': coins[0]}}])),
+        )
+        failed = []
+        print(f"{'query':20s}{'ms':>9s}  plan")
+        for name, query in queries.items():
+            listener.commands.clear()
+            elapsed = timeit.timeit(query, number=5) / 5
+            plans = set()
+            for command in listener.commands[:len(listener.commands) // 5]:
+                explain = Record.mydb.command('explain', dict(aggregate=command['aggregate'],
+                                                              pipeline=command['pipeline'], cursor={}),
+                                              verbosity='queryPlanner')
+                for plan in winning_plans(explain):
+                    plans.update(stages(plan))
+            if 'COLLSCAN' in plans:
+                failed.append(name)
+            print(f"{name:20s}{elapsed * 1000:9.3f}  {','.join(sorted(plans))}")
+    finally:
+        Record.myclient.drop_database('OKEx_bench')
+    if failed:
+        print('COLLSCAN:', ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""资金费筛选排序：字典列表全排序逐个格式化与结构化数组argpartition取前k行对比
+
+python -m benchmark.bench_ranking [币种数] [前k]
+"""
+import sys
+import timeit
+import numpy as np
+from src.ranking import format_rows, ranking_table, top_k
+from src.utils import *
+
+TEMPLATE = '{:9s}{:7.3%}{:8.2%}{:8.3%}{:8.3%}{:8.3%}'
+FIELDS = ('instrument', 'funding_rate', 'apr', 'open_pd', 'close_pd', 'carry')
+
+
+def per_dict(coins, funding_rate, open_pd, close_pd, days, k):
+    """原先的方式：逐币种建字典，全排序后逐个格式化
+    """
+    carry_list = []
+    for coin, rate, o, c in zip(coins, funding_rate.tolist(), open_pd.tolist(), close_pd.tolist()):
+        carry_list.append(dict(instrument=coin, funding_rate=rate, open_pd=o, close_pd=c,
+                               carry=rate * 3 * days + o - c - 0.003))
+    carry_list.sort(key=lambda x: x['carry'], reverse=True)
+    return [f"{n['instrument']:9s}{n['funding_rate']:7.3%}{n['funding_rate'] * 3 * 365:8.2%}"
+            f"{n['open_pd']:8.3%}{n['close_pd']:8.3%}{n['carry']:8.3%}" for n in carry_list[:k]]
+
+
+def vectorized(coins, funding_rate, open_pd, close_pd, days, k):
+    table = ranking_table(coins, funding_rate=funding_rate, apr=funding_rate * 3 * 365, open_pd=open_pd,
+                          close_pd=close_pd, carry=funding_rate * 3 * days + open_pd - close_pd - 0.003)
+    return format_rows(top_k(table, 'carry', k), FIELDS, TEMPLATE)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    rng = np.random.default_rng(0)
+    coins = [f'C{i:04d}' for i in range(count)]
+    args = (coins, rng.normal(1e-4, 2e-4, count), rng.normal(5e-4, 5e-4, count), rng.normal(-5e-4, 5e-4, count), 7, k)
+    assert per_dict(*args) == vectorized(*args)
+    number = 200
+    old = timeit.timeit(lambda: per_dict(*args), number=number) / number
+    new = timeit.timeit(lambda: vectorized(*args), number=number) / number
+    print(f'coins={count}  top {k}')
+    print(f'dicts + sort {old * 1000:.3f} ms  structured array + argpartition {new * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""REST限速：全市场筛选排队时下单的等待时间，以及两个进程共用一个令牌桶时的总速率
+
+python -m benchmark.bench_ratelimit [每秒请求数]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import src.ratelimit as ratelimit
+from src.ratelimit import HIGH, LOW, BucketTable, RateLimited, RateLimiter
+from src.utils import *
+
+
+class FakeAPI:
+    async def get_funding_history(self, instId):
+        return instId
+
+    async def take_swap_order(self, instId):
+        return instId
+
+
+def setup(path: str, rate: int):
+    """两个方法共用一个每秒rate次的桶，状态写入path
+    """
+    RateLimiter.table = BucketTable(path)
+    RateLimiter.buckets.clear()
+    ratelimit.ENDPOINTS['get_funding_history'] = ratelimit.ENDPOINTS['take_swap_order'] = ('bench', rate, 1)
+
+
+async def fan_out(rate: int):
+    """先提交3秒的筛选请求，0.5秒后下单
+    """
+    screen, trade = RateLimited(FakeAPI(), LOW), RateLimited(FakeAPI(), HIGH)
+    screening = [asyncio.create_task(screen.get_funding_history(str(i))) for i in range(3 * rate)]
+    await asyncio.sleep(0.5)
+    waits = []
+    for i in range(5):
+        start = time.monotonic()
+        await trade.take_swap_order(str(i))
+        waits.append(time.monotonic() - start)
+        await asyncio.sleep(0.1)
+    await asyncio.gather(*screening)
+    return waits
+
+
+def worker(path: str, rate: int, count: int):
+    setup(path, rate)
+    api = RateLimited(FakeAPI(), HIGH)
+
+    async def run():
+        await asyncio.gather(*[api.get_funding_history(str(i)) for i in range(count)])
+
+    asyncio.run(run())
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    path = os.path.join(tempfile.mkdtemp(), 'ratelimit')
+
+    setup(path, rate)
+    waits = asyncio.run(fan_out(rate))
+    metrics = RateLimiter.metrics()['live/bench']
+    print(f"screening {3 * rate} requests  mean wait {metrics['mean_wait']:.2f} s  max {metrics['max_wait']:.2f} s")
+    print(f'orders queued behind it wait at most {max(waits) * 1000:.1f} ms')
+
+    # 两个进程各请求2秒的量，共享时约4秒完成
+    context = multiprocessing.get_context('spawn')
+    start = time.monotonic()
+    processes = [context.Process(target=worker, args=(path, rate, 2 * rate)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.monotonic() - start
+    print(f'2 processes x {2 * rate} requests in {elapsed:.2f} s, {4 * rate / elapsed:.0f}/s with a limit of {rate}/s')
+
+
+if __name__ == '__main__':
+    main()
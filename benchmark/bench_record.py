@@ -0,0 +1,79 @@
+"""行情拼接基准测试
+
+python -m benchmark.bench_record
+"""
+import random
+import timeit
+from src.record import TICKER_FIELDS, join_tickers, ticker_docs
+from src.utils import *
+
+
+def synthetic_tickers(n: int):
+    """生成n个币种的现货与合约行情，顺序打乱
+    """
+    ts = str(int(time.time() * 1000))
+    instrumentsID, spot_ticker, swap_ticker = [], [], []
+    for i in range(n):
+        coin = f'C{i:04d}'
+        price = random.uniform(0.01, 1000)
+        instrumentsID.append(f'{coin}-USDT-SWAP')
+        spot_ticker.append(dict(instId=f'{coin}-USDT', ts=ts, bidPx=f'{price * 0.999:.6f}', askPx=f'{price:.6f}',
+                                bidSz='10', askSz='12'))
+        swap_ticker.append(dict(instId=f'{coin}-USDT-SWAP', ts=ts, bidPx=f'{price * 1.001:.6f}',
+                                askPx=f'{price * 1.002:.6f}', bidSz='30', askSz='25'))
+    # 交易所返回的现货多于合约
+    spot_ticker += [dict(instId=f'S{i:04d}-USDT', ts=ts, bidPx='1', askPx='1', bidSz='1', askSz='1')
+                    for i in range(2 * n)]
+    random.shuffle(spot_ticker)
+    random.shuffle(swap_ticker)
+    return instrumentsID, spot_ticker, swap_ticker
+
+
+def linear_scan(instrumentsID, spot_ticker, swap_ticker):
+    """原先逐个扫描并pop的实现
+    """
+    spot_ticker, swap_ticker = spot_ticker.copy(), swap_ticker.copy()
+    mylist = []
+    for swap_ID in instrumentsID:
+        spot_ID = swap_ID[:swap_ID.find('-SWAP')]
+        coin = spot_ID[:spot_ID.find('-USDT')]
+        spot_ask = spot_bid = swap_bid = swap_ask = 0.
+        timestamp = None
+        for i, n in enumerate(spot_ticker):
+            if n['instId'] == spot_ID:
+                timestamp = utcfrommillisecs(n['ts'])
+                spot_ask = safe_float(n['askPx'])
+                spot_bid = safe_float(n['bidPx'])
+                spot_ticker.pop(i)
+                break
+        for i, n in enumerate(swap_ticker):
+            if n['instId'] == swap_ID:
+                swap_ask = safe_float(n['askPx'])
+                swap_bid = safe_float(n['bidPx'])
+                swap_ticker.pop(i)
+                break
+        if spot_ask and spot_bid:
+            open_pd = (swap_bid - spot_ask) / spot_ask
+            close_pd = (swap_ask - spot_bid) / spot_bid
+        else:
+            continue
+        mylist.append({'instrument': coin, "timestamp": timestamp, 'spot_bid': spot_bid, 'spot_ask': spot_ask,
+                       'swap_bid': swap_bid, 'swap_ask': swap_ask, 'open_pd': open_pd, 'close_pd': close_pd})
+    return mylist
+
+
+def main():
+    print(f"{'N':>6s}{'scan ms':>10s}{'index ms':>10s}{'speedup':>9s}")
+    for n in (100, 300, 600, 1200):
+        args = synthetic_tickers(n)
+        docs = ticker_docs(join_tickers(*args))
+        # 原先的文档不含挂单量
+        assert [{key: n[key] for key in ('instrument',) + TICKER_FIELDS} for n in docs] == linear_scan(*args)
+        number = 20
+        scan = timeit.timeit(lambda: linear_scan(*args), number=number) / number
+        index = timeit.timeit(lambda: ticker_docs(join_tickers(*args)), number=number) / number
+        print(f'{n:6d}{scan * 1000:10.3f}{index * 1000:10.3f}{scan / index:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
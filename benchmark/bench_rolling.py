@@ -0,0 +1,41 @@
+"""滚动统计与整窗重算对比：每追加一批采样后查询一次
+
+python -m benchmark.bench_rolling [窗口小时数] [每批条数]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+import src.store as store
+from src.rolling import PremiumRollingStat
+from src.utils import *
+from benchmark.bench_rollup import synthetic_premium
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    store.store_dir = tempfile.mkdtemp()
+    raw = synthetic_premium(1, 1)
+    premium = store.PremiumStore.get('BTC')
+    n = len(raw['timestamp']) // 2
+    premium.append({name: arr[:n] for name, arr in raw.items()})
+    rolling = PremiumRollingStat.get('BTC', 'open_pd', hours)
+    rolling.update(int(raw['timestamp'][n - 1]))
+    recompute = incremental = 0.
+    steps = 200
+    for i in range(n, n + steps * batch, batch):
+        premium.append({name: arr[i:i + batch] for name, arr in raw.items()})
+        now = int(raw['timestamp'][i + batch - 1])
+        start = now - int(hours * 3600_000)
+        recompute += timeit.timeit(lambda: store.rollup_stat('BTC', 'open_pd', start, now), number=1)
+        incremental += timeit.timeit(lambda: rolling.update(now), number=1)
+        expected, result = store.rollup_stat('BTC', 'open_pd', start, now), rolling.update(now)
+        for key in ('avg', 'std', 'max', 'min', 'count'):
+            assert np.isclose(result[key], expected[key], rtol=1e-7, atol=1e-12), key
+    print(f"{'hours':>6s}{'batch':>7s}{'recompute us':>14s}{'rolling us':>12s}")
+    print(f'{hours:6g}{batch:7d}{recompute / steps * 1e6:14.1f}{incremental / steps * 1e6:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""多级汇总与原始数据的窗口统计对比
+
+python -m benchmark.bench_rollup [天数] [采样间隔秒]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+import src.store as store
+from src.utils import *
+
+
+def synthetic_premium(days: int, interval=10):
+    """生成days天、每interval秒一条的期现差价
+    """
+    end = int(time.time() * 1000) // 1000 * 1000
+    timestamp = np.arange(end - days * 86400_000, end, interval * 1000, dtype=np.int64)
+    open_pd = 0.001 + np.cumsum(np.random.normal(0, 1e-5, len(timestamp)))
+    close_pd = open_pd - 0.0005 + np.random.normal(0, 1e-5, len(timestamp))
+    ones = np.ones(len(timestamp))
+    return dict(timestamp=timestamp, spot_bid=ones, spot_ask=ones, swap_bid=ones, swap_ask=ones, open_pd=open_pd,
+                close_pd=close_pd)
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    store.store_dir = tempfile.mkdtemp()
+    raw = synthetic_premium(days, interval)
+    coin = 'BTC'
+    # 大部分直接写入原始数据，由seed补齐汇总，最后一小时逐条写入
+    split = len(raw['timestamp']) - 3600 // interval
+    store.PremiumStore.get(coin).append({name: arr[:split] for name, arr in raw.items()})
+    for i in range(split, len(raw['timestamp'])):
+        store.append_premium({'instrument': [coin], **{name: arr[i:i + 1] for name, arr in raw.items()}})
+    end = int(raw['timestamp'][-1])
+    print(f"{'hours':>6s}{'raw ms':>10s}{'rollup ms':>11s}{'count':>8s}")
+    for hours in (1, 4, 24, 24 * days - 1):
+        start = end - hours * 3600_000 - 12_345
+        for field in store.RollupStore.fields:
+            expected = store.raw_stat(coin, field, start)
+            result = store.rollup_stat(coin, field, start)
+            for key, value in expected.items():
+                assert np.isclose(result[key], value, rtol=1e-9, atol=1e-12), (hours, field, key)
+        number = 20
+        elapsed = timeit.timeit(lambda: store.raw_stat(coin, 'open_pd', start), number=number) / number
+        rollup = timeit.timeit(lambda: store.rollup_stat(coin, 'open_pd', start), number=number) / number
+        print(f'{hours:6d}{elapsed * 1000:10.3f}{rollup * 1000:11.3f}{expected["count"]:8d}')
+
+
+if __name__ == '__main__':
+    main()
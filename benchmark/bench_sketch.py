@@ -0,0 +1,38 @@
+"""分位数摘要与原始数据精确分位数对比：秩误差及耗时
+
+python -m benchmark.bench_sketch [天数] [采样间隔秒]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+import src.store as store
+from src.utils import *
+from benchmark.bench_rollup import synthetic_premium
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    store.store_dir = tempfile.mkdtemp()
+    raw = synthetic_premium(days, interval)
+    # 厚尾
+    raw['open_pd'] = raw['open_pd'] + np.random.standard_t(3, len(raw['timestamp'])) * 5e-5
+    store.PremiumStore.get('BTC').append(raw)
+    store.SketchStore.get('BTC').update(int(raw['timestamp'][-1]))
+    end = int(raw['timestamp'][-1])
+    qs = np.array([0.0013, 0.0228, 0.1587, 0.5, 0.8413, 0.9772, 0.9987])
+    print(f"{'hours':>6s}{'count':>9s}{'max rank err':>14s}{'exact ms':>10s}{'sketch ms':>11s}")
+    for hours in (1, 4, 24, 24 * days - 1):
+        start = end - hours * 3600_000 - 12_345
+        arr = store.PremiumStore.get('BTC').window(start, columns=('open_pd',))['open_pd']
+        result = store.sketch_quantile('BTC', 'open_pd', qs, start)
+        error = np.abs(np.searchsorted(np.sort(arr), result) / len(arr) - qs).max()
+        number = 10
+        exact = timeit.timeit(lambda: np.quantile(arr, qs), number=number) / number
+        sketch = timeit.timeit(lambda: store.sketch_quantile('BTC', 'open_pd', qs, start), number=number) / number
+        print(f'{hours:6d}{len(arr):9d}{error:14.4%}{exact * 1000:10.2f}{sketch * 1000:11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""参数扫描：单进程逐组合重放与进程池内存映射的对比，48小时窗口
+
+python -m benchmark.bench_sweep [币种数] [进程数]
+"""
+import os
+import sys
+import tempfile
+import timeit
+import numpy as np
+# 先导入record，避免与trading_data循环导入
+import src.record
+import src.store as store
+import src.sweep as sweep
+from src.backtest import load_history, replay
+from src.utils import *
+from benchmark.bench_backtest import synthetic_market, synthetic_funding
+
+
+def run(coins, funding, start, lookback, end, combos, fixed, chunk, workers):
+    """按sweep的方式分批保存、提交，返回(币种数, 组合数)的rate
+    """
+    path = tempfile.mkdtemp(dir=store.store_dir)
+    history = asyncio.run(load_history(coins, start - lookback, end))
+    sweep.save_history(history, path)
+    rate = np.empty((len(coins), len(combos)))
+    with sweep.executor(workers) as pool:
+        futures = [pool.submit(sweep.sweep_rows, path, 0, (j, min(j + chunk, len(coins))),
+                               {name: arr[j:j + chunk] for name, arr in funding.items()}, dict(), start, combos,
+                               fixed)
+                   for j in range(0, len(coins), chunk)]
+        for future in futures:
+            (i, j), result = future.result()
+            rate[i:j] = result['rate']
+    return rate
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    store.store_dir = tempfile.mkdtemp()
+    end = int(time.time() * 1000)
+    start = end - 48 * 3600_000
+    grid = dict(k=(1., 2., 3.), window=(2., 4.), accelerate_after=(0., 2.), leverage=(2., 3.), band=(1.,))
+    combos = sweep.expand(grid)
+    lookback = 4 * 3600_000
+    coins = [f'C{i:04d}' for i in range(count)]
+    synthetic_market(coins, start - lookback - 60_000, end, 10)
+    funding = synthetic_funding(count, start, end)
+    fixed = dict(open_diff=None, close_diff=None)
+
+    # 与直接重放比较
+    history = asyncio.run(load_history(coins, start - lookback, end))
+    expected = np.stack([replay(history, funding, start, **{**fixed, **params})['rate'] for params in combos], axis=1)
+    rate = run(coins, funding, start, lookback, end, combos, fixed, 4, 2)
+    assert np.allclose(rate, expected, equal_nan=True)
+
+    single = timeit.timeit(lambda: run(coins, funding, start, lookback, end, combos, fixed, 4, 1), number=1)
+    pool = timeit.timeit(lambda: run(coins, funding, start, lookback, end, combos, fixed, 4, workers), number=1)
+    print(f'coins={count}  combos={len(combos)}  workers={workers}')
+    print(f'1 process {single:.2f} s  {workers} processes {pool:.2f} s  speedup {single / pool:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""全市场期现差价统计：逐币种逐列rollup_stat与universe_stat一次遍历对比
+
+python -m benchmark.bench_universe [币种数] [窗口小时数]
+"""
+import sys
+import tempfile
+import timeit
+import numpy as np
+import src.store as store
+from src.utils import *
+from benchmark.bench_rollup import synthetic_premium
+
+
+def per_coin(start: int):
+    """原先每个币种每列一次统计
+    """
+    return {coin: {field: store.rollup_stat(coin, field, start) for field in store.RollupStore.fields}
+            for coin in store.PremiumStore.instruments()}
+
+
+def main():
+    coins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 4
+    store.store_dir = tempfile.mkdtemp()
+    raw = synthetic_premium(1, 10)
+    for n in range(coins):
+        store.PremiumStore.get(f'C{n:03d}').append(raw)
+    start = int(raw['timestamp'][-1]) - int(hours * 3600_000)
+    expected, result = per_coin(start), store.universe_stat(start)
+    for coin, stat in expected.items():
+        for field, value in stat.items():
+            for key in ('avg', 'std', 'max', 'min', 'count'):
+                assert np.isclose(result[coin][field][key], value[key], rtol=1e-9), (coin, field, key)
+    number = 5
+    old = timeit.timeit(lambda: per_coin(start), number=number) / number
+    new = timeit.timeit(lambda: store.universe_stat(start), number=number) / number
+    print(f'coins={coins}  hours={hours:g}  per coin {old * 1000:.1f} ms  universe {new * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
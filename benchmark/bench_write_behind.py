@@ -0,0 +1,84 @@
+"""行情写入：同步insert_many与后台批量写入对采样间隔的影响
+
+用每批耗时latency秒的模拟集合，采样间隔interval秒。
+python -m benchmark.bench_write_behind [采样次数]
+"""
+import sys
+import tempfile
+import numpy as np
+import pymongo
+import src.record as record
+from src.record import AsyncCollection, Record, WriteBehind
+from src.utils import *
+
+
+class SlowCollection:
+    """insert_many耗时固定latency秒加每条per_doc秒，down时抛出异常
+    """
+
+    def __init__(self, latency=0.05, per_doc=2e-5):
+        self.latency = latency
+        self.per_doc = per_doc
+        self.down = False
+        self.count = 0
+
+    def insert_many(self, documents, ordered=True):
+        time.sleep(self.latency + self.per_doc * len(documents))
+        if self.down:
+            raise pymongo.errors.ServerSelectionTimeoutError('simulated')
+        self.count += len(documents)
+
+
+def documents(n=300):
+    return [dict(instrument=f'C{i:03d}', timestamp=datetime.utcnow(), open_pd=0.001) for i in range(n)]
+
+
+async def sample(col, samples: int, interval: float, writer: Optional[WriteBehind]):
+    """按间隔采样写入，返回实际间隔
+    """
+    stamps = []
+    looper = Looper(interval=interval)
+    async for _ in looper:
+        stamps.append(time.monotonic())
+        if writer:
+            await writer.put(documents())
+        else:
+            col.insert_many(documents())
+        if len(stamps) == samples:
+            break
+    return np.diff(stamps)
+
+
+async def measure(samples: int, interval=0.05):
+    print(f"{'mode':14s}{'mean ms':>9s}{'max ms':>9s}{'stored':>8s}  counters")
+    col = SlowCollection()
+    gaps = await sample(col, samples, interval, None)
+    print(f"{'inline':14s}{gaps.mean() * 1000:9.1f}{gaps.max() * 1000:9.1f}{col.count:8d}")
+
+    col = SlowCollection()
+    writer = WriteBehind(AsyncCollection(col, Record.executor), 'bench', batch=3000, age=0.2).start()
+    gaps = await sample(col, samples, interval, writer)
+    await writer.close()
+    print(f"{'write-behind':14s}{gaps.mean() * 1000:9.1f}{gaps.max() * 1000:9.1f}{col.count:8d}  {writer.stats()}")
+
+    # 数据库不可用期间缓存满后溢出到磁盘，恢复后读回
+    col = SlowCollection()
+    col.down = True
+    writer = WriteBehind(AsyncCollection(col, Record.executor), 'bench', batch=3000, age=0.2, buffer=3000,
+                         block=0.01).start()
+    gaps = await sample(col, samples, interval, writer)
+    col.down = False
+    while writer.depth or writer.spill_files():
+        await asyncio.sleep(0.1)
+    await writer.close()
+    print(f"{'outage':14s}{gaps.mean() * 1000:9.1f}{gaps.max() * 1000:9.1f}{col.count:8d}  {writer.stats()}")
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    record.store_dir = tempfile.mkdtemp()
+    asyncio.run(measure(samples))
+
+
+if __name__ == '__main__':
+    main()
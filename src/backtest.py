@@ -0,0 +1,456 @@
+import sys
+import src.record as record
+from src.config import threshold_mode, trade_fee
+from src.instruments import InstrumentRegistry
+from src.store import DepthStore, PremiumStore
+from src.trading_data import normal_cdf
+from src.utils import *
+from src.lang import *
+import numpy as np
+
+PRICE_FIELDS = ('spot_bid', 'spot_ask', 'swap_bid', 'swap_ask')
+SIZE_FIELDS = ('spot_bid_sz', 'spot_ask_sz', 'swap_bid_sz', 'swap_ask_sz')
+# 行末补齐的时间戳
+PAD = np.iinfo(np.int64).max
+FUNDING_PERIOD = 8 * 3600_000
+# replay返回的各项
+REPLAY_FIELDS = ('target', 'opened', 'open_time', 'closed', 'close_time', 'spot_notional', 'swap_notional', 'fee',
+                 'funding', 'unrealized', 'rebalances', 'rebalance_cost', 'pnl', 'rate')
+
+
+def funding_settling(timestamp: np.ndarray) -> np.ndarray:
+    """同OKExAPI.funding_settling，资金费结算前后30秒内不下单
+
+    :param timestamp: 毫秒
+    """
+    t = timestamp % FUNDING_PERIOD
+    return (t >= FUNDING_PERIOD - 29_000) | (t < 30_000)
+
+
+def row_searchsorted(timestamp: np.ndarray, values: np.ndarray, side='left') -> np.ndarray:
+    """每行各自二分查找
+
+    :param timestamp: (n, T)，每行递增
+    :param values: (n,)或(n, m)
+    """
+    return np.stack([np.searchsorted(row, v, side) for row, v in zip(timestamp, values)])
+
+
+def stack_rows(rows: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """各币种行情按行堆叠，末尾补齐：timestamp补int64最大值，价格补NaN，挂单量补0
+    """
+    length = max((len(n['timestamp']) for n in rows), default=0)
+    stacked = dict(timestamp=np.full((len(rows), length), PAD, dtype=np.int64))
+    stacked.update({name: np.full((len(rows), length), np.nan) for name in PRICE_FIELDS})
+    stacked.update({name: np.zeros((len(rows), length)) for name in SIZE_FIELDS})
+    for i, n in enumerate(rows):
+        for name, arr in stacked.items():
+            arr[i, :len(n['timestamp'])] = n[name]
+    return stacked
+
+
+def store_rows(coin: str, start: int, end: int) -> Dict[str, np.ndarray]:
+    """列式存储(start, end]内的行情，按时间戳对齐挂单量，没有挂单量的行视为无限
+    """
+    rows = PremiumStore.get(coin).window(start, end, ('timestamp',) + PRICE_FIELDS)
+    depth = DepthStore.get(coin).window(start, end)
+    index = np.searchsorted(depth['timestamp'], rows['timestamp'])
+    matched = index < len(depth['timestamp'])
+    matched[matched] = depth['timestamp'][index[matched]] == rows['timestamp'][matched]
+    for name in SIZE_FIELDS:
+        rows[name] = np.full(len(matched), np.inf)
+        rows[name][matched] = depth[name][index[matched]]
+    return rows
+
+
+async def load_history(coins: List[str], start: int, end: int) -> Dict[str, np.ndarray]:
+    """各币种(start, end]内的行情，每行一个币种\n
+    列式存储最早一条不晚于start的读存储，其余一次查询Ticker；没有挂单量的记录视为挂单量无限。
+
+    :param coins: 币种列表
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒
+    :return: timestamp及PRICE_FIELDS、SIZE_FIELDS，均为(len(coins), T)
+    """
+    rows = dict()
+    missing = []
+    for coin in coins:
+        if (first := PremiumStore.get(coin).first()) is not None and first <= start:
+            rows[coin] = store_rows(coin, start, end)
+        else:
+            missing.append(coin)
+    if missing:
+        Ticker = record.Record('Ticker')
+        pipeline = [{'$match': {'instrument': {'$in': missing},
+                                'timestamp': {'$gt': utcfrommillisecs(start), '$lte': utcfrommillisecs(end)}}},
+                    {'$sort': {'timestamp': 1}},
+                    {'$project': {'_id': 0, 'instrument': 1, 'timestamp': 1,
+                                  **{name: 1 for name in PRICE_FIELDS + SIZE_FIELDS}}}]
+        docs = dict()
+        for n in await Ticker.acol.aggregate(pipeline, allowDiskUse=True):
+            docs.setdefault(n['instrument'], []).append(n)
+        for coin in missing:
+            result = docs.get(coin, [])
+            rows[coin] = dict(timestamp=np.fromiter(
+                (int(x['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1000) for x in result),
+                dtype=np.int64, count=len(result)))
+            rows[coin].update({name: np.fromiter((x[name] for x in result), dtype=np.float64, count=len(result))
+                               for name in PRICE_FIELDS})
+            rows[coin].update({name: np.fromiter((x.get(name, np.inf) for x in result), dtype=np.float64,
+                                                 count=len(result)) for name in SIZE_FIELDS})
+    return stack_rows([rows[coin] for coin in coins])
+
+
+async def load_funding(coins: List[str], start: int, end: int) -> Dict[str, np.ndarray]:
+    """各币种(start, end]内的资金费率，每行一个币种，末尾补齐：timestamp补int64最大值，funding补0
+
+    :param coins: 币种列表
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒
+    """
+    Funding = record.Record('Funding')
+    pipeline = [{'$match': {'instrument': {'$in': coins},
+                            'timestamp': {'$gt': utcfrommillisecs(start), '$lte': utcfrommillisecs(end)}}},
+                {'$sort': {'timestamp': 1}}]
+    funding = dict()
+    for n in await Funding.acol.aggregate(pipeline):
+        timestamp = int(n['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1000)
+        funding.setdefault(n['instrument'], []).append((timestamp, n['funding']))
+    length = max((len(n) for n in funding.values()), default=0)
+    stacked = dict(timestamp=np.full((len(coins), length), PAD, dtype=np.int64), funding=np.zeros((len(coins), length)))
+    for i, coin in enumerate(coins):
+        if n := funding.get(coin):
+            stacked['timestamp'][i, :len(n)], stacked['funding'][i, :len(n)] = zip(*n)
+    return stacked
+
+
+def prefix_moments(values: np.ndarray):
+    """每行条数、和、平方和的前缀和，首列为0；减去每行均值后累加，窗口相减时不损失精度
+
+    :param values: (n, T)期现差价，NaN不计
+    :return: count, total, sumsq, shift
+    """
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.nan_to_num(np.where(valid, values, 0.).sum(axis=1) / np.count_nonzero(valid, axis=1))
+    centered = np.where(valid, values - shift[:, None], 0.)
+    count, total, sumsq = (np.pad(np.cumsum(arr, axis=1), ((0, 0), (1, 0)))
+                           for arr in (valid.astype(np.float64), centered, np.square(centered)))
+    return count, total, sumsq, shift
+
+
+def window_threshold(timestamp: np.ndarray, values: np.ndarray, prefix: tuple, lo: np.ndarray, hi: np.ndarray,
+                     k: float, side: int) -> np.ndarray:
+    """每行(lo, hi]内的开平仓阈值，同Stat.open_threshold、close_threshold，窗口内没有数据时为NaN
+
+    :param timestamp: (n, T)
+    :param values: (n, T)期现差价
+    :param prefix: prefix_moments返回值
+    :param lo: (n,)窗口起点，毫秒
+    :param hi: (n,)窗口终点，毫秒
+    :param k: 标准差倍数
+    :param side: 1为开仓，-1为平仓
+    :rtype: np.ndarray
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if threshold_mode == 'quantile':
+            mask = (timestamp > lo[:, None]) & (timestamp <= hi[:, None]) & ~np.isnan(values)
+            count = np.count_nonzero(mask, axis=1)
+            q = normal_cdf(k) if side > 0 else 1 - normal_cdf(k)
+            # NaN排在每行末尾，按numpy默认的线性插值取前count个的分位数
+            ordered = np.sort(np.where(mask, values, np.nan), axis=1)
+            pos = q * (count - 1)
+            below = np.clip(np.floor(pos).astype(np.intp), 0, None)[:, None]
+            above = np.clip(np.ceil(pos).astype(np.intp), 0, None)[:, None]
+            low, high = np.take_along_axis(ordered, below, 1)[:, 0], np.take_along_axis(ordered, above, 1)[:, 0]
+            return np.where(count > 0, low + (high - low) * (pos - np.floor(pos)), np.nan)
+        # 每行窗口两端的行号，前缀和相减即窗口内的和
+        i = row_searchsorted(timestamp, lo, 'right')[:, None]
+        j = row_searchsorted(timestamp, hi, 'right')[:, None]
+        count, total, sumsq = (np.take_along_axis(arr, j, 1)[:, 0] - np.take_along_axis(arr, i, 1)[:, 0]
+                               for arr in prefix[:3])
+        mean = total / count
+        std = np.sqrt(np.maximum(sumsq - total * mean, 0.) / (count - 1))
+        return np.where(count > 0, prefix[3] + mean + side * k * std, np.nan)
+
+
+def block_thresholds(timestamp: np.ndarray, values: np.ndarray, since: np.ndarray, price_diff: Optional[float],
+                     window: float, k: float, accelerate_after: float, side: int) -> np.ndarray:
+    """每个采样适用的阈值\n
+    同AddPosition.add、ReducePosition.reduce：起始为price_diff，为None时取since前window小时的阈值；
+    之后每过accelerate_after小时，改为前accelerate_after小时的阈值。
+
+    :param timestamp: (n, T)
+    :param values: (n, T)期现差价
+    :param since: (n,)开始下单时间，毫秒
+    :param price_diff: 期现差价
+    :param window: 起始阈值的统计小时数
+    :param k: 标准差倍数
+    :param accelerate_after: 几小时后加速，0为不加速
+    :param side: 1为开仓，-1为平仓
+    :return: (n, T)
+    """
+    n = len(timestamp)
+    prefix = prefix_moments(values) if price_diff is None or accelerate_after else None
+    if price_diff is None:
+        first = window_threshold(timestamp, values, prefix, since - int(window * 3600_000), since, k, side)
+    else:
+        first = np.full(n, price_diff)
+    if not accelerate_after or not timestamp.size:
+        return np.broadcast_to(first[:, None], timestamp.shape)
+    period = int(accelerate_after * 3600_000)
+    last = timestamp.max(axis=1, where=timestamp != PAD, initial=0)
+    blocks = max(int(np.max(np.maximum(last - since, 0) // period)) + 1, 1)
+    thresholds = np.empty((n, blocks))
+    thresholds[:, 0] = first
+    for j in range(1, blocks):
+        thresholds[:, j] = window_threshold(timestamp, values, prefix, since + (j - 1) * period, since + j * period,
+                                            k, side)
+    block = np.clip((timestamp - since[:, None] - 1) // period, 0, blocks - 1)
+    return np.take_along_axis(thresholds, block, 1)
+
+
+def cumulative_fills(cond: np.ndarray, size: np.ndarray, lot: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """FOK按买一卖一逐次成交的累计数量\n
+    每次下单min(剩余, 挂单量)并向下取整到lot，目标为lot的整数倍时累计成交即min(目标, 可成交量累加)。
+    有lot时按手数整数累加，没有舍入误差。
+
+    :param cond: (n, T)满足差价的采样
+    :param size: (n, T)买一卖一可成交量，币数
+    :param lot: (n,)下单单位，0为不取整
+    :param target: (n,)目标数量，lot的整数倍
+    """
+    unit = np.where(lot > 0, lot, 1.)[:, None]
+    with np.errstate(invalid='ignore'):
+        size = np.where(lot[:, None] > 0, np.floor(size / unit), size)
+    available = np.where(cond & (size > 0), size, 0.)
+    goal = np.where(lot > 0, np.round(target / unit[:, 0]), target)[:, None]
+    return np.minimum(goal, np.cumsum(available, axis=1)) * unit
+
+
+def first_reached(cumulative: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """每行累计数量首次达到目标的列，未达到为-1
+    """
+    reached = (cumulative >= target[:, None]) & (target[:, None] > 0)
+    return np.where(reached.any(axis=1), reached.argmax(axis=1), -1)
+
+
+def leverage_bands(history: Dict[str, np.ndarray], holding: np.ndarray, since: np.ndarray, until: np.ndarray,
+                   leverage: float, band: float, fee_rate: float):
+    """Monitor.watch按杠杆区间调仓的次数及估算成本\n
+    持仓期间以合约中间价为最新价，建仓完成时强平价为last * (1 + 1 / leverage)。
+    强平价低于last * (1 + 1 / (leverage + band))时减仓swap_position / (leverage + 1) ** 2，
+    高于last * (1 + 1 / (leverage - band))时按多余保证金加仓swap_position * (liq / last / (1 + 1 / leverage) - 1)，
+    调仓后强平价回到last * (1 + 1 / leverage)。调仓数量较小，不改变持仓路径，每次按当时买一卖一计一次往返的价差及手续费。
+
+    :param history: load_history返回值
+    :param holding: (n, T)持仓
+    :param since: (n,)建仓完成的列，-1为未完成
+    :param until: (n,)平仓完成或最后一个采样的列
+    :param leverage: 杠杆
+    :param band: 杠杆区间，Monitor为1
+    :param fee_rate: 单边现货加合约吃单手续费率
+    :return: 调仓次数、成本
+    """
+    n = len(holding)
+    count, cost = np.zeros(n, dtype=np.int64), np.zeros(n)
+    if not band:
+        return count, cost
+    spot_bid, spot_ask, swap_bid, swap_ask = (history[name] for name in PRICE_FIELDS)
+    last = (swap_bid + swap_ask) / 2
+    upper = 1 + 1 / (leverage + band)
+    # 杠杆不高于band时不会加仓
+    lower = 1 + 1 / (leverage - band) if leverage > band else np.inf
+    for row, i, j in zip(range(n), since.tolist(), until.tolist()):
+        if i < 0:
+            continue
+        liquidation = last[row, i] * (1 + 1 / leverage)
+        while i < j:
+            segment = last[row, i + 1:j + 1]
+            with np.errstate(invalid='ignore'):
+                hit = (liquidation < segment * upper) | (liquidation > segment * lower)
+            if not hit.any():
+                break
+            i += 1 + int(hit.argmax())
+            price, position = last[row, i], holding[row, i]
+            if liquidation < price * upper:
+                size = position / (leverage + 1) ** 2
+            else:
+                size = position * (liquidation / price / (1 + 1 / leverage) - 1)
+            spread = swap_ask[row, i] - swap_bid[row, i] + spot_ask[row, i] - spot_bid[row, i]
+            cost[row] += size * (spread + fee_rate * (spot_bid[row, i] + spot_ask[row, i]))
+            count[row] += 1
+            liquidation = price * (1 + 1 / leverage)
+    return count, cost
+
+
+def replay(history: Dict[str, np.ndarray], funding: Dict[str, np.ndarray], start: int, usdt_size=1000.,
+           leverage=2., open_diff: Optional[float] = 0.002, close_diff: Optional[float] = 0., window=4., k=2.,
+           accelerate_after=0., hold=0., band=0., lot: Optional[np.ndarray] = None,
+           contract_val: Optional[np.ndarray] = None, fee_rate=trade_fee) -> Dict[str, np.ndarray]:
+    """按记录的行情重放一次建仓、平仓，所有币种、所有采样一起计算\n
+    start之后开始建仓，同AddPosition.add：合约买一不低于现货卖一 * (1 + 阈值)时按买一卖一FOK下单；
+    建仓完成hold小时后开始平仓，同ReducePosition.reduce：合约卖一不高于现货买一 * (1 + 阈值)时下单。
+    每个采样至多下单一次，资金费结算前后不下单。持仓期间按资金费率及合约买一计入资金费，
+    期末未平的仓位按最后的现货买一、合约卖一计算平仓价值。
+
+    :param history: load_history返回值
+    :param funding: load_funding返回值
+    :param start: 开始建仓时间，毫秒
+    :param usdt_size: 每个币种U本位仓位
+    :param leverage: 杠杆
+    :param open_diff: 开仓期现差价，None为前window小时的阈值
+    :param close_diff: 平仓期现差价，None为建仓完成前window小时的阈值
+    :param window: 阈值统计小时数
+    :param k: 标准差倍数
+    :param accelerate_after: 几小时后加速，0为不加速
+    :param hold: 建仓完成后几小时开始平仓
+    :param band: Monitor调仓的杠杆区间，见leverage_bands，0为不调仓
+    :param lot: (n,)各币种下单单位，币数，默认不取整
+    :param contract_val: (n,)合约面值，默认1
+    :param fee_rate: 单边现货加合约吃单手续费率，按现货成交额计
+    :return: 各币种目标数量、建仓及平仓数量与完成时间、现货及合约成交额、手续费、资金费、未平仓价值、调仓次数及成本、
+        收益及收益率
+    :rtype: Dict[str, np.ndarray]
+    """
+    timestamp = history['timestamp']
+    n = len(timestamp)
+    rows = np.arange(n)
+    lot = np.zeros(n) if lot is None else np.asarray(lot, dtype=np.float64)
+    contract_val = np.ones(n) if contract_val is None else np.asarray(contract_val, dtype=np.float64)
+    spot_bid, spot_ask, swap_bid, swap_ask = (history[name] for name in PRICE_FIELDS)
+    spot_bid_sz, spot_ask_sz, swap_bid_sz, swap_ask_sz = (history[name] for name in SIZE_FIELDS)
+    tradable = (timestamp != PAD) & ~funding_settling(timestamp)
+    since = np.full(n, start, dtype=np.int64)
+
+    # 建仓目标按start后第一个现货卖一折算，取整到lot
+    first = np.minimum(row_searchsorted(timestamp, since, 'right'), max(timestamp.shape[1] - 1, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        target = usdt_size * leverage / (leverage + 1) / spot_ask[rows, first] if timestamp.size else np.zeros(n)
+        target = np.where(lot > 0, np.floor(target / lot) * lot, target)
+    target = np.nan_to_num(target, nan=0., posinf=0.)
+
+    with np.errstate(invalid='ignore'):
+        open_pd = (swap_bid - spot_ask) / spot_ask
+        threshold = block_thresholds(timestamp, open_pd, since, open_diff, window, k, accelerate_after, 1)
+        cond = tradable & (timestamp > start) & (swap_bid >= spot_ask * (1 + threshold))
+    opened = cumulative_fills(cond, np.fmin(spot_ask_sz, swap_bid_sz * contract_val[:, None]), lot, target)
+    open_done = first_reached(opened, target)
+    open_time = np.where(open_done >= 0, timestamp[rows, open_done], 0)
+
+    # 建仓完成后才平仓
+    complete = open_done >= 0
+    close_since = np.where(complete, open_time + int(hold * 3600_000), start)
+    position = np.where(complete, target, 0.)
+    with np.errstate(invalid='ignore'):
+        close_pd = (swap_ask - spot_bid) / spot_bid
+        threshold = block_thresholds(timestamp, close_pd, close_since, close_diff, window, k, accelerate_after, -1)
+        cond = (tradable & complete[:, None] & (timestamp > close_since[:, None])
+                & (swap_ask <= spot_bid * (1 + threshold)))
+    closed = cumulative_fills(cond, np.fmin(spot_bid_sz, swap_ask_sz * contract_val[:, None]), lot, position)
+    close_done = first_reached(closed, position)
+    close_time = np.where(close_done >= 0, timestamp[rows, close_done], 0)
+
+    open_fill = np.diff(opened, axis=1, prepend=0.)
+    close_fill = np.diff(closed, axis=1, prepend=0.)
+
+    def turnover(fill, price):
+        return np.where(fill > 0, fill * price, 0.).sum(axis=1)
+
+    spot_notional = turnover(close_fill, spot_bid) - turnover(open_fill, spot_ask)
+    swap_notional = turnover(open_fill, swap_bid) - turnover(close_fill, swap_ask)
+    fee = - fee_rate * (turnover(open_fill, spot_ask) + turnover(close_fill, spot_bid))
+
+    # 资金费时刻的持仓
+    holding = opened - closed
+    index = row_searchsorted(timestamp, funding['timestamp'], 'right') - 1
+    settled = (funding['timestamp'] != PAD) & (index >= 0)
+    index = np.maximum(index, 0)
+    income = (funding['funding'] * np.take_along_axis(holding, index, 1)
+              * np.take_along_axis(swap_bid, index, 1)) if holding.size else np.zeros(funding['funding'].shape)
+    funding_fee = np.where(settled, income, 0.).sum(axis=1)
+
+    # 期末按最后的买一卖一平掉剩余仓位
+    last = np.maximum(np.count_nonzero(timestamp != PAD, axis=1) - 1, 0)
+    remaining = holding[rows, last] if holding.size else np.zeros(n)
+    with np.errstate(invalid='ignore'):
+        unrealized = np.where(remaining > 0, remaining * (spot_bid[rows, last] * (1 - fee_rate) - swap_ask[rows, last]),
+                              0.) if holding.size else np.zeros(n)
+    until = np.where(close_done >= 0, close_done, last)
+    rebalances, rebalance_cost = leverage_bands(history, holding, open_done, until, leverage, band, fee_rate)
+    pnl = spot_notional + swap_notional + fee + funding_fee + unrealized - rebalance_cost
+    return dict(target=target, opened=opened[:, -1] if opened.size else np.zeros(n), open_time=open_time,
+                closed=closed[:, -1] if closed.size else np.zeros(n), close_time=close_time,
+                spot_notional=spot_notional, swap_notional=swap_notional, fee=fee, funding=funding_fee,
+                unrealized=unrealized, rebalances=rebalances, rebalance_cost=rebalance_cost, pnl=pnl,
+                rate=pnl / usdt_size)
+
+
+async def contract_specs(coins: List[str], account=3) -> Tuple[np.ndarray, np.ndarray]:
+    """各币种永续合约的下单单位（币数，ctVal × lotSz）及合约面值ctVal，取自InstrumentRegistry
+
+    :param coins: 币种列表
+    :param account: 账号id，3为模拟盘
+    """
+    registry = InstrumentRegistry.get(account)
+    specs = await asyncio.gather(*[registry.instrument('SWAP', coin + '-USDT-SWAP') for coin in coins])
+    contract_val = np.array([float(n['ctVal']) for n in specs])
+    return contract_val * np.array([float(n['lotSz']) for n in specs]), contract_val
+
+
+@call_coroutine
+async def backtest(hours=48., coins: Optional[List[str]] = None, end: Optional[int] = None, chunk=32, window=4.,
+                   lot: Optional[Dict[str, float]] = None, contract_val: Optional[Dict[str, float]] = None,
+                   account=3, **kwargs):
+    """回测最近几小时，每次读取、重放chunk个币种
+
+    :param hours: 回测几小时
+    :param coins: 币种列表，默认列式存储中的全部币种
+    :param end: 截止时间，毫秒，默认现在
+    :param chunk: 每批币种数
+    :param window: 阈值统计小时数，向前多读取的行情
+    :param lot: 各币种下单单位，默认按合约规格
+    :param contract_val: 各币种合约面值，默认按合约规格；DepthStore中合约挂单量为张数
+    :param account: 读取合约规格的账号id
+    :param kwargs: 传给replay
+    :return: instrument及replay各项
+    :rtype: Dict[str, np.ndarray]
+    """
+    if end is None:
+        end = int(time.time() * 1000)
+    start = end - int(hours * 3600_000)
+    coins = PremiumStore.instruments() if coins is None else coins
+    lot, contract_val = lot or dict(), contract_val or dict()
+    results = []
+    for i in range(0, len(coins), chunk):
+        part = coins[i:i + chunk]
+        history, funding, (spec_lot, spec_val) = await asyncio.gather(
+            load_history(part, start - int(window * 3600_000), end), load_funding(part, start, end),
+            contract_specs(part, account))
+        results.append(replay(history, funding, start, window=window,
+                              lot=np.array([lot.get(coin, n) for coin, n in zip(part, spec_lot.tolist())]),
+                              contract_val=np.array([contract_val.get(coin, n)
+                                                     for coin, n in zip(part, spec_val.tolist())]), **kwargs))
+    result = {name: np.concatenate([n[name] for n in results]) if results else np.empty(0)
+              for name in REPLAY_FIELDS}
+    result['instrument'] = list(coins)
+    return result
+
+
+def print_backtest(result: Dict[str, np.ndarray], top=20):
+    """按收益从高到低打印
+    """
+    fprint(backtest_title)
+    for i in np.argsort(-result['pnl'])[:top].tolist():
+        fprint(f"{result['instrument'][i]:8s}{result['opened'][i]:12.4g}{result['closed'][i]:12.4g}"
+              f"{result['funding'][i]:10.2f}{result['fee'][i]:10.2f}{result['pnl'][i]:10.2f}{result['rate'][i]:9.2%}")
+
+
+if __name__ == '__main__':
+    # 离线回测：python -m src.backtest [小时数] [开仓差价] [平仓差价]
+    arguments = dict(hours=float(sys.argv[1])) if len(sys.argv) > 1 else dict()
+    if len(sys.argv) > 2:
+        arguments['open_diff'] = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        arguments['close_diff'] = float(sys.argv[3])
+    print_backtest(backtest(**arguments))
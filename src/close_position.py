@@ -1,4 +1,3 @@
-from okx.async_okx_v5.channel import TickersChannel
 from src.okex_api import *
 from src.trading_data import Stat
 
@@ -161,7 +160,7 @@ class ReducePosition(OKExAPI):
                 fprint(lang.hedge_success.format(swap_filled, self.coin), lang.remaining.format(self.target_position))
                 mydict = dict(account=self.account, instrument=self.coin, op='reduce',
                               size=target_position_prev)
-                Record('OP').mycol.find_one_and_update(mydict, {'$set': {'size': self.target_position}})
+                await Record('OP').acol.find_one_and_update(mydict, {'$set': {'size': self.target_position}})
             else:
                 fprint(lang.hedge_fail.format(self.coin, spot_filled, swap_filled))
                 self.exit_flag = True
@@ -211,7 +210,7 @@ class ReducePosition(OKExAPI):
         fprint(lang.amount_to_reduce.format(self.coin, self.target_position))
         OP = Record('OP')
         mydict = dict(account=self.account, instrument=self.coin, op='reduce', size=self.target_position)
-        OP.insert(mydict)
+        await OP.insert(mydict)
 
         self.spot_filled_sum = 0.
         self.swap_filled_sum = 0.
@@ -221,10 +220,7 @@ class ReducePosition(OKExAPI):
         self.swap_notional = 0.
         time_to_accelerate = datetime.utcnow() + timedelta(hours=accelerate_after)
 
-        tickers_subscription = await self.websocketAPI.subscribe_public(
-            [TickersChannel(channel='tickers', instId=self.spot_ID),
-             TickersChannel(channel='tickers', instId=self.swap_ID)]
-        )
+        tickers_subscription = self.subscribe_tickers([self.spot_ID, self.swap_ID])
         spot_ticker = swap_ticker = None
         self.exit_flag = False
 
@@ -237,8 +233,9 @@ class ReducePosition(OKExAPI):
                 # 判断是否加速
                 if accelerate_after and datetime.utcnow() > time_to_accelerate:
                     stat = Stat(self.coin)
-                    assert (recent := stat.recent_close_stat(accelerate_after)), lang.fetch_ticker_first
-                    price_diff = recent['avg'] - 2 * recent['std']
+                    # 不按采样覆盖率过滤，没有近期数据时沿用原阈值
+                    if (threshold := await stat.close_threshold(accelerate_after, 2, coverage=0)) is not None:
+                        price_diff = threshold
                     time_to_accelerate = datetime.utcnow() + timedelta(hours=accelerate_after)
 
                 ticker = ticker['data'][0]
@@ -300,7 +297,7 @@ class ReducePosition(OKExAPI):
                             pass
 
         if self.spot_notional:
-            Ledger = Record('Ledger')
+            Ledger = record.Ledger()
             timestamp = datetime.utcnow()
             mydict1 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='现货卖出',
                            spot_notional=self.spot_notional)
@@ -308,10 +305,10 @@ class ReducePosition(OKExAPI):
                            swap_notional=self.swap_notional)
             mydict3 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='手续费',
                            fee=self.fee_total)
-            Ledger.mycol.insert_many([mydict1, mydict2, mydict3])
+            await Ledger.insert_many([mydict1, mydict2, mydict3])
 
         mydict = dict(account=self.account, instrument=self.coin, op='reduce')
-        OP.delete(mydict)
+        await OP.delete(mydict)
         await self.update_portfolio()
         fprint(lang.reduced_amount.format(self.swap_filled_sum, self.coin))
         if self.usdt_release:
@@ -348,7 +345,7 @@ class ReducePosition(OKExAPI):
         fprint(lang.amount_to_close.format(self.coin, self.target_position))
         OP = Record('OP')
         mydict = dict(account=self.account, instrument=self.coin, op='close', size=self.target_position)
-        OP.insert(mydict)
+        await OP.insert(mydict)
 
         self.spot_filled_sum = 0.
         self.swap_filled_sum = 0.
@@ -358,10 +355,7 @@ class ReducePosition(OKExAPI):
         self.swap_notional = 0.
         time_to_accelerate = datetime.utcnow() + timedelta(hours=accelerate_after)
 
-        tickers_subscription = await self.websocketAPI.subscribe_public(
-            [TickersChannel(channel='tickers', instId=self.spot_ID),
-             TickersChannel(channel='tickers', instId=self.swap_ID)]
-        )
+        tickers_subscription = self.subscribe_tickers([self.spot_ID, self.swap_ID])
         spot_ticker = swap_ticker = None
         self.exit_flag = False
 
@@ -374,8 +368,9 @@ class ReducePosition(OKExAPI):
                 # 判断是否加速
                 if accelerate_after and datetime.utcnow() > time_to_accelerate:
                     stat = Stat(self.coin)
-                    assert (recent := stat.recent_close_stat(accelerate_after)), lang.fetch_ticker_first
-                    price_diff = recent['avg'] - 2 * recent['std']
+                    # 不按采样覆盖率过滤，没有近期数据时沿用原阈值
+                    if (threshold := await stat.close_threshold(accelerate_after, 2, coverage=0)) is not None:
+                        price_diff = threshold
                     time_to_accelerate = datetime.utcnow() + timedelta(hours=accelerate_after)
 
                 ticker = ticker['data'][0]
@@ -461,7 +456,7 @@ class ReducePosition(OKExAPI):
                             pass
 
         if self.spot_notional:
-            Ledger = Record('Ledger')
+            Ledger = record.Ledger()
             timestamp = datetime.utcnow()
             mydict1 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='现货卖出',
                            spot_notional=self.spot_notional)
@@ -471,11 +466,11 @@ class ReducePosition(OKExAPI):
                            fee=self.fee_total)
             mydict4 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='平仓',
                            position=self.usdt_release)
-            Ledger.mycol.insert_many([mydict1, mydict2, mydict3, mydict4])
+            await Ledger.insert_many([mydict1, mydict2, mydict3, mydict4])
 
         mydict = dict(account=self.account, instrument=self.coin, op='close')
-        OP.delete(mydict)
-        Record('Portfolio').mycol.delete_one(dict(account=self.account, instrument=self.coin))
+        await OP.delete(mydict)
+        await Record('Portfolio').acol.delete_one(dict(account=self.account, instrument=self.coin))
         fprint(lang.closed_amount.format(self.swap_filled_sum, self.coin))
         if self.usdt_release:
             fprint(lang.spot_recoup.format(self.usdt_release))
@@ -10,6 +10,46 @@ language = 'cn'
 # English support
 # language = 'en'
 
+# 行情记录方式，'ws'订阅推送，'rest'轮询
+record_mode = 'ws'
+# 行情采样间隔，秒
+record_interval = 1
+# 'ws'方式下只记录报价有变化的币种
+record_on_change = False
+# 行情列式存储目录
+store_dir = './data'
+# 期现差价汇总保留天数，0为永久
+rollup_retention = {'1m': 7, '15m': 90, '1h': 0}
+# 行情写入队列：每批条数、最长等待秒数、最多缓存条数，缓存满时'spill'写入磁盘或'drop'丢弃
+write_batch = 5000
+write_age = 5
+write_buffer = 200_000
+write_overflow = 'spill'
+# 启动时回补最近几小时内超过max_gap秒的行情空档
+backfill_hours = 24
+max_gap = 120
+# 统计窗口有采样的分钟占比低于此值时不用于交易
+min_coverage = 0.9
+# Stat统计值缓存条目数及有效秒数，有新行情时也失效
+stat_cache_size = 256
+stat_cache_ttl = 60
+# 开平仓阈值：'sigma'为均值加减k倍标准差，'quantile'为按正态分布k倍标准差对应分位的历史分位数
+threshold_mode = 'sigma'
+# 每小时分位数摘要的质心数及保留天数，0为不清理
+sketch_size = 64
+sketch_retention = 90
+# 图片保存目录及格式，'png'或'svg'
+plot_dir = './plots'
+plot_format = 'png'
+# 现货、永续合约规格保存在store_dir/instruments，超过几秒后台刷新
+instrument_ttl = 3600
+# 资金费推送超过几秒未更新时退回REST查询
+funding_stale = 120
+# 低优先级REST请求（全市场筛选）不使用的令牌比例，留给下单及持仓查询
+rate_reserve = 0.25
+# 全市场筛选时估算的单边现货加合约吃单手续费率
+trade_fee = 0.0015
+
 
 class Key:
 
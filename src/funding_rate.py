@@ -1,4 +1,116 @@
+from typing import Set
+from okx.async_okx_v5.channel import FundingRateChannel
+from okx.async_okx_v5.websocket import OkxWebsocket
 from src.trading_data import *
+from src.config import Key, funding_stale, trade_fee
+from src.instruments import InstrumentRegistry
+from src.ranking import format_rows, ranking_table, top_k
+from src.ratelimit import LOW, RateLimited, scope
+from src.quotes import SharedQuotes
+
+# 资金费最长收取间隔
+FUNDING_INTERVAL = timedelta(hours=8)
+# 可能的收取间隔
+FUNDING_INTERVALS = tuple(timedelta(hours=n) for n in (1, 2, 4, 8))
+
+
+def funding_interval(first: datetime, last: datetime, count: int) -> timedelta:
+    """按count条记录的首尾时间估计收取间隔，取不超过平均间隔的最长标准间隔，中间缺几条时仍能识别，不足2条时为8小时
+    """
+    if count < 2:
+        return FUNDING_INTERVAL
+    gap = (last - first) / (count - 1) + timedelta(minutes=10)
+    return max((n for n in FUNDING_INTERVALS if n <= gap), default=FUNDING_INTERVALS[0])
+
+
+def parse_funding(n: dict) -> Tuple[float, float]:
+    """funding-rate推送或get_funding_time返回值中的当期、预测资金费
+    """
+    return safe_float(n['fundingRate']), safe_float(n['nextFundingRate'])
+
+
+class FundingCache:
+    """funding-rate频道推送的全部永续合约当期、预测资金费\n
+    每个进程一个订阅，首次查询时启动，连接中断后退避重连，期间查询退回REST。
+    超过funding_stale秒未推送或已过收取时间的合约视为过期。
+    """
+    # instId -> (当期, 预测, 收取时间毫秒, 推送时间monotonic)
+    rates: Dict[str, Tuple[float, float, int, float]] = dict()
+    instIds: Set[str] = set()
+    task: Optional[asyncio.Task] = None
+    updated: Optional[asyncio.Event] = None
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls.task is not None and not cls.task.done()
+
+    @classmethod
+    def start(cls, account: int, instIds: List[str]):
+        """后台订阅funding-rate频道
+
+        :param account: 账号id
+        :param instIds: 永续合约
+        """
+        cls.instIds = set(instIds)
+        cls.updated = asyncio.Event()
+        cls.task = asyncio.create_task(cls.run(account, instIds))
+
+    @classmethod
+    async def run(cls, account: int, instIds: List[str]):
+        apikey = Key(account)
+        delay = 1
+        while True:
+            try:
+                websocketAPI = OkxWebsocket(apikey.api_key, apikey.secret_key, apikey.passphrase, test=account == 3)
+                subscription = await websocketAPI.subscribe_public(
+                    [FundingRateChannel(channel='funding-rate', instId=instId) for instId in instIds])
+                async for event in subscription:
+                    for n in event.get('data', ()):
+                        cls.update(n)
+                    cls.updated.set()
+                    delay = 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+                fprint(lang.funding_feed_error.format(e))
+            # 推送结束或连接中断，等待1、2、4……最长60秒后重连
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    @classmethod
+    def update(cls, n: dict):
+        cls.rates[n['instId']] = parse_funding(n) + (int(n['fundingTime']), time.monotonic())
+
+    @classmethod
+    def get(cls, instId: str) -> Optional[Tuple[float, float]]:
+        """未过期的当期、预测资金费
+
+        :param instId: 永续合约
+        """
+        if (n := cls.rates.get(instId)) is None:
+            return None
+        current_rate, next_rate, funding_time, updated = n
+        if time.monotonic() - updated > funding_stale or funding_time <= time.time() * 1000:
+            return None
+        return current_rate, next_rate
+
+    @classmethod
+    async def wait(cls, instIds: List[str], timeout=5.) -> Dict[str, Tuple[float, float]]:
+        """等待订阅中的合约推送，最多timeout秒
+
+        :param instIds: 永续合约
+        :param timeout: 最长等待秒数
+        :return: instId -> 未过期的(当期, 预测)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            rates = {instId: rate for instId in instIds if (rate := cls.get(instId))}
+            pending = [instId for instId in instIds if instId not in rates and instId in cls.instIds]
+            if not pending or not cls.running() or (remaining := deadline - time.monotonic()) <= 0:
+                return rates
+            cls.updated.clear()
+            try:
+                await asyncio.wait_for(cls.updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
 
 # @debug_timer
@@ -6,27 +118,43 @@ class FundingRate:
     publicAPI: PublicAPI
 
     def __init__(self, account=3):
+        self.account = account
         if account == 3:
-            FundingRate.publicAPI = PublicAPI(test=True)
+            FundingRate.publicAPI = RateLimited(PublicAPI(test=True), LOW, scope(True))
         else:
-            FundingRate.publicAPI = PublicAPI()
+            FundingRate.publicAPI = RateLimited(PublicAPI(), LOW, scope(False))
 
     async def get_instruments_ID(self):
-        """获取合约币种列表
+        """获取合约币种列表，行情服务运行时取其订阅的合约，否则取InstrumentRegistry
 
         :rtype: List[str]
         """
-        return [n['instId'] for n in await self.publicAPI.get_instruments('SWAP') if n['instId'].find('USDT') != -1]
+        if quotes := SharedQuotes.attach():
+            return [instId for instId in quotes.index if instId.endswith('-SWAP')]
+        return [n['instId'] for n in await InstrumentRegistry.get(self.account).instruments('SWAP')
+                if n['instId'].find('USDT') != -1]
+
+    async def current_next_rates(self, instIds: List[str]) -> Dict[str, Tuple[float, float]]:
+        """多个合约的当期和预测资金费，取FundingCache，未订阅或过期的合约调用REST
+
+        :param instIds: 永续合约
+        :return: instId -> (当期, 预测)
+        """
+        if not FundingCache.running():
+            FundingCache.start(self.account, await self.get_instruments_ID())
+        rates = await FundingCache.wait(instIds)
+        missing = [instId for instId in instIds if instId not in rates]
+        for instId, funding_time in zip(missing, await asyncio.gather(
+                *[self.publicAPI.get_funding_time(instId=instId) for instId in missing])):
+            rates[instId] = parse_funding(funding_time)
+        return rates
 
     async def current_next(self, instrument_id=''):
         """当期和预测资金费
 
         :param instrument_id: 币种合约
         """
-        funding_rate = await self.publicAPI.get_funding_time(instId=instrument_id)
-        current_rate = float(m) if (m := funding_rate['fundingRate']) else 0.
-        next_rate = float(m) if (m := funding_rate['nextFundingRate']) else 0.
-        return current_rate, next_rate
+        return (await self.current_next_rates([instrument_id]))[instrument_id]
 
     async def current(self, instrument_id):
         """当期资金费
@@ -46,44 +174,118 @@ class FundingRate:
     async def show_current_rate(self):
         """显示当前资金费
         """
-        task_list = [self.publicAPI.get_funding_time(instId=m) for m in await self.get_instruments_ID()]
-        funding_rate_list = []
-        for funding_time in await asyncio.gather(*task_list):
-            instId = funding_time['instId']
-            current_rate = float(m) if (m := funding_time['fundingRate']) else 0.
-            estimated_rate = float(m) if (m := funding_time['nextFundingRate']) else 0.
-            funding_rate_list.append(
-                dict(instrument_id=instId, current_rate=current_rate, estimated_rate=estimated_rate))
-        funding_rate_list.sort(key=lambda x: x['current_rate'], reverse=True)
-
-        def format(n: dict):
-            instrumentID = n['instrument_id'][:n['instrument_id'].find('-')]
-            current_rate = n['current_rate']
-            estimated_rate = n['estimated_rate']
-            return f'{instrumentID:8s}{current_rate:9.3%}{estimated_rate:11.3%}'
-
-        columned_output(funding_rate_list, coin_current_next, 3, format)
+        rates = await self.current_next_rates(await self.get_instruments_ID())
+        current_rate, estimated_rate = np.array(list(rates.values())).reshape(-1, 2).T
+        table = ranking_table([instId[:instId.find('-')] for instId in rates], current_rate=current_rate,
+                              estimated_rate=estimated_rate)
+        lines = format_rows(top_k(table, 'current_rate'), ('instrument', 'current_rate', 'estimated_rate'),
+                            '{:8s}{:9.3%}{:11.3%}')
+        columned_output(lines, coin_current_next, 3, str)
         # 50 s without asyncio
         # 1.6 s with asyncio
+        # instantaneous from FundingCache
+
+    async def sync_funding(self, days=7, instrumentsID: Optional[List[str]] = None) -> Dict[str, timedelta]:
+        """补齐Funding集合中最近days天的资金费，每个合约只请求最后一条记录之后的部分\n
+        收取间隔按窗口内已有记录估计，没有记录时按8小时；窗口内条数少于应有条数（新上线、中间缺记录）时请求整个窗口，
+        请求结果的间隔短于估计时按新间隔再请求一次。
+
+        :param days: 最近几天
+        :param instrumentsID: 合约列表，默认全部USDT永续合约
+        :return: 币种 -> 收取间隔
+        """
+        Record = record.Record('Funding')
+        now = datetime.utcnow()
+        since = now - timedelta(days=days)
+        pipeline = [{'$match': {'timestamp': {'$gt': since}}},
+                    {'$group': {'_id': '$instrument', 'first': {'$min': '$timestamp'}, 'last': {'$max': '$timestamp'},
+                                'count': {'$sum': 1}}}]
+        stored = {n['_id']: n for n in await Record.acol.aggregate(pipeline)}
+        intervals = dict()
+        counts = dict()
+        for swap_ID in instrumentsID or await self.get_instruments_ID():
+            coin = swap_ID[:swap_ID.find('-')]
+            interval = intervals[coin] = FUNDING_INTERVAL
+            last = since
+            if n := stored.get(coin):
+                interval = intervals[coin] = funding_interval(n['first'], n['last'], n['count'])
+                # 条数不足时整段重新请求
+                if n['count'] >= (now - since) // interval:
+                    last = n['last']
+            if (count := (now - last) // interval) > 0:
+                counts[swap_ID] = count
+        funding_list = []
+        while counts:
+            task_list = [self.publicAPI.get_funding_history(instId=m, count=count) for m, count in counts.items()]
+            retry = dict()
+            for swap_ID, historical_funding_rate in zip(counts, await asyncio.gather(*task_list,
+                                                                                     return_exceptions=True)):
+                if isinstance(historical_funding_rate, AssertionError):
+                    continue
+                coin = swap_ID[:swap_ID.find('-')]
+                # 尚未结算的一期realizedRate为空，跳过
+                fetched = [dict(instrument=coin, timestamp=utcfrommillisecs(n['fundingTime']),
+                                funding=safe_float(n['realizedRate']))
+                           for n in historical_funding_rate if n.get('realizedRate')]
+                funding_list += fetched
+                if len(fetched) > 1:
+                    timestamps = [n['timestamp'] for n in fetched]
+                    interval = funding_interval(min(timestamps), max(timestamps), len(fetched))
+                    # 只取回了窗口的后一部分
+                    if interval < intervals[coin] and min(timestamps) - since > interval:
+                        retry[swap_ID] = (now - since) // interval
+                    intervals[coin] = min(interval, intervals[coin])
+            counts = retry
+        await Record.bulk_upsert(funding_list, record.FUNDING_KEYS)
+        return intervals
+
+    async def stored_rates(self, windows=(7,), intervals: Optional[Dict[str, timedelta]] = None
+                           ) -> Dict[str, List[float]]:
+        """从Funding集合一次读取最近max(windows)天的资金费，按币种求各窗口的日资金费率
+
+        :param windows: 各窗口天数
+        :param intervals: 币种 -> 收取间隔，sync_funding返回值，默认全部币种按8小时
+        :return: 币种 -> 各窗口平均每天资金费，记录少于窗口内应有条数的为NaN
+        """
+        Record = record.Record('Funding')
+        now = datetime.utcnow()
+        match = {'timestamp': {'$gt': now - timedelta(days=max(windows))}}
+        if intervals is not None:
+            match['instrument'] = {'$in': list(intervals)}
+        result = await Record.acol.aggregate([{'$match': match},
+                                              {'$project': {'_id': 0, 'instrument': 1, 'timestamp': 1, 'funding': 1}}])
+        if not result:
+            return dict()
+        instruments, inverse = np.unique([n['instrument'] for n in result], return_inverse=True)
+        age = np.fromiter(((now - n['timestamp']).total_seconds() for n in result), dtype=np.float64,
+                          count=len(result)) / 86400
+        funding = np.fromiter((n['funding'] for n in result), dtype=np.float64, count=len(result))
+        # 每天收取次数
+        per_day = np.array([timedelta(days=1) / (intervals or dict()).get(coin, FUNDING_INTERVAL)
+                            for coin in instruments.tolist()])
+        daily = np.empty((len(instruments), len(windows)))
+        for j, days in enumerate(windows):
+            mask = age < days
+            count = np.bincount(inverse[mask], minlength=len(instruments))
+            total = np.bincount(inverse[mask], funding[mask], minlength=len(instruments))
+            daily[:, j] = np.where(count >= np.floor(days * per_day), total / days, np.nan)
+        return dict(zip(instruments.tolist(), daily.tolist()))
 
-    async def get_recent_rate(self, days=7):
-        """返回最近资金费列表
+    async def get_recent_rate(self, days=7) -> np.ndarray:
+        """最近平均资金费，先增量同步Funding集合再从中读取
 
         :param days: 最近几天
-        :rtype: List[dict]
+        :return: ranking_table，列为instrument、funding_rate（折算为每8小时）、daily_rate（每天）及interval（收取间隔小时数），
+            不含记录不全的币种
         """
         assert isinstance(days, int) and 0 < days <= 90
-        count = days * 3
-        task_list = [self.publicAPI.get_funding_history(instId=m, count=count) for m in await self.get_instruments_ID()]
-        funding_rate_list = []
-        for historical_funding_rate in await asyncio.gather(*task_list, return_exceptions=True):
-            if isinstance(historical_funding_rate, AssertionError) or len(historical_funding_rate) < count:
-                continue
-            instId = historical_funding_rate[0]['instId']
-            realized_rate = [float(n['realizedRate']) for n in historical_funding_rate]
-            instrumentID = instId[:instId.find('-')]
-            funding_rate_list.append(dict(instrument=instrumentID, funding_rate=np.mean(realized_rate)))
-        return funding_rate_list
+        intervals = await self.sync_funding(days, await self.get_instruments_ID())
+        rates = await self.stored_rates((days,), intervals)
+        coins = list(rates)
+        daily_rate = np.array(list(rates.values()), dtype=np.float64).reshape(-1)
+        interval = np.array([intervals[coin] / timedelta(hours=1) for coin in coins], dtype=np.float64)
+        table = ranking_table(coins, funding_rate=daily_rate / 3, daily_rate=daily_rate, interval=interval)
+        return table[~np.isnan(table['daily_rate'])]
 
     # @debug_timer
     async def show_nday_rate(self, days: int):
@@ -92,44 +294,25 @@ class FundingRate:
         :param days: 天数
         """
         assert isinstance(days, int) and 0 < days <= 90
-        funding_rate_list = await self.get_recent_rate(days)
-        funding_rate_list.sort(key=lambda x: x['funding_rate'], reverse=True)
-
-        def format(n: dict):
-            return f"{n['instrument']:8s}{n['funding_rate']:8.3%}"
-
-        columned_output(funding_rate_list, funding_day, 5, format)
+        table = top_k(await self.get_recent_rate(days), 'funding_rate')
+        columned_output(format_rows(table, ('instrument', 'funding_rate'), '{:8s}{:8.3%}'), funding_day, 5, str)
 
     # @debug_timer
     async def print_30day_rate(self):
         """输出最近30天平均资金费到文件
         """
-        task_list = [self.publicAPI.get_funding_history(instId=m, count=90) for m in await self.get_instruments_ID()]
-        funding_rate_list = []
-        for historical_funding_rate in await asyncio.gather(*task_list):
-            instId = historical_funding_rate[0]['instId']
-            # 永续合约上线不一定有30天
-            if len(historical_funding_rate) < 21:
-                # print(m + "上线不到7天。")
-                pass
-            elif len(historical_funding_rate) < 90:
-                # print(m + "上线不到30天。")
-                realized_rate = [float(n['realizedRate']) for n in historical_funding_rate]
-                funding_rate_list.append(
-                    {'instrument_id': instId, '7day_funding_rate': np.mean(realized_rate[:21]),
-                     '30day_funding_rate': 0})
-            else:
-                realized_rate = [float(n['realizedRate']) for n in historical_funding_rate]
-                funding_rate_list.append(
-                    {'instrument_id': instId, '7day_funding_rate': np.mean(realized_rate[:21]),
-                     '30day_funding_rate': np.mean(realized_rate[:90])})
-
-        funding_rate_list.sort(key=lambda x: x['30day_funding_rate'], reverse=True)
-        funding_rate_list.sort(key=lambda x: x['7day_funding_rate'], reverse=True)
+        intervals = await self.sync_funding(30, await self.get_instruments_ID())
+        rates = await self.stored_rates((7, 30), intervals)
+        # 折算为每8小时
+        rates = {coin: [rate / 3 for rate in n] for coin, n in rates.items()}
+        # 永续合约上线不一定有30天，不到7天的不输出
+        rate7, rate30 = np.array(list(rates.values())).reshape(-1, 2).T
+        table = ranking_table(list(rates), rate7=rate7, rate30=np.nan_to_num(rate30))[~np.isnan(rate7)]
+        lines = format_rows(top_k(table, ('rate7', 'rate30')), ('instrument', 'rate7', 'rate30'), '{:9s}{:7.3%}{:8.3%}')
 
         funding_rate_file = open("Funding Rate.txt", "a", encoding="utf-8")
         funding_rate_file.write(datetime_str(datetime.now()) + '\n')
-        len1 = len(funding_rate_list)
+        len1 = len(lines)
         ncols = 4
         nrows = len1 // ncols + 1
         header = ''
@@ -142,11 +325,7 @@ class FundingRate:
             line = ''
             for j in range(ncols):
                 if i + j * nrows < len1:
-                    n = funding_rate_list[i + j * nrows]
-                    instrumentID = n['instrument_id'][:n['instrument_id'].find('-')]
-                    line += instrumentID.ljust(9)
-                    line += f"{n['7day_funding_rate']:7.3%}"
-                    line += f"{n['30day_funding_rate']:8.3%}"
+                    line += lines[i + j * nrows]
                     if j < ncols - 1:
                         line += '\t'
             funding_rate_file.write(line + '\n')
@@ -158,51 +337,64 @@ class FundingRate:
         """补录最近3个月资金费率
         """
         Record = record.Record('Funding')
-        found = inserted = 0
         task_list = [self.publicAPI.get_funding_history(m) for m in await self.get_instruments_ID()]
+        funding_list = []
         # API results
         for api_funding in await asyncio.gather(*task_list):
-            found += len(api_funding)
+            if not api_funding:
+                continue
             instId = api_funding[0]['instId']
             instrument = instId[:instId.find('-')]
-            pipeline = [{'$match': {'instrument': instrument}}]
-            # Results in DB
-            db_funding = [m for m in Record.mycol.aggregate(pipeline)]
-            for m in api_funding:
-                timestamp = utcfrommillisecs(m['fundingTime'])
-                mydict = dict(instrument=instrument, timestamp=timestamp, funding=float(m['realizedRate']))
-                # Check for duplicate
-                for n in db_funding:
-                    if n['funding'] == float(m['realizedRate']):
-                        if n['timestamp'] == timestamp:
-                            break
-                else:
-                    Record.mycol.insert_one(mydict)
-                    inserted += 1
-        print(f"Found: {found}, Inserted: {inserted}")
+            funding_list += [dict(instrument=instrument, timestamp=utcfrommillisecs(m['fundingTime']),
+                                  funding=safe_float(m['realizedRate'])) for m in api_funding if m.get('realizedRate')]
+        inserted = await Record.bulk_upsert(funding_list, record.FUNDING_KEYS)
+        print(f"Found: {len(funding_list)}, Inserted: {inserted}")
 
-    # @debug_timer
-    async def show_profitable_rate(self, days=7):
-        """显示收益最高十个币种资金费
+    async def profitable_rates(self, days=7, hours=24, top=10) -> np.ndarray:
+        """按预期资金费减开平仓期现差价及手续费排序的前top个币种
+
+        :param days: 资金费平均及持仓天数
+        :param hours: 期现差价统计最近几小时
+        :param top: 币种数
+        :return: ranking_table，列为instrument、funding_rate、apr、open_pd、close_pd、carry及profitability，
+            apr及carry按各币种的收取间隔由日资金费率得出
         """
         assert isinstance(days, int) and 0 < days <= 90
-        funding_rate_list = await self.get_recent_rate(days)
-        funding_rate_list.sort(key=lambda x: x['funding_rate'], reverse=True)
-        funding_rate_list = funding_rate_list[:20]
-        funding_rate_list = [n['instrument'] for n in await Stat().profitability(funding_rate_list, days)]
-        await self.show_selected_rate(funding_rate_list)
+        rates = await self.get_recent_rate(days)
+        premium = await Stat().universe_stat(hours, rates['instrument'].tolist())
+        rates = rates[np.isin(rates['instrument'], list(premium))]
+        coins = rates['instrument'].tolist()
+        funding_rate, daily_rate = rates['funding_rate'], rates['daily_rate']
+        open_pd, close_pd = (np.array([premium[coin][field]['avg'] for coin in coins], dtype=np.float64)
+                             for field in ('open_pd', 'close_pd'))
+        table = ranking_table(coins, funding_rate=funding_rate, apr=daily_rate * 365, open_pd=open_pd,
+                              close_pd=close_pd, carry=daily_rate * days + open_pd - close_pd - 2 * trade_fee,
+                              profitability=np.zeros(len(coins), dtype=np.int64))
+        table = top_k(table, 'carry', top)
+        table['profitability'] = await Stat().profitability(table['instrument'].tolist(), table['funding_rate'], days)
+        return table
+
+    # @debug_timer
+    async def show_profitable_rate(self, days=7, hours=24):
+        """按预期资金费减开平仓期现差价及手续费排序，显示收益最高十个币种
+
+        :param days: 资金费平均及持仓天数
+        :param hours: 期现差价统计最近几小时
+        """
+        table = await self.profitable_rates(days, hours)
+        fprint(coin_carry)
+        for line in format_rows(table, ('instrument', 'funding_rate', 'apr', 'open_pd', 'close_pd', 'carry',
+                                        'profitability'), '{:9s}{:7.3%}{:8.2%}{:8.3%}{:8.3%}{:8.3%}{:14d}'):
+            fprint(line)
+        await self.show_selected_rate(table['instrument'].tolist())
 
     async def show_selected_rate(self, coinlist):
         """显示列表币种当前资金费
         """
-        task_list = [self.publicAPI.get_funding_time(instId=n + '-USDT-SWAP') for n in coinlist]
-        funding_rate_list = []
-        for funding_time in await asyncio.gather(*task_list):
-            instrument = funding_time['instId'][:funding_time['instId'].find('-')]
-            current_rate = float(n) if (n := funding_time['fundingRate']) else 0.
-            estimated_rate = float(n) if (n := funding_time['nextFundingRate']) else 0.
-            funding_rate_list.append(
-                dict(instrument=instrument, current_rate=current_rate, estimated_rate=estimated_rate))
+        rates = await self.current_next_rates([n + '-USDT-SWAP' for n in coinlist])
+        funding_rate_list = [dict(instrument=instId[:instId.find('-')], current_rate=current_rate,
+                                  estimated_rate=estimated_rate)
+                             for instId, (current_rate, estimated_rate) in rates.items()]
 
         funding_rate_list.sort(key=lambda x: x['current_rate'], reverse=True)
         fprint(coin_current_next)
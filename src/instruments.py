@@ -0,0 +1,109 @@
+import json
+import os
+from okx.async_okx_v5.public import PublicAPI
+from src.config import instrument_ttl, store_dir
+from src.ratelimit import LOW, RateLimited, scope
+from src.utils import *
+
+
+class InstrumentRegistry:
+    """全部现货、永续合约规格，按instId索引\n
+    每类产品一次get_instruments读取，保存到store_dir/instruments供下次启动直接使用。
+    超过instrument_ttl秒后在后台刷新，期间仍返回旧规格；表中没有的产品（新上线）单独查询一次。
+    """
+    inst_types = ('SPOT', 'SWAP')
+    # 实盘、模拟盘各一个
+    registries: Dict[bool, 'InstrumentRegistry'] = dict()
+
+    def __init__(self, test: bool):
+        """
+        :param test: 模拟盘
+        """
+        self.publicAPI = RateLimited(PublicAPI(test=test), LOW, scope(test))
+        self.path = os.path.join(store_dir, 'instruments', ('test' if test else 'live') + '.json')
+        self.specs: Dict[str, Dict[str, dict]] = {inst_type: dict() for inst_type in self.inst_types}
+        # 上次全量读取时间，秒
+        self.updated = 0.
+        self.task: Optional[asyncio.Task] = None
+        self.read()
+
+    @classmethod
+    def get(cls, account=3) -> 'InstrumentRegistry':
+        """账号对应的规格表
+
+        :param account: 账号id，3为模拟盘
+        """
+        test = account == 3
+        if (self := cls.registries.get(test)) is None:
+            self = cls.registries[test] = cls(test)
+        return self
+
+    def read(self):
+        """读取上次保存的规格，文件不存在或损坏时为空
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.specs = {inst_type: {n['instId']: n for n in saved[inst_type]} for inst_type in self.inst_types}
+            self.updated = saved['updated']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        """先写临时文件再替换，其他进程不会读到一半
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = f'{self.path}.{os.getpid()}'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(dict(updated=self.updated, **{inst_type: list(self.specs[inst_type].values())
+                                                    for inst_type in self.inst_types}), f)
+        os.replace(temp, self.path)
+
+    def stale(self) -> bool:
+        return time.time() - self.updated > instrument_ttl
+
+    async def refresh(self):
+        """全量读取现货及永续合约规格并保存
+        """
+        results = await asyncio.gather(*[self.publicAPI.get_instruments(inst_type) for inst_type in self.inst_types])
+        self.specs = {inst_type: {n['instId']: n for n in result}
+                      for inst_type, result in zip(self.inst_types, results)}
+        self.updated = time.time()
+        self.save()
+
+    def refreshed(self, task: asyncio.Task):
+        """后台刷新失败时保留旧规格
+        """
+        if not task.cancelled() and (e := task.exception()):
+            fprint(f'{type(self).__name__}.refresh() error')
+            fprint(e)
+
+    async def ready(self):
+        """从未读取过时等待全量读取，过期时在后台刷新，并发调用共用一次读取
+        """
+        if self.task is None or self.task.done():
+            if all(self.specs.values()) and not self.stale():
+                return
+            self.task = asyncio.create_task(self.refresh())
+            self.task.add_done_callback(self.refreshed)
+        if not all(self.specs.values()):
+            await self.task
+
+    async def instrument(self, inst_type: str, instId: str) -> dict:
+        """产品规格，格式同get_specific_instrument
+
+        :param inst_type: 'SPOT'或'SWAP'
+        :param instId: 产品ID
+        """
+        await self.ready()
+        if (spec := self.specs[inst_type].get(instId)) is None:
+            spec = self.specs[inst_type][instId] = await self.publicAPI.get_specific_instrument(inst_type, instId)
+        return spec
+
+    async def instruments(self, inst_type: str) -> List[dict]:
+        """某类全部产品规格
+
+        :param inst_type: 'SPOT'或'SWAP'
+        """
+        await self.ready()
+        return list(self.specs[inst_type].values())
@@ -168,9 +168,6 @@ funding_day = _('Crypto   Funding')
 coin_7_30 = _('Crypto     7 day  30 day')
 # "币种     7天资金费 30天资金费"
 
-coin_funding_value = _('Crypto   Funding     APR Profitability')
-# '币种        资金费     APR  投资价值'
-
 pd_open = _('Premium/discount at open')
 # '开仓期现价差'
 
@@ -401,3 +398,24 @@ input_q_abort = _('Input q to abort\n')
 
 network_interruption = _('Network interruption')
 # "网络中断"
+
+websocket_fallback = _('Websocket stalled. Fall back to REST.')
+# "推送中断，改用REST轮询。"
+backfill_done = _('Back-filled {:d} samples in {:d} gaps')
+# "回补{:d}条行情，共{:d}处空档"
+recorder_running = _('Recorder is already running.')
+# "行情服务已在运行。"
+coin_carry = _('Crypto   Funding     APR   Entry    Exit   Carry Profitability')
+# "币种        资金费     APR    开仓    平仓    收益      投资价值"
+plot_saved = _('Plot saved to {:s}')
+# "图片已保存到{:s}"
+backtest_title = _('Crypto        Opened      Closed   Funding       Fee       PnL   Return')
+# "币种          建仓数量    平仓数量    资金费    手续费      收益   收益率"
+sweep_start = _('Sweeping {:d} coins over {:d} parameter sets')
+# "扫描{:d}个币种，{:d}组参数"
+sweep_title = _('Crypto         PnL   Return  Reb.')
+# "币种          收益   收益率  调仓"
+sweep_ranking = _('  Average')
+# "平均收益率"
+funding_feed_error = _('Funding rate feed interrupted. Fall back to REST: {}')
+# "资金费推送中断，改用REST查询：{}"
@@ -1,3 +1,4 @@
+import multiprocessing
 from okx.async_okx_v5.client import OkxClient
 from okx.async_okx_v5.utils import query_with_pagination
 from src.close_position import ReducePosition
@@ -8,6 +9,7 @@ from src.okex_api import *
 from src.lang import *
 from src.trading_data import Stat
 import src.record as record
+from src.quotes import SharedQuotes
 
 loop = asyncio.get_event_loop()
 
@@ -47,10 +49,9 @@ async def profit_all(accountid: int):
         mon = await Monitor(coin=coin, account=accountid)
         gather_result = await gather(mon.apr(1), mon.apr(7), mon.apr())
         fprint(apr_message.format(coin, *gather_result))
-        funding = stat.history_funding(accountid)
-        cost = stat.history_cost(accountid)
-        localtime = utc_to_local(stat.open_time(accountid))
-        fprint(open_time_pnl.format(localtime.isoformat(timespec='minutes'), funding + cost))
+        pnl = await stat.history_pnl(accountid)
+        localtime = utc_to_local(pnl['open_time'])
+        fprint(open_time_pnl.format(localtime.isoformat(timespec='minutes'), pnl['funding'] + pnl['cost']))
 
 
 async def history_profit(accountid: int):
@@ -61,26 +62,18 @@ async def history_profit(accountid: int):
     Record = record.Record('Ledger')
     pipeline = [{'$match': {'account': accountid}},
                 {'$group': {'_id': '$instrument'}}]
-    temp = [x['_id'] for x in Record.mycol.aggregate(pipeline)]
+    temp = [x['_id'] for x in await Record.acol.aggregate(pipeline)]
     coinlist = await get_coinlist(accountid)
     coinlist = set(temp) - set(coinlist)
     for coin in coinlist:
-        stat = Stat(coin)
-        funding = stat.history_funding(accountid)
-        cost = stat.history_cost(accountid)
-        open_time = stat.open_time(accountid)
-        close_time = stat.close_time(accountid)
-        pipeline = [{'$match': {'account': accountid, 'instrument': coin, 'title': '平仓'}},
-                    {'$sort': {'_id': -1}}, {'$limit': 1}]
-        position = 0
-        for x in Record.mycol.aggregate(pipeline):
-            if 'position' in x: position = x['position']
+        pnl = await Stat(coin).history_pnl(accountid)
+        open_time, close_time, position = pnl['open_time'], pnl['close_time'] or datetime.utcnow(), pnl['position']
         delta = (close_time - open_time).total_seconds()
         apr = 0
         if position:
-            apr = (funding + cost) / position / delta * 86400 * 365
+            apr = (pnl['funding'] + pnl['cost']) / position / delta * 86400 * 365
         fprint(open_close_pnl.format(coin, open_time.isoformat(timespec='minutes'),
-                                     close_time.isoformat(timespec='minutes'), funding + cost, apr))
+                                     close_time.isoformat(timespec='minutes'), pnl['funding'] + pnl['cost'], apr))
 
 
 async def cumulative_profit(accountid: int):
@@ -91,12 +84,10 @@ async def cumulative_profit(accountid: int):
     Record = record.Record('Ledger')
     pipeline = [{'$match': {'account': accountid}},
                 {'$group': {'_id': '$instrument'}}]
-    coinlist = [x['_id'] for x in Record.mycol.aggregate(pipeline)]
+    coinlist = [x['_id'] for x in await Record.acol.aggregate(pipeline)]
     for coin in coinlist:
-        stat = Stat(coin)
-        funding = stat.history_funding(accountid, -1)
-        cost = stat.history_cost(accountid, -1)
-        fprint(cumulative_pnl.format(coin, funding + cost))
+        pnl = await Stat(coin).history_pnl(accountid, -1)
+        fprint(cumulative_pnl.format(coin, pnl['funding'] + pnl['cost']))
 
 
 # @debug_timer
@@ -105,31 +96,20 @@ async def back_track_all(accountid: int):
 
     :param accountid: 账号id
     """
-    Ledger = record.Record('Ledger')
+    Ledger = record.Ledger()
     coinlist = await get_coinlist(accountid)
     mon = await Monitor(account=accountid)
     # API results
     api_ledger = await query_with_pagination(mon.accountAPI.get_archive_ledger, tag='billId', page_size=100, count=0,
                                              instType='SWAP', ccy='USDT', type='8')
+    ledger = {coin: [] for coin in coinlist}
+    for item in api_ledger:
+        if (coin := item['instId'][:item['instId'].find('-')]) in ledger:
+            timestamp = datetime.utcfromtimestamp(float(item['ts']) / 1000)
+            ledger[coin].append(dict(account=accountid, instrument=coin, timestamp=timestamp, title='资金费',
+                                     billId=item['billId'], funding=float(item['pnl'])))
     for coin in coinlist:
-        pipeline = [{'$match': {'account': accountid, 'instrument': coin, 'title': '资金费'}}]
-        # Results in DB
-        db_ledger = [n for n in Ledger.mycol.aggregate(pipeline)]
-        inserted = 0
-        for item in api_ledger:
-            if item['instId'] == coin + '-USDT-SWAP':
-                realized_rate = float(item['pnl'])
-                timestamp = datetime.utcfromtimestamp(float(item['ts']) / 1000)
-                mydict = dict(account=accountid, instrument=coin, timestamp=timestamp, title='资金费',
-                              funding=realized_rate)
-                # 查重
-                for n in db_ledger:
-                    if n['funding'] == realized_rate:
-                        if n['timestamp'] == timestamp:
-                            break
-                else:
-                    Ledger.mycol.insert_one(mydict)
-                    inserted += 1
+        inserted = await Ledger.bulk_upsert(ledger[coin], record.LEDGER_FUNDING_KEYS)
         fprint(back_track_funding.format(coin, inserted))
 
 
@@ -141,8 +121,8 @@ async def close_all(accountid: int):
     fundingRate = FundingRate(accountid)
     for coin in await get_coinlist(accountid):
         stat = Stat(coin=coin)
-        if recent := stat.recent_close_stat(4):
-            close_pd = recent['avg'] - 2 * recent['std']
+        if recent := await stat.recent_close_stat(4):
+            close_pd = await stat.close_threshold(4, 2)
             fprint(funding_close.format(coin, await fundingRate.current(coin + '-USDT-SWAP'),
                                         recent['avg'], recent['std'], recent['min'], close_pd))
             reducePosition = await ReducePosition(coin=coin, account=accountid)
@@ -160,8 +140,8 @@ async def import_position(accountid: int, coin: str):
             continue
         timestamp = datetime.utcnow()
         mydict = dict(account=accountid, instrument=coin, timestamp=timestamp, title='开仓')
-        record.Record('Ledger').insert(mydict)
-        record.Record('Portfolio').mycol.insert_one(dict(account=accountid, instrument=coin, leverage=leverage))
+        await record.Ledger().insert(mydict)
+        await record.Record('Portfolio').acol.insert_one(dict(account=accountid, instrument=coin, leverage=leverage))
         addPosition = await AddPosition(coin=coin, account=accountid)
         await addPosition.adjust_swap_lever(leverage)
         fprint(imported)
@@ -177,7 +157,7 @@ async def get_coinlist(accountid: int):
     Record = record.Record('Ledger')
     pipeline = [{'$match': {'account': accountid}},
                 {'$group': {'_id': '$instrument'}}]
-    coinlist = [x['_id'] for x in Record.mycol.aggregate(pipeline)]
+    coinlist = [x['_id'] for x in await Record.acol.aggregate(pipeline)]
     if not coinlist:
         fprint(empty_db, end='')
         while True:
@@ -203,6 +183,7 @@ async def main_menu(accountid: int):
     try:
         assert isinstance(accountid, int)
         fprint(f'{accountid=}')
+        record.Record.ensure_indexes()
         while (command := await ainput(loop, main_menu_text)) != 'q':
             if command == '1':
                 _ = await Monitor(coin='BTC', account=accountid)
@@ -216,6 +197,10 @@ async def main_menu(accountid: int):
             elif command == '4':
                 await account_menu(accountid)
             elif command == '5':
+                # 已有独立行情服务python -m src.record
+                if SharedQuotes.attach():
+                    fprint(recorder_running)
+                    continue
                 multiprocessing.set_start_method('spawn', True)
                 process = multiprocessing.Process(target=record.record_ticker, args=(accountid,))
                 process.start()
@@ -263,8 +248,7 @@ async def crypto_menu(accountid: int):
                 addPosition = await AddPosition(coin=coin, account=accountid)
                 stat = Stat(coin)
                 hours = 2
-                if recent := stat.recent_open_stat(hours):
-                    open_pd = recent['avg'] + 2 * recent['std']
+                if (open_pd := await stat.open_threshold(hours, 2)) is not None:
                     add_task = await addPosition.open(usdt_size=usdt, leverage=leverage, price_diff=open_pd,
                                                       accelerate_after=hours)
 
@@ -286,8 +270,7 @@ async def crypto_menu(accountid: int):
                 reducePosition = await ReducePosition(coin=coin, account=accountid)
                 stat = Stat(coin)
                 hours = 2
-                if recent := stat.recent_close_stat(hours):
-                    close_pd = recent['avg'] - 2 * recent['std']
+                if (close_pd := await stat.close_threshold(hours, 2)) is not None:
                     await reducePosition.reduce(usdt_size=usdt, price_diff=close_pd, accelerate_after=hours)
                 else:
                     fprint(fetch_ticker_first)
@@ -308,8 +291,7 @@ async def crypto_menu(accountid: int):
             reducePosition = await ReducePosition(coin=coin, account=accountid)
             stat = Stat(coin)
             hours = 2
-            if recent := stat.recent_close_stat(hours):
-                close_pd = recent['avg'] - 2 * recent['std']
+            if (close_pd := await stat.close_threshold(hours, 2)) is not None:
                 await reducePosition.close(price_diff=close_pd, accelerate_after=hours)
             else:
                 fprint(fetch_ticker_first)
@@ -322,11 +304,9 @@ async def crypto_menu(accountid: int):
                 apys = map(apy, aprs)
                 fprint(apr_message.format(coin, *aprs))
                 fprint(apy_message.format(coin, *apys))
-                stat = Stat(coin)
-                funding = stat.history_funding(accountid)
-                cost = stat.history_cost(accountid)
-                localtime = utc_to_local(stat.open_time(accountid))
-                fprint(open_time_pnl.format(localtime.isoformat(timespec='minutes'), funding + cost))
+                pnl = await Stat(coin).history_pnl(accountid)
+                localtime = utc_to_local(pnl['open_time'])
+                fprint(open_time_pnl.format(localtime.isoformat(timespec='minutes'), pnl['funding'] + pnl['cost']))
         elif command == '7':
             while True:
                 try:
@@ -335,10 +315,8 @@ async def crypto_menu(accountid: int):
                 except:
                     continue
                 stat = Stat(coin)
-                if stat.recent_open_stat(hours):
-                    stat.plot(hours)
-                    stat.gaussian_dist(hours, 'o')
-                    stat.gaussian_dist(hours, 'c')
+                if await stat.recent_open_stat(hours):
+                    await gather(stat.plot(hours), stat.gaussian_dist(hours, 'o'), stat.gaussian_dist(hours, 'c'))
                 else:
                     fprint(fetch_ticker_first)
                 break
@@ -410,8 +388,7 @@ async def account_menu(accountid: int):
                         pass
                     else:
                         continue
-            Record = record.Record('Ledger')
-            delete_result = Record.mycol.delete_many(dict(account=accountid, instrument=coin))
+            delete_result = await record.Ledger().delete_many(dict(account=accountid, instrument=coin))
             fprint(deleted.format(delete_result.deleted_count))
         elif command == 'b':
             break
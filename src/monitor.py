@@ -3,6 +3,7 @@ from src.funding_rate import FundingRate
 from src.open_position import AddPosition
 from src.okex_api import *
 from src.trading_data import Stat
+from src.record import LEDGER_FUNDING_KEYS
 
 
 # 监控一个币种，如果当期资金费+预测资金费小于重新开仓成本（开仓期现差价-平仓期现差价-手续费），进行平仓。
@@ -14,6 +15,8 @@ class Monitor(OKExAPI):
 
     def __init__(self, coin=None, account=3):
         super().__init__(coin=coin, account=account)
+        # (side, hours, k) -> 上次得到的期现差价阈值
+        self.thresholds: Dict[tuple, float] = dict()
 
     async def apr(self, days=0):
         """最近年利率
@@ -30,16 +33,12 @@ class Monitor(OKExAPI):
         size = position * last + margin + upl
 
         if size > 10:
+            pnl = await stat.history_pnl(self.account, days)
             if days == 0:
-                open_time = stat.open_time(self.account)
-                delta = (datetime.utcnow() - open_time).total_seconds()
-                funding = stat.history_funding(self.account)
-                cost = stat.history_cost(self.account)
-                apr = (funding + cost) / size / delta * 86400 * 365
+                delta = (datetime.utcnow() - pnl['open_time']).total_seconds()
+                apr = (pnl['funding'] + pnl['cost']) / size / delta * 86400 * 365
             else:
-                funding = stat.history_funding(self.account, days)
-                cost = stat.history_cost(self.account, days)
-                apr = (funding + cost) / size / days * 365
+                apr = (pnl['funding'] + pnl['cost']) / size / days * 365
         else:
             apr = 0.
         return apr
@@ -47,7 +46,7 @@ class Monitor(OKExAPI):
     async def record_funding(self):
         """记录最近一次资金费
         """
-        Ledger = Record('Ledger')
+        Ledger = record.Ledger()
         ledger = await self.accountAPI.get_ledger(instType='SWAP', ccy='USDT', type='8')
         realized_rate = 0.
         for item in ledger:
@@ -55,8 +54,8 @@ class Monitor(OKExAPI):
                 realized_rate = float(item['pnl'])
                 timestamp = datetime.utcfromtimestamp(float(item['ts']) / 1000)
                 mydict = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='资金费',
-                              funding=realized_rate)
-                Ledger.mycol.find_one_and_replace(mydict, mydict, upsert=True)
+                              billId=item['billId'], funding=realized_rate)
+                await Ledger.bulk_upsert([mydict], LEDGER_FUNDING_KEYS)
                 break
         fprint(lang.received_funding.format(self.coin, realized_rate))
 
@@ -68,12 +67,28 @@ class Monitor(OKExAPI):
             # fprint(lang.nonexistent_position.format(swap_ID))
             return False
         else:
-            result = Record('Ledger').find_last(dict(account=self.account, instrument=self.coin))
+            result = await Record('Ledger').find_last(dict(account=self.account, instrument=self.coin))
             if result and result['title'] == '平仓':
                 fprint(lang.has_closed.format(self.swap_ID))
                 return False
         return True
 
+    async def threshold(self, stat: Stat, side: str, hours=4, k=2.) -> Optional[float]:
+        """监控用的期现差价阈值，不按采样覆盖率过滤，行情中断后仍能减仓；没有近期数据时沿用上次的阈值
+
+        :param stat: 该币种的Stat
+        :param side: 'open'或'close'
+        :param hours: 最近几小时
+        :param k: 标准差倍数
+        """
+        method = stat.open_threshold if side == 'open' else stat.close_threshold
+        key = (side, hours, k)
+        if (value := await method(hours, k, coverage=0)) is not None:
+            self.thresholds[key] = value
+        elif (value := self.thresholds.get(key)) is None:
+            fprint(lang.fetch_ticker_first)
+        return value
+
     @manager.submit
     async def watch(self):
         """监控仓位，自动加仓、减仓
@@ -86,11 +101,11 @@ class Monitor(OKExAPI):
         addPosition: Optional[AddPosition] = None
         reducePosition: Optional[ReducePosition] = None
         stat = Stat(self.coin)
-        Ledger = Record('Ledger')
+        Ledger = record.Ledger()
         # OP = Record('OP')
 
         # Obtain leverage
-        portfolio = Record('Portfolio').mycol.find_one(dict(account=self.account, instrument=self.coin))
+        portfolio = await Record('Portfolio').acol.find_one(dict(account=self.account, instrument=self.coin))
         assert portfolio is not None, f"{self.coin}"
         leverage = portfolio['leverage']
         if 'size' not in portfolio:
@@ -137,14 +152,14 @@ class Monitor(OKExAPI):
                     if not liquidation_price:
                         fprint(lang.has_closed.format(self.swap_ID))
                         mydict = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='平仓')
-                        Ledger.mycol.insert_one(mydict)
-                        Record('Portfolio').mycol.delete_one(dict(account=self.account, instrument=self.coin))
+                        await Ledger.insert_one(mydict)
+                        await Record('Portfolio').acol.delete_one(dict(account=self.account, instrument=self.coin))
                         return
 
-                    assert (recent := stat.recent_open_stat()), lang.fetch_ticker_first
-                    open_pd = recent['avg'] + recent['std']
-                    recent = stat.recent_close_stat()
-                    close_pd = recent['avg'] - recent['std']
+                    open_pd = await self.threshold(stat, 'open', k=1)
+                    close_pd = await self.threshold(stat, 'close', k=1)
+                    if open_pd is None or close_pd is None:
+                        continue
                     cost = open_pd - close_pd + 2 * trade_fee
                     # Expected funding rates too low.
                     if (timestamp.hour + 4) % 8 == 0 and current_rate + next_rate < cost:
@@ -158,7 +173,7 @@ class Monitor(OKExAPI):
                         return
                 # Update price every 10s.
                 elif event == ten_seconds:
-                    swap_ticker = await self.publicAPI.get_specific_ticker(self.swap_ID)
+                    swap_ticker = await self.get_ticker(self.swap_ID)
                     last = float(swap_ticker['last'])
                     # 线程未创建
                     if not task_started:
@@ -169,14 +184,13 @@ class Monitor(OKExAPI):
                                 fprint(lang.hedge_fail.format(self.coin, spot, swap))
                                 self.exit_flag = True
                                 continue
+                            # 期现差价控制在2个标准差，先取阈值再记账
+                            if (close_pd := await self.threshold(stat, 'close', k=2)) is None:
+                                continue
                             fprint(lang.approaching_liquidation)
                             mydict = dict(account=self.account, instrument=self.coin, timestamp=timestamp,
                                           title='自动减仓')
-                            Ledger.mycol.insert_one(mydict)
-
-                            # 期现差价控制在2个标准差
-                            assert (recent := stat.recent_close_stat()), lang.fetch_ticker_first
-                            close_pd = recent['avg'] - 2 * recent['std']
+                            await Ledger.insert_one(mydict)
 
                             swap_position = await self.swap_position()
                             target_size = swap_position / (leverage + 1) ** 2
@@ -195,14 +209,13 @@ class Monitor(OKExAPI):
                                 fprint(lang.hedge_fail.format(self.coin, spot, swap))
                                 self.exit_flag = True
                                 continue
+                            # 期现差价控制在2个标准差，先取阈值再记账
+                            if (open_pd := await self.threshold(stat, 'open', k=2)) is None:
+                                continue
                             fprint(lang.too_much_margin)
                             mydict = dict(account=self.account, instrument=self.coin, timestamp=timestamp,
                                           title='自动加仓')
-                            Ledger.mycol.insert_one(mydict)
-
-                            # 期现差价控制在2个标准差
-                            assert (recent := stat.recent_open_stat()), lang.fetch_ticker_first
-                            open_pd = recent['avg'] + 2 * recent['std']
+                            await Ledger.insert_one(mydict)
 
                             if not addPosition:
                                 addPosition = await AddPosition(self.coin, self.account)
@@ -222,16 +235,13 @@ class Monitor(OKExAPI):
                     else:
                         # 如果减仓时间过长，加速减仓
                         if reducing and not reduce_task.done():
-                            # 迫近下下级杠杆
-                            if liquidation_price < last * (1 + 1 / (leverage + 2)) and not accelerated:
+                            # 迫近下下级杠杆，取到阈值后才停止当前减仓
+                            if liquidation_price < last * (1 + 1 / (leverage + 2)) and not accelerated and \
+                                    (close_pd := await self.threshold(stat, 'close', 1, 1.5)) is not None:
                                 # 已加速就不另开线程
                                 reducePosition.exitFlag = True
                                 while not reduce_task.done():
                                     await asyncio.sleep(0.1)
-
-                                assert (recent := stat.recent_close_stat(1)), lang.fetch_ticker_first
-                                close_pd = recent['avg'] - 1.5 * recent['std']
-
                                 liquidation_price, swap_position = await gather(self.liquidation_price(),
                                                                                 self.swap_position())
                                 target_size = swap_position * (1 - liquidation_price / last / (1 + 1 / leverage))
@@ -240,14 +250,11 @@ class Monitor(OKExAPI):
                                 accelerated = True
                                 time_to_accelerate = datetime.utcnow() + timedelta(hours=2)
 
-                            if timestamp > time_to_accelerate:
+                            if timestamp > time_to_accelerate and \
+                                    (close_pd := await self.threshold(stat, 'close', 2, 2)) is not None:
                                 reducePosition.exitFlag = True
                                 while not reduce_task.done():
                                     await asyncio.sleep(0.1)
-
-                                assert (recent := stat.recent_close_stat(2)), lang.fetch_ticker_first
-                                close_pd = recent['avg'] - 2 * recent['std']
-
                                 liquidation_price, swap_position = await gather(self.liquidation_price(),
                                                                                 self.swap_position())
                                 target_size = swap_position * (1 - liquidation_price / last / (1 + 1 / leverage))
@@ -255,14 +262,11 @@ class Monitor(OKExAPI):
                                 reducing = True
                                 time_to_accelerate = datetime.utcnow() + timedelta(hours=2)
                         elif adding and not add_task.done():
-                            if timestamp > time_to_accelerate:
+                            if timestamp > time_to_accelerate and \
+                                    (open_pd := await self.threshold(stat, 'open', 2, 2)) is not None:
                                 addPosition.exitFlag = True
                                 while not add_task.done():
                                     await asyncio.sleep(0.1)
-
-                                assert (recent := stat.recent_open_stat(2)), lang.fetch_ticker_first
-                                open_pd = recent['avg'] + 2 * recent['std']
-
                                 # liquidation_price = await self.liquidation_price()
                                 # swap_position = await self.swap_position()
                                 # target_size = swap_position * (liquidation_price / last / (1 + 1 / leverage) - 1)
@@ -1,10 +1,15 @@
 from okx.async_okx_v5.account import AccountAPI
+from okx.async_okx_v5.channel import TickersChannel
 from okx.async_okx_v5.public import PublicAPI
 from okx.async_okx_v5.trade import TradeAPI
 from okx.async_okx_v5.exceptions import OkexException, OkexAPIException
 from okx.async_okx_v5.websocket import OkxWebsocket
 from src.config import Key
+from src.instruments import InstrumentRegistry
+import src.record as record
 from src.record import Record
+from src.quotes import SharedQuotes
+from src.ratelimit import HIGH, NORMAL, RateLimited, scope
 from src.manager import *
 from asyncio import create_task, gather
 
@@ -32,15 +37,18 @@ class OKExAPI:
             secret_key = apikey.secret_key
             passphrase = apikey.passphrase
             OKExAPI.__key = dict(api_key=api_key, passphrase=passphrase, secret_key=secret_key)
+            # 下单优先于查询及全市场筛选，私有接口按账号限速
+            key = (api_key, secret_key, passphrase)
+            private, public = scope(account == 3, account), scope(account == 3)
             if account == 3:
-                OKExAPI.accountAPI = AccountAPI(api_key, secret_key, passphrase, test=True)
-                OKExAPI.tradeAPI = TradeAPI(api_key, secret_key, passphrase, test=True)
-                OKExAPI.publicAPI = PublicAPI(test=True)
+                OKExAPI.accountAPI = RateLimited(AccountAPI(*key, test=True), NORMAL, private)
+                OKExAPI.tradeAPI = RateLimited(TradeAPI(*key, test=True), HIGH, private)
+                OKExAPI.publicAPI = RateLimited(PublicAPI(test=True), NORMAL, public)
                 OKExAPI.websocketAPI = OkxWebsocket(api_key, secret_key, passphrase, test=True)
             else:
-                OKExAPI.accountAPI = AccountAPI(api_key, secret_key, passphrase)
-                OKExAPI.tradeAPI = TradeAPI(api_key, secret_key, passphrase)
-                OKExAPI.publicAPI = PublicAPI()
+                OKExAPI.accountAPI = RateLimited(AccountAPI(*key), NORMAL, private)
+                OKExAPI.tradeAPI = RateLimited(TradeAPI(*key), HIGH, private)
+                OKExAPI.publicAPI = RateLimited(PublicAPI(), NORMAL, public)
                 OKExAPI.websocketAPI = OkxWebsocket(api_key, secret_key, passphrase)
             OKExAPI.api_initiated = True
 
@@ -90,11 +98,33 @@ class OKExAPI:
         return OKExAPI.__key
 
     async def spot_inst(self):
-        return await self.publicAPI.get_specific_instrument('SPOT', self.spot_ID)
+        return await InstrumentRegistry.get(self.account).instrument('SPOT', self.spot_ID)
 
     async def swap_inst(self, swap_ID=None):
         if not swap_ID: swap_ID = self.swap_ID
-        return await self.publicAPI.get_specific_instrument('SWAP', swap_ID)
+        return await InstrumentRegistry.get(self.account).instrument('SWAP', swap_ID)
+
+    async def get_ticker(self, instId: str) -> dict:
+        """最新行情，行情服务运行时读取共享内存
+
+        :param instId: 产品ID
+        """
+        if (quotes := SharedQuotes.attach()) and (ticker := quotes.ticker(instId)):
+            return ticker
+        return await self.publicAPI.get_specific_ticker(instId)
+
+    async def subscribe_tickers(self, instIds: List[str]):
+        """tickers行情流，行情服务运行时轮询共享内存，心跳中断后改为订阅websocket
+
+        :param instIds: 产品ID
+        """
+        if (quotes := SharedQuotes.attach()) and all(instId in quotes.index for instId in instIds):
+            async for ticker in quotes.subscribe(instIds):
+                yield ticker
+        subscription = await self.websocketAPI.subscribe_public(
+            [TickersChannel(channel='tickers', instId=instId) for instId in instIds])
+        async for ticker in subscription:
+            yield ticker
 
     async def check_account_level(self):
         """检查账户模式，需开通合约交易
@@ -142,7 +172,8 @@ class OKExAPI:
                 or (timestamp.hour % 8 == 0 and timestamp.minute == 0 and timestamp.second < 30))
 
     async def funding_settled(self):
-        while (await self.swap_inst())['state'] == 'settlement':
+        # 合约状态需实时查询
+        while (await self.publicAPI.get_specific_instrument('SWAP', self.swap_ID))['state'] == 'settlement':
             await asyncio.sleep(1)
 
     async def swap_holding(self, swap_ID=None):
@@ -220,9 +251,9 @@ class OKExAPI:
         last = holding['last']
         position = - holding['pos'] * float(self.swap_info['ctVal'])
         size = position * last + margin + upl
-        portfolio = Portfolio.mycol.find_one(dict(account=self.account, instrument=self.coin))
+        portfolio = await Portfolio.acol.find_one(dict(account=self.account, instrument=self.coin))
         portfolio['size'] = size
-        Portfolio.mycol.find_one_and_replace(dict(account=self.account, instrument=self.coin), portfolio)
+        await Portfolio.acol.find_one_and_replace(dict(account=self.account, instrument=self.coin), portfolio)
         return portfolio
 
     async def add_margin(self, transfer_amount):
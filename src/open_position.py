@@ -1,4 +1,3 @@
-from okx.async_okx_v5.channel import TickersChannel
 from src.okex_api import *
 from src.trading_data import Stat
 
@@ -82,8 +81,8 @@ class AddPosition(OKExAPI):
 
             notional_lever = float(f'{notional_lever:.2f}')
             if await self.set_swap_lever(notional_lever):
-                Record('Portfolio').mycol.find_one_and_update(dict(account=self.account, instrument=self.coin),
-                                                              {'$set': {'leverage': leverage}}, upsert=True)
+                await Record('Portfolio').acol.find_one_and_update(dict(account=self.account, instrument=self.coin),
+                                                                   {'$set': {'leverage': leverage}}, upsert=True)
 
             holding = await self.swap_holding()
             margin = holding['margin']
@@ -119,7 +118,7 @@ class AddPosition(OKExAPI):
         """
         if not leverage: leverage = await self.get_lever()
         if usdt_size:
-            last = float((await self.publicAPI.get_specific_ticker(self.spot_ID))['last'])
+            last = float((await self.get_ticker(self.spot_ID))['last'])
             target_position = usdt_size * leverage / (leverage + 1) / last
         else:
             target_position = target_size
@@ -142,12 +141,9 @@ class AddPosition(OKExAPI):
 
         OP = Record('OP')
         mydict = dict(account=self.account, instrument=self.coin, op='add', size=target_position)
-        OP.insert(mydict)
+        await OP.insert(mydict)
 
-        tickers_subscription = await self.websocketAPI.subscribe_public(
-            [TickersChannel(channel='tickers', instId=self.spot_ID),
-             TickersChannel(channel='tickers', instId=self.swap_ID)]
-        )
+        tickers_subscription = self.subscribe_tickers([self.spot_ID, self.swap_ID])
         spot_ticker = swap_ticker = None
         self.exit_flag = False
 
@@ -160,8 +156,9 @@ class AddPosition(OKExAPI):
                 # 判断是否加速
                 if accelerate_after and datetime.utcnow() > time_to_accelerate:
                     stat = Stat(self.coin)
-                    assert (recent := stat.recent_open_stat(accelerate_after)), lang.fetch_ticker_first
-                    price_diff = recent['avg'] + 2 * recent['std']
+                    # 不按采样覆盖率过滤，没有近期数据时沿用原阈值
+                    if (threshold := await stat.open_threshold(accelerate_after, 2, coverage=0)) is not None:
+                        price_diff = threshold
                     time_to_accelerate = datetime.utcnow() + timedelta(hours=accelerate_after)
 
                 ticker = ticker['data'][0]
@@ -349,7 +346,7 @@ class AddPosition(OKExAPI):
                                            lang.remaining.format(target_position))
                                     mydict = dict(account=self.account, instrument=self.coin, op='add',
                                                   size=target_position_prev)
-                                    OP.mycol.find_one_and_update(mydict, {'$set': {'size': target_position}})
+                                    await OP.acol.find_one_and_update(mydict, {'$set': {'size': target_position}})
                                 else:
                                     fprint(lang.hedge_fail.format(self.coin, spot_filled, swap_filled))
                                     self.exit_flag = True
@@ -370,7 +367,7 @@ class AddPosition(OKExAPI):
                             pass
 
         if spot_notional:
-            Ledger = Record('Ledger')
+            Ledger = record.Ledger()
             timestamp = datetime.utcnow()
             mydict1 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='现货买入',
                            spot_notional=spot_notional)
@@ -378,10 +375,10 @@ class AddPosition(OKExAPI):
                            swap_notional=swap_notional)
             mydict3 = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='手续费',
                            fee=fee_total)
-            Ledger.mycol.insert_many([mydict1, mydict2, mydict3])
+            await Ledger.insert_many([mydict1, mydict2, mydict3])
 
         mydict = dict(account=self.account, instrument=self.coin, op='add')
-        OP.delete(mydict)
+        await OP.delete(mydict)
         await self.update_portfolio()
         fprint(lang.added_amount.format(swap_filled_sum, self.coin))
         if await self.is_hedged():
@@ -405,21 +402,21 @@ class AddPosition(OKExAPI):
         :return: 建仓金额
         :rtype: float
         """
-        Ledger = Record('Ledger')
-        result = Ledger.find_last(dict(account=self.account, instrument=self.coin))
+        Ledger = record.Ledger()
+        result = await Ledger.find_last(dict(account=self.account, instrument=self.coin))
         if result and result['title'] != '平仓' and (swap_position := await self.swap_position()):
             fprint(lang.position_exist.format(swap_position, self.coin))
             return await self.add(usdt_size=usdt_size, price_diff=price_diff, accelerate_after=accelerate_after)
         else:
             usdt_balance = await self.usdt_balance()
             if target_size:
-                last = float((await self.publicAPI.get_specific_ticker(self.spot_ID))['last'])
+                last = float((await self.get_ticker(self.spot_ID))['last'])
                 usdt_size = last * target_size * (1 + 1 / leverage)
             if usdt_balance >= usdt_size:
                 timestamp = datetime.utcnow()
                 mydict = dict(account=self.account, instrument=self.coin, timestamp=timestamp, title='开仓')
-                Ledger.insert(mydict)
-                Record('Portfolio').mycol.insert_one(
+                await Ledger.insert(mydict)
+                await Record('Portfolio').acol.insert_one(
                     dict(account=self.account, instrument=self.coin, leverage=leverage))
                 await self.set_swap_lever(leverage)
                 return await self.add(usdt_size=usdt_size, price_diff=price_diff, accelerate_after=accelerate_after)
@@ -0,0 +1,235 @@
+from multiprocessing import resource_tracker, shared_memory
+import os
+from src.utils import *
+import numpy as np
+
+
+class QuoteTable:
+    """全币种最新现货、合约买一卖一价格及挂单量表
+    """
+
+    def __init__(self, instrumentsID: List[str]):
+        """
+        :param instrumentsID: 合约列表
+        """
+        self.instrument = [swap_ID[:swap_ID.find('-')] for swap_ID in instrumentsID]
+        # instId -> (行, 列偏移)，现货占0、1列，合约占2、3列
+        self.index = dict()
+        for row, coin in enumerate(self.instrument):
+            self.index[coin + '-USDT'] = (row, 0)
+            self.index[coin + '-USDT-SWAP'] = (row, 2)
+        # spot_bid, spot_ask, swap_bid, swap_ask
+        self.prices = np.zeros((len(self.instrument), 4), dtype=np.float64)
+        # 对应的挂单量
+        self.sizes = np.zeros((len(self.instrument), 4), dtype=np.float64)
+        self.changed = np.zeros(len(self.instrument), dtype=bool)
+        self.last_update = time.monotonic()
+
+    def update(self, ticker: dict) -> bool:
+        """更新一条tickers频道推送
+
+        :param ticker: 推送数据
+        :return: 报价是否变化
+        """
+        if (n := self.index.get(ticker['instId'])) is None:
+            return False
+        row, col = n
+        self.last_update = time.monotonic()
+        bid, ask = safe_float(ticker['bidPx']), safe_float(ticker['askPx'])
+        self.sizes[row, col] = safe_float(ticker['bidSz'])
+        self.sizes[row, col + 1] = safe_float(ticker['askSz'])
+        if self.prices[row, col] == bid and self.prices[row, col + 1] == ask:
+            return False
+        self.prices[row, col] = bid
+        self.prices[row, col + 1] = ask
+        self.changed[row] = True
+        return True
+
+    def snapshot(self, timestamp: int, changed_only=False):
+        """当前报价快照，格式同record.join_tickers
+
+        :param timestamp: 采样时间，毫秒
+        :param changed_only: 只返回上次快照后变化的币种
+        :rtype: dict
+        """
+        valid = np.all(self.prices > 0, axis=1)
+        if changed_only:
+            valid &= self.changed
+        self.changed[:] = False
+        spot_bid, spot_ask, swap_bid, swap_ask = self.prices[valid].T
+        spot_bid_sz, spot_ask_sz, swap_bid_sz, swap_ask_sz = self.sizes[valid].T
+        return dict(instrument=[coin for coin, n in zip(self.instrument, valid) if n],
+                    timestamp=np.full(len(spot_bid), timestamp, dtype=np.int64),
+                    spot_bid=spot_bid, spot_ask=spot_ask, swap_bid=swap_bid, swap_ask=swap_ask,
+                    open_pd=(swap_bid - spot_ask) / spot_ask, close_pd=(swap_ask - spot_bid) / spot_bid,
+                    spot_bid_sz=spot_bid_sz, spot_ask_sz=spot_ask_sz, swap_bid_sz=swap_bid_sz, swap_ask_sz=swap_ask_sz)
+
+
+class SharedQuotes:
+    """共享内存最新行情表，行情服务写入，其他进程只读\n
+    布局：表头int64[magic, 行数, 心跳毫秒, pid, 心跳间隔毫秒]，instId定长字节，每行序号、时间戳及
+    bidPx, bidSz, askPx, askSz, last。写入前后各将序号加一（seqlock），
+    读取时序号为奇数或前后不一致则重读。
+    """
+    name = 'okex_quotes'
+    magic = 0x4F4B5852
+    fields = ('bidPx', 'bidSz', 'askPx', 'askSz', 'last')
+    readers: Dict[str, 'SharedQuotes'] = dict()
+
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int):
+        self.shm = shm
+        offset = 0
+
+        def view(dtype, shape):
+            nonlocal offset
+            arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            offset += arr.nbytes
+            return arr
+
+        self.header = view(np.int64, 5)
+        self.names = view('S32', capacity)
+        self.seq = view(np.int64, capacity)
+        self.timestamp = view(np.int64, capacity)
+        self.values = view(np.float64, (capacity, len(self.fields)))
+        self.index = {n.decode(): i for i, n in enumerate(self.names.tolist())}
+
+    @classmethod
+    def size(cls, capacity: int):
+        return 5 * 8 + capacity * (32 + 8 + 8 + 8 * len(cls.fields))
+
+    @classmethod
+    def create(cls, instIds: List[str], interval=1., name=None) -> 'SharedQuotes':
+        """行情服务创建共享内存，替换已有的同名表
+
+        :param instIds: 产品ID
+        :param interval: 心跳间隔，秒，即采样间隔
+        :param name: 共享内存名
+        """
+        name = name or cls.name
+        try:
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name, create=True, size=cls.size(len(instIds)))
+        self = cls(shm, len(instIds))
+        self.names[:] = [n.encode() for n in instIds]
+        self.index = {n: i for i, n in enumerate(instIds)}
+        self.header[:] = [cls.magic, len(instIds), 0, os.getpid(), int(interval * 1000)]
+        return self
+
+    @classmethod
+    def attach(cls, name=None, stale=None) -> Optional['SharedQuotes']:
+        """读取方连接共享内存，行情服务未运行或心跳超时返回None
+
+        :param name: 共享内存名
+        :param stale: 心跳超时秒数，默认按行情服务的心跳间隔
+        """
+        name = name or cls.name
+        if (self := cls.readers.get(name)) and not self.stale(stale):
+            return self
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return None
+        # 只读方不负责删除，避免进程退出时resource_tracker销毁行情服务的共享内存
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray(5, dtype=np.int64, buffer=shm.buf)
+        # 行情服务自身不作为读取方
+        if header[0] != cls.magic or header[3] == os.getpid():
+            shm.close()
+            return None
+        self = cls(shm, int(header[1]))
+        if self.stale(stale):
+            return None
+        # 旧表可能仍有行情流在读，由引用计数释放
+        cls.readers[name] = self
+        return self
+
+    def timeout(self) -> float:
+        """默认心跳超时秒数，心跳间隔的3倍，至少10秒
+        """
+        return max(10., 3 * self.header[4] / 1000)
+
+    def stale(self, seconds=None) -> bool:
+        """心跳超过seconds秒未更新
+
+        :param seconds: 默认timeout()
+        """
+        if seconds is None:
+            seconds = self.timeout()
+        return time.time() * 1000 - self.header[2] > seconds * 1000
+
+    def heartbeat(self):
+        self.header[2] = int(time.time() * 1000)
+
+    def publish(self, ticker: dict):
+        """写入一条tickers推送或REST行情
+
+        :param ticker: 行情
+        """
+        if (row := self.index.get(ticker['instId'])) is None:
+            return
+        self.seq[row] += 1
+        self.timestamp[row] = int(ticker['ts'])
+        self.values[row] = [safe_float(ticker[field]) for field in self.fields]
+        self.seq[row] += 1
+        self.heartbeat()
+
+    def read(self, row: int, retry=1000):
+        """一致地读取一行
+
+        :param row: 行号
+        :param retry: 最多重读次数
+        :return: (序号, 时间戳, 数值)，未写入或写入方停在写入中途时序号为0
+        """
+        for _ in range(retry):
+            seq = int(self.seq[row])
+            if seq & 1:
+                continue
+            timestamp, values = int(self.timestamp[row]), self.values[row].tolist()
+            if int(self.seq[row]) == seq:
+                return seq, timestamp, values
+        return 0, 0, []
+
+    def ticker(self, instId: str) -> Optional[dict]:
+        """最新行情，格式同tickers频道推送，数值为字符串
+
+        :param instId: 产品ID
+        """
+        if (row := self.index.get(instId)) is None:
+            return None
+        seq, timestamp, values = self.read(row)
+        if not seq:
+            return None
+        ticker = dict(instId=instId, ts=str(timestamp))
+        ticker.update({field: np.format_float_positional(value, trim='-') for field, value in zip(self.fields, values)})
+        return ticker
+
+    async def subscribe(self, instIds: List[str], interval=0.05, stale=None):
+        """轮询共享内存，行情变化时产生与tickers频道相同格式的消息，心跳超时后结束
+
+        :param instIds: 产品ID
+        :param interval: 轮询间隔，秒
+        :param stale: 心跳超时秒数，默认按行情服务的心跳间隔
+        """
+        rows = [(instId, self.index[instId]) for instId in instIds if instId in self.index]
+        last = dict()
+        while not self.stale(stale):
+            for instId, row in rows:
+                if (seq := int(self.seq[row])) != last.get(row) and (ticker := self.ticker(instId)):
+                    last[row] = seq
+                    yield dict(arg=dict(channel='tickers', instId=instId), data=[ticker])
+            await asyncio.sleep(interval)
+
+    def close(self, unlink=False):
+        """
+        :param unlink: 行情服务退出时删除共享内存，并使读取方立即视为超时
+        """
+        if unlink:
+            self.header[2] = 0
+        self.header = self.names = self.seq = self.timestamp = self.values = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
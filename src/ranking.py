@@ -0,0 +1,49 @@
+from typing import Union
+from src.utils import *
+import numpy as np
+
+
+def ranking_table(instruments: List[str], **metrics) -> np.ndarray:
+    """币种×指标结构化数组，instrument列为定长字符串，其余列的类型同传入数组
+
+    :param instruments: 币种
+    :param metrics: 指标名 -> 与instruments等长的数组
+    """
+    metrics = {name: np.asarray(values) for name, values in metrics.items()}
+    dtype = [('instrument', f'U{max(map(len, instruments), default=1)}')]
+    dtype += [(name, values.dtype) for name, values in metrics.items()]
+    table = np.empty(len(instruments), dtype=dtype)
+    table['instrument'] = instruments
+    for name, values in metrics.items():
+        table[name] = values
+    return table
+
+
+def top_k(table: np.ndarray, keys: Union[str, Tuple[str, ...]], k: Optional[int] = None,
+          descending=True) -> np.ndarray:
+    """按keys排序的前k行，NaN排最后\n
+    k小于行数时先按第一个键argpartition，只对选出的k行排序。
+
+    :param table: ranking_table返回值
+    :param keys: 排序列，多个时前者为主
+    :param k: 行数，默认全部
+    :param descending: 从大到小
+    """
+    keys = (keys,) if isinstance(keys, str) else keys
+    scores = [np.nan_to_num(-table[key] if descending else table[key], nan=np.inf) for key in keys]
+    if k is None or k >= len(table):
+        index = np.arange(len(table))
+    else:
+        index = np.argpartition(scores[0], k - 1)[:k] if k > 0 else np.arange(0)
+    # lexsort以最后一个键为主
+    return table[index[np.lexsort([score[index] for score in reversed(scores)])]]
+
+
+def format_rows(table: np.ndarray, fields: Tuple[str, ...], template: str) -> List[str]:
+    """每行按template格式化一次
+
+    :param table: ranking_table返回值
+    :param fields: 依次填入template的列
+    :param template: str.format模板
+    """
+    return [template.format(*row) for row in table[list(fields)].tolist()]
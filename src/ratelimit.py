@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+import heapq
+import itertools
+import os
+import tempfile
+from src.config import rate_reserve
+from src.utils import *
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # 没有fcntl时令牌桶只在进程内共享
+    fcntl = None
+
+# 优先级，数值小的先取令牌
+HIGH, NORMAL, LOW = 0, 1, 2
+# REST方法 -> (令牌桶, 请求数, 秒)，按OKX V5文档各接口的限速
+ENDPOINTS = dict(
+    take_spot_order=('order', 60, 2), take_swap_order=('order', 60, 2), get_order_info=('order_info', 60, 2),
+    get_funding_time=('funding_rate', 20, 2), get_funding_history=('funding_history', 20, 2),
+    get_historical_funding_rate=('funding_history', 20, 2), get_tickers=('tickers', 20, 2),
+    get_specific_ticker=('ticker', 20, 2), get_instruments=('instruments', 20, 2),
+    get_specific_instrument=('instruments', 20, 2), get_history_candles=('history_candles', 20, 2),
+    get_specific_position=('positions', 10, 2), get_coin_balance=('balance', 10, 2), get_leverage=('leverage', 20, 2),
+    set_leverage=('set_leverage', 20, 2), adjust_margin=('margin', 20, 2), get_account_config=('config', 5, 2),
+    set_position_mode=('position_mode', 5, 2), get_trade_fee=('trade_fee', 5, 2), get_ledger=('bills', 5, 1),
+    get_archive_ledger=('bills_archive', 5, 2))
+# 未列出的方法
+DEFAULT_LIMIT = (10, 2)
+
+
+def scope(test: bool, account: Optional[int] = None) -> str:
+    """令牌桶作用域，实盘、模拟盘分开计数，私有接口再按账号分开
+
+    :param test: 模拟盘
+    :param account: 账号id，公共接口为None
+    """
+    env = 'test' if test else 'live'
+    return env if account is None else f'{env}/{account}'
+
+
+class BucketTable:
+    """令牌桶状态表，各进程映射同一文件，读改写时加文件锁\n
+    每行为作用域/桶名、剩余令牌数及上次更新时间（秒）。
+    """
+    dtype = np.dtype([('name', 'S48'), ('tokens', 'f8'), ('updated', 'f8')])
+
+    def __init__(self, path: Optional[str] = None, capacity=128):
+        """
+        :param path: 状态文件，默认系统临时目录下okex_ratelimit_{uid}，每个系统用户一个
+        :param capacity: 最多桶数
+        """
+        self.fd = None
+        if fcntl:
+            path = path or os.path.join(tempfile.gettempdir(), f'okex_ratelimit_{os.getuid()}')
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self.locked():
+                if os.fstat(self.fd).st_size < capacity * self.dtype.itemsize:
+                    os.ftruncate(self.fd, capacity * self.dtype.itemsize)
+            self.rows = np.memmap(path, self.dtype, 'r+', shape=(capacity,))
+        else:
+            self.rows = np.zeros(capacity, self.dtype)
+
+    @contextmanager
+    def locked(self):
+        if self.fd is None:
+            yield
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def row(self, name: str) -> int:
+        """桶所在行，没有时占用第一个空行
+        """
+        key = name.encode()
+        with self.locked():
+            names = self.rows['name'].tolist()
+            if key in names:
+                return names.index(key)
+            assert b'' in names, f'{type(self).__name__} full'
+            row = names.index(b'')
+            self.rows[row] = (key, 0., 0.)
+            return row
+
+    def take(self, row: int, capacity: int, rate: float, reserve=0) -> float:
+        """按经过时间补充令牌后取一个
+
+        :param row: 行号
+        :param capacity: 桶容量
+        :param rate: 每秒补充令牌数
+        :param reserve: 至少留下的令牌数
+        :return: 取到为0，否则为还需等待的秒数
+        """
+        with self.locked():
+            now = time.time()
+            tokens = min(capacity, self.rows['tokens'][row] + (now - self.rows['updated'][row]) * rate)
+            self.rows['updated'][row] = now
+            if tokens >= reserve + 1:
+                self.rows['tokens'][row] = tokens - 1
+                return 0.
+            self.rows['tokens'][row] = tokens
+            return (reserve + 1 - tokens) / rate
+
+
+class TokenBucket:
+    """一个接口的令牌桶，取不到令牌时按优先级排队\n
+    LOW优先级不取最后rate_reserve比例的令牌，其他进程的下单也不会被全市场筛选挤占。
+    """
+
+    def __init__(self, table: BucketTable, name: str, requests: int, seconds: float):
+        """
+        :param table: 状态表
+        :param name: 桶名
+        :param requests: 每seconds秒请求数
+        :param seconds: 限速周期
+        """
+        self.table = table
+        self.name = name
+        self.row = table.row(name)
+        self.capacity = requests
+        self.rate = requests / seconds
+        # (优先级, 序号, future)
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.requests = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def reserve(self, priority: int) -> int:
+        return int(self.capacity * rate_reserve) if priority >= LOW else 0
+
+    async def acquire(self, priority=NORMAL):
+        """取一个令牌，排队时按优先级、先后被唤醒
+
+        :param priority: HIGH、NORMAL或LOW
+        """
+        start = time.monotonic()
+        if self.waiters or self.table.take(self.row, self.capacity, self.rate, self.reserve(priority)):
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+            self.wakeup.set()
+            if self.dispatcher is None or self.dispatcher.done():
+                self.dispatcher = asyncio.create_task(self.dispatch())
+            await future
+        waited = time.monotonic() - start
+        self.requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def dispatch(self):
+        """依次为队首取令牌，等待期间有更高优先级入队时重新计算
+        """
+        # Event绑定首次等待的事件循环
+        self.wakeup = asyncio.Event()
+        while self.waiters:
+            priority, _, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            self.wakeup.clear()
+            if delay := self.table.take(self.row, self.capacity, self.rate, self.reserve(priority)):
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.waiters)
+            future.set_result(None)
+
+    def metrics(self) -> dict:
+        """请求数、排队数及排队等待秒数
+        """
+        return dict(requests=self.requests, queued=len(self.waiters), total_wait=self.total_wait,
+                    mean_wait=self.total_wait / self.requests if self.requests else 0., max_wait=self.max_wait)
+
+
+class RateLimiter:
+    """按接口分桶的REST限速器
+    """
+    table: Optional[BucketTable] = None
+    buckets: Dict[str, TokenBucket] = dict()
+
+    @classmethod
+    def bucket(cls, method: str, scope='live') -> TokenBucket:
+        """REST方法对应的令牌桶
+
+        :param method: 方法名
+        :param scope: 作用域，见scope()
+        """
+        name, requests, seconds = ENDPOINTS.get(method, (method,) + DEFAULT_LIMIT)
+        name = f'{scope}/{name}'
+        if (bucket := cls.buckets.get(name)) is None:
+            if cls.table is None:
+                cls.table = BucketTable()
+            bucket = cls.buckets[name] = TokenBucket(cls.table, name, requests, seconds)
+        return bucket
+
+    @classmethod
+    def metrics(cls) -> Dict[str, dict]:
+        """各桶TokenBucket.metrics
+        """
+        return {name: bucket.metrics() for name, bucket in cls.buckets.items()}
+
+
+class RateLimited:
+    """REST API代理，协程方法先从对应令牌桶取令牌
+    """
+
+    def __init__(self, api, priority=NORMAL, scope='live'):
+        """
+        :param api: AccountAPI、TradeAPI或PublicAPI
+        :param priority: 该代理所有请求的优先级
+        :param scope: 令牌桶作用域，见scope()
+        """
+        self.api = api
+        self.priority = priority
+        self.scope = scope
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        bucket = RateLimiter.bucket(name, self.scope)
+        priority = self.priority
+
+        @functools.wraps(attr)
+        async def limited(*args, **kwargs):
+            await bucket.acquire(priority)
+            return await attr(*args, **kwargs)
+
+        return limited
@@ -1,16 +1,330 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pickle
+import sys
 import pymongo
+import numpy as np
+from okx.async_okx_v5.channel import TickersChannel
+from okx.async_okx_v5.public import PublicAPI
+from okx.async_okx_v5.websocket import OkxWebsocket
 import src.funding_rate as funding_rate
+from src.config import Key, record_mode, record_interval, record_on_change, store_dir, write_batch, write_age, \
+    write_buffer, write_overflow, backfill_hours, max_gap
+from src.quotes import QuoteTable, SharedQuotes
+from src.store import DepthStore, PremiumStore, append_premium, insert_premium, truncate_stores
 from src.utils import *
 
+TICKER_FIELDS = tuple(PremiumStore.columns)
+DEPTH_FIELDS = tuple(DepthStore.columns)[1:]
+# 唯一键
+FUNDING_KEYS = ('instrument', 'timestamp')
+# 旧资金费账本没有billId，按时间匹配后补上
+LEDGER_FUNDING_KEYS = ('account', 'instrument', 'title', 'timestamp')
+# 没有开仓记录时的起始时间
+LEDGER_EPOCH = datetime(2021, 4, 1)
+# 本地存储写入线程，单线程保证按采样顺序写入
+store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Store')
+
+
+class AsyncCollection:
+    """在专用线程池中执行pymongo操作，避免阻塞事件循环
+    """
+
+    def __init__(self, collection: pymongo.collection.Collection, executor: ThreadPoolExecutor):
+        self.collection = collection
+        self.executor = executor
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return wrapper
+
+    async def aggregate(self, pipeline: List[dict], **kwargs) -> List[dict]:
+        """在线程池中取完游标
+        """
+        return await self.run(lambda: list(self.collection.aggregate(pipeline, **kwargs)))
+
+
+class WriteBehind:
+    """后台批量写入队列\n
+    采样只把记录放入缓存，后台任务按条数或等待时间成批insert_many。
+    缓存满时put最多等待block秒，仍满则按overflow写入磁盘或丢弃，缓存降到一半以下时读回磁盘记录。
+    """
+
+    def __init__(self, acol: AsyncCollection, name: str, batch=write_batch, age=write_age, buffer=write_buffer,
+                 overflow=write_overflow, block=1.):
+        """
+        :param acol: 目标集合
+        :param name: 溢出文件名前缀
+        :param batch: 每批最多条数
+        :param age: 最早一条最多等待秒数
+        :param buffer: 最多缓存条数
+        :param overflow: 'spill'或'drop'
+        :param block: 缓存满时最多等待秒数
+        """
+        self.acol = acol
+        self.name = name
+        self.batch = batch
+        self.age = age
+        self.buffer = buffer
+        self.overflow = overflow
+        self.block = block
+        self.spill_dir = os.path.join(store_dir, 'spill')
+        self.queue: collections.deque = collections.deque()
+        self.oldest = 0.
+        self.wakeup = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        # 计数
+        self.committed = self.dropped = self.spilled = self.failed = self.batches = 0
+        self.latency = self.max_latency = 0.
+
+    @property
+    def depth(self):
+        """缓存条数
+        """
+        return len(self.queue)
+
+    @property
+    def mean_latency(self):
+        """平均每批写入耗时，秒
+        """
+        return self.latency / self.batches if self.batches else 0.
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(depth=self.depth, committed=self.committed, dropped=self.dropped, spilled=self.spilled,
+                    failed=self.failed, batches=self.batches, mean_latency=self.mean_latency,
+                    max_latency=self.max_latency, spill_files=len(self.spill_files()))
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self
+
+    async def put(self, documents: List[dict]):
+        """放入缓存，缓存满时等待至多block秒
+
+        :param documents: 记录
+        """
+        if self.task and self.task.done():
+            self.task.result()
+        if not documents:
+            return
+        if len(self.queue) + len(documents) > self.buffer:
+            self.drained.clear()
+            try:
+                await asyncio.wait_for(self.drained.wait(), self.block)
+            except asyncio.TimeoutError:
+                pass
+        if len(self.queue) + len(documents) > self.buffer:
+            if self.overflow == 'spill':
+                self.spill(documents)
+            else:
+                self.dropped += len(documents)
+            return
+        if not self.queue:
+            self.oldest = time.monotonic()
+        self.queue.extend(documents)
+        if len(self.queue) >= self.batch:
+            self.wakeup.set()
+
+    def spill_files(self) -> List[str]:
+        if not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(os.path.join(self.spill_dir, n) for n in os.listdir(self.spill_dir)
+                      if n.startswith(self.name + '-'))
+
+    def spill(self, documents: List[dict]):
+        """写入溢出文件
+
+        :param documents: 记录
+        """
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f'{self.name}-{time.time_ns()}.pkl')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(documents, f)
+        os.replace(path + '.tmp', path)
+        self.spilled += len(documents)
+
+    def restore(self):
+        """缓存降到一半以下时读回最早的溢出文件
+        """
+        while len(self.queue) < self.buffer // 2 and (files := self.spill_files()):
+            with open(files[0], 'rb') as f:
+                documents = pickle.load(f)
+            os.remove(files[0])
+            if not self.queue:
+                self.oldest = time.monotonic()
+            self.queue.extend(documents)
+
+    async def commit(self):
+        """写入一批
+        """
+        documents = [self.queue.popleft() for _ in range(min(self.batch, len(self.queue)))]
+        start = time.monotonic()
+        try:
+            await self.acol.insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # 无序写入，只有出错的记录未写入
+            self.failed += len(e.details.get('writeErrors', []))
+            self.committed += e.details.get('nInserted', 0)
+        except pymongo.errors.PyMongoError:
+            # 数据库不可用，放回队首稍后重试
+            self.queue.extendleft(reversed(documents))
+            raise
+        else:
+            self.committed += len(documents)
+        elapsed = time.monotonic() - start
+        self.batches += 1
+        self.latency += elapsed
+        self.max_latency = max(self.max_latency, elapsed)
+        self.oldest = time.monotonic()
+
+    async def run(self):
+        """后台写入循环
+        """
+        while not self.closing or self.queue:
+            if not self.queue:
+                self.drained.set()
+                self.restore()
+            if not self.queue:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.age)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if len(self.queue) < self.batch and not self.closing:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), max(self.oldest + self.age - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.commit()
+            except pymongo.errors.PyMongoError:
+                if self.closing:
+                    break
+                await asyncio.sleep(self.age)
+                continue
+            if len(self.queue) <= self.buffer // 2:
+                self.drained.set()
+                self.restore()
+
+    async def close(self):
+        """写完缓存后停止，无法写入的部分写入溢出文件
+        """
+        self.closing = True
+        self.wakeup.set()
+        if self.task:
+            await self.task
+            self.task = None
+        if self.queue:
+            self.spill(list(self.queue))
+            self.queue.clear()
+
 
 class Record:
     myclient = pymongo.MongoClient('mongodb://localhost:27017/', connect=False)
     mydb = myclient['OKEx']
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='Record')
+    indexed = False
 
     def __init__(self, col=''):
         self.mycol = self.mydb[col]
+        self.acol = AsyncCollection(self.mycol, self.executor)
+
+    @classmethod
+    def ensure_indexes(cls):
+        """创建查询所需索引，行情由TTL索引保留48小时
+        """
+        if cls.indexed:
+            return
+        ticker = cls.mydb['Ticker']
+        ticker.create_index([('instrument', pymongo.ASCENDING), ('timestamp', pymongo.ASCENDING)])
+        try:
+            ticker.create_index('timestamp', expireAfterSeconds=48 * 3600)
+        except pymongo.errors.OperationFailure:
+            # 已有同名普通索引
+            cls.mydb.command('collMod', 'Ticker', index={'keyPattern': {'timestamp': 1},
+                                                         'expireAfterSeconds': 48 * 3600})
+        cls.unique_index('Funding', FUNDING_KEYS)
+        cls.unique_index('Ledger', ('account', 'billId'), partialFilterExpression={'billId': {'$exists': True}})
+        ledger = cls.mydb['Ledger']
+        ledger.create_index([('account', pymongo.ASCENDING), ('instrument', pymongo.ASCENDING),
+                             ('title', pymongo.ASCENDING), ('timestamp', pymongo.ASCENDING)])
+        ledger.create_index([('account', pymongo.ASCENDING), ('instrument', pymongo.ASCENDING),
+                             ('timestamp', pymongo.ASCENDING)])
+        cls.unique_index('PnL', ('account', 'instrument', 'epoch'))
+        for col in ('Portfolio', 'OP'):
+            cls.mydb[col].create_index([('account', pymongo.ASCENDING), ('instrument', pymongo.ASCENDING)])
+        cls.indexed = True
+
+    @classmethod
+    def unique_index(cls, col: str, keys: Tuple[str, ...], **kwargs):
+        """创建唯一索引，已有同键普通索引或重复记录时去重后重建
+
+        :param col: 集合
+        :param keys: 唯一键
+        """
+        collection = cls.mydb[col]
+        index = [(key, pymongo.ASCENDING) for key in keys]
+        try:
+            collection.create_index(index, unique=True, **kwargs)
+        except pymongo.errors.OperationFailure:
+            cls.dedupe(col, keys)
+            if (name := '_'.join(f'{key}_1' for key in keys)) in collection.index_information():
+                collection.drop_index(name)
+            collection.create_index(index, unique=True, **kwargs)
+
+    @classmethod
+    def dedupe(cls, col: str, keys: Tuple[str, ...]):
+        """删除唯一键重复的记录，保留最早一条
+
+        :param col: 集合
+        :param keys: 唯一键
+        """
+        collection = cls.mydb[col]
+        pipeline = [{'$match': {key: {'$exists': True} for key in keys}},
+                    {'$sort': {'_id': 1}},
+                    {'$group': {'_id': {key: '$' + key for key in keys}, 'ids': {'$push': '$_id'}}},
+                    {'$match': {'ids.1': {'$exists': True}}}]
+        duplicates = [i for x in collection.aggregate(pipeline, allowDiskUse=True) for i in x['ids'][1:]]
+        if duplicates:
+            collection.delete_many({'_id': {'$in': duplicates}})
+
+    @call_coroutine
+    async def bulk_upsert(self, documents: List[dict], keys: Tuple[str, ...], batch=1000):
+        """按唯一键批量幂等写入，每批一次无序bulk_write
+
+        :param documents: 记录
+        :param keys: 唯一键
+        :param batch: 每批条数
+        :return: 新增条数
+        :rtype: int
+        """
+        upserted = 0
+        for i in range(0, len(documents), batch):
+            requests = [pymongo.UpdateOne({key: n[key] for key in keys},
+                                          {'$set': {key: n[key] for key in n if key not in keys}}, upsert=True)
+                        for n in documents[i:i + batch]]
+            result = await self.acol.bulk_write(requests, ordered=False)
+            upserted += result.upserted_count
+            if result.upserted_count:
+                await self.written([documents[i + j] for j in sorted(result.upserted_ids)])
+        return upserted
 
-    def find_last(self, match: dict):
+    @call_coroutine
+    async def find_last(self, match: dict):
         """返回最后一条记录
 
         :param match: 匹配条件
@@ -19,108 +333,468 @@ class Record:
         pipeline = [{'$match': match},
                     {'$sort': {'_id': -1}},
                     {'$limit': 1}]
-        for x in self.mycol.aggregate(pipeline):
+        for x in await self.acol.aggregate(pipeline):
             return x
 
-    def insert(self, match: dict):
+    async def written(self, documents: List[dict]):
+        """新记录写入后调用，子类在此更新派生数据
+
+        :param documents: 新写入的记录
+        """
+        pass
+
+    @call_coroutine
+    async def insert_one(self, document: dict):
+        """写入一条记录
+        """
+        await self.acol.insert_one(document)
+        await self.written([document])
+
+    @call_coroutine
+    async def insert_many(self, documents: List[dict]):
+        """写入多条记录
+        """
+        await self.acol.insert_many(documents)
+        await self.written(documents)
+
+    @call_coroutine
+    async def insert(self, match: dict):
         """插入对应记录
 
         :param match: 匹配条件
         """
-        self.mycol.find_one_and_replace(match, match, upsert=True)
+        if await self.acol.find_one_and_replace(match, match, upsert=True) is None:
+            await self.written([match])
 
-    def delete(self, match: dict):
+    @call_coroutine
+    async def delete(self, match: dict):
         """删除对应记录
 
         :param match: 匹配条件
         """
-        self.mycol.delete_one(match)
+        await self.acol.delete_one(match)
+
+
+class Ledger(Record):
+    """账本，新记录写入时同步更新PnL集合中每次开仓以来的汇总\n
+    每个(account, instrument, epoch)一条汇总，epoch为开仓时间，记录累计资金费、现货与合约成交额、手续费、
+    开平仓时间及平仓时仓位。记录归入时间早于它的最近一次开仓，首次开仓之前的记录归入LEDGER_EPOCH。
+    """
+    summed = ('funding', 'spot_notional', 'swap_notional', 'fee')
+    # 本进程已确认有汇总的(account, instrument)
+    summarized: set = set()
+
+    def __init__(self):
+        super().__init__('Ledger')
+        self.summary = Record('PnL')
+
+    async def written(self, documents: List[dict]):
+        """按币种更新汇总，尚无汇总时由账本整体重建
+        """
+        keys = dict.fromkeys((n['account'], n['instrument']) for n in documents)
+        for account, instrument in keys:
+            if (account, instrument) not in self.summarized:
+                if await self.summary.acol.find_one(dict(account=account, instrument=instrument)) is None:
+                    # 重建结果已包含本次写入的记录
+                    await self.rebuild_summary(account, instrument)
+                    continue
+                self.summarized.add((account, instrument))
+            for n in sorted((n for n in documents if (n['account'], n['instrument']) == (account, instrument)),
+                            key=lambda x: x['timestamp']):
+                await self.summarize(n)
+
+    async def summarize(self, document: dict):
+        """一条记录计入汇总，开仓记录新建汇总，其余原子累加到所属汇总
+        """
+        match = dict(account=document['account'], instrument=document['instrument'])
+        timestamp = document['timestamp']
+        if document.get('title') == '开仓':
+            await self.summary.acol.update_one(
+                dict(match, epoch=timestamp),
+                {'$setOnInsert': dict(open_time=timestamp, **{key: 0. for key in self.summed})}, upsert=True)
+            return
+        update = {'$inc': {key: float(document.get(key, 0.)) for key in self.summed}}
+        if document.get('title') == '平仓':
+            update['$set'] = dict(close_time=timestamp, position=document.get('position', 0.))
+        if await self.summary.acol.find_one_and_update(dict(match, epoch={'$lt': timestamp}), update,
+                                                       sort=[('epoch', pymongo.DESCENDING)]) is None:
+            update['$setOnInsert'] = dict(open_time=LEDGER_EPOCH)
+            await self.summary.acol.update_one(dict(match, epoch=LEDGER_EPOCH), update, upsert=True)
+
+    async def rebuild_summary(self, account: int, instrument: str):
+        """由账本记录重算一个币种的全部汇总
+
+        :param account: 账号id
+        :param instrument: 币种
+        """
+        match = dict(account=account, instrument=instrument)
+        pipeline = [{'$match': match}, {'$sort': {'timestamp': 1, '_id': 1}}]
+        summaries = summarize_ledger(await self.acol.aggregate(pipeline))
+        await self.summary.acol.delete_many(match)
+        if summaries:
+            await self.summary.acol.insert_many([dict(match, **n) for n in summaries])
+        self.summarized.add((account, instrument))
+
+    @call_coroutine
+    async def latest_summary(self, account: int, instrument: str):
+        """最近一次开仓以来的汇总，一次索引查询
+
+        :param account: 账号id
+        :param instrument: 币种
+        :rtype: dict
+        """
+        match = dict(account=account, instrument=instrument)
+        if (account, instrument) not in self.summarized and \
+                await self.summary.acol.find_one(match) is None:
+            await self.rebuild_summary(account, instrument)
+        return await self.summary.acol.find_one(match, sort=[('epoch', pymongo.DESCENDING)])
+
+    @call_coroutine
+    async def total_summary(self, account: int, instrument: str):
+        """全部汇总累加
+
+        :param account: 账号id
+        :param instrument: 币种
+        :rtype: dict
+        """
+        await self.latest_summary(account, instrument)
+        pipeline = [{'$match': dict(account=account, instrument=instrument)},
+                    {'$group': {'_id': '$instrument', **{key: {'$sum': '$' + key} for key in self.summed}}}]
+        for x in await self.summary.acol.aggregate(pipeline):
+            return x
+
+    @call_coroutine
+    async def delete_many(self, match: dict):
+        """删除账本记录及对应汇总
+
+        :param match: 含account、instrument的匹配条件
+        """
+        result = await self.acol.delete_many(match)
+        await self.summary.acol.delete_many(match)
+        self.summarized.discard((match['account'], match['instrument']))
+        return result
+
+
+def summarize_ledger(documents: List[dict]) -> List[dict]:
+    """按Ledger.summarize的规则由按时间排序的账本记录计算各次开仓的汇总
+
+    :param documents: 一个币种的账本记录，按timestamp递增
+    :return: 汇总，不含account、instrument
+    """
+    summaries: List[dict] = []
+    for n in documents:
+        timestamp = n['timestamp']
+        if n.get('title') == '开仓':
+            if not summaries or summaries[-1]['epoch'] != timestamp:
+                summaries.append(dict(epoch=timestamp, open_time=timestamp, **{key: 0. for key in Ledger.summed}))
+            continue
+        # 时间早于记录的最近一次开仓
+        target = next((x for x in reversed(summaries) if x['epoch'] < timestamp), None)
+        if target is None:
+            if not summaries or summaries[0]['epoch'] != LEDGER_EPOCH:
+                summaries.insert(0, dict(epoch=LEDGER_EPOCH, open_time=LEDGER_EPOCH,
+                                         **{key: 0. for key in Ledger.summed}))
+            target = summaries[0]
+        for key in Ledger.summed:
+            target[key] += float(n.get(key, 0.))
+        if n.get('title') == '平仓':
+            target.update(close_time=timestamp, position=n.get('position', 0.))
+    return summaries
+
+
+def join_tickers(instrumentsID: List[str], spot_ticker: List[dict], swap_ticker: List[dict]):
+    """按instId索引拼接现货与合约行情，一次性计算全部币种期现差价
+
+    :param instrumentsID: 合约列表
+    :param spot_ticker: 现货行情
+    :param swap_ticker: 合约行情
+    :return: 币种列表及各字段数组，时间戳为毫秒
+    :rtype: dict
+    """
+    spot_index = {n['instId']: n for n in spot_ticker}
+    swap_index = {n['instId']: n for n in swap_ticker}
+    coins = []
+    rows = []
+    for swap_ID in instrumentsID:
+        spot_ID = swap_ID[:swap_ID.find('-SWAP')]
+        if not (spot := spot_index.get(spot_ID)):
+            continue
+        swap = swap_index.get(swap_ID)
+        coins.append(spot_ID[:spot_ID.find('-USDT')])
+        rows.append((int(spot['ts']), safe_float(spot['bidPx']), safe_float(spot['askPx']),
+                     safe_float(swap['bidPx']) if swap else 0., safe_float(swap['askPx']) if swap else 0.,
+                     safe_float(spot['bidSz']), safe_float(spot['askSz']),
+                     safe_float(swap['bidSz']) if swap else 0., safe_float(swap['askSz']) if swap else 0.))
+    # 毫秒时间戳小于2^53，float64无损
+    table = np.asarray(rows, dtype=np.float64).reshape(-1, 9)
+    # 现货无报价则跳过
+    valid = (table[:, 1] > 0) & (table[:, 2] > 0)
+    ts, spot_bid, spot_ask, swap_bid, swap_ask, spot_bid_sz, spot_ask_sz, swap_bid_sz, swap_ask_sz = table[valid].T
+    return dict(instrument=[coin for coin, n in zip(coins, valid) if n], timestamp=ts.astype(np.int64),
+                spot_bid=spot_bid, spot_ask=spot_ask, swap_bid=swap_bid, swap_ask=swap_ask,
+                open_pd=(swap_bid - spot_ask) / spot_ask, close_pd=(swap_ask - spot_bid) / spot_bid,
+                spot_bid_sz=spot_bid_sz, spot_ask_sz=spot_ask_sz, swap_bid_sz=swap_bid_sz, swap_ask_sz=swap_ask_sz)
+
+
+def ticker_docs(joined: dict) -> List[dict]:
+    """拼接结果转为Ticker文档，有挂单量时一并写入
+
+    :param joined: join_tickers返回值
+    """
+    fields = TICKER_FIELDS[1:] + (DEPTH_FIELDS if DEPTH_FIELDS[0] in joined else ())
+    return [dict(instrument=coin, timestamp=utcfrommillisecs(ts), **dict(zip(fields, values)))
+            for coin, ts, *values in zip(joined['instrument'], *(joined[n].tolist() for n in ('timestamp',) + fields))]
 
 
 recording = False
 
 
-def record_ticker(accountid=3):
+def instIds(instrumentsID: List[str]) -> List[str]:
+    """合约列表对应的现货及合约产品ID
+    """
+    return [instId for swap_ID in instrumentsID for instId in (swap_ID[:swap_ID.find('-SWAP')], swap_ID)]
+
+
+def record_ticker(accountid=3, mode=record_mode, interval=record_interval, on_change=record_on_change):
+    """记录行情，websocket推送中断时退回REST轮询
+
+    :param accountid: 账号id
+    :param mode: 'ws'订阅推送，'rest'轮询
+    :param interval: 采样间隔，秒
+    :param on_change: 'ws'方式下只记录报价有变化的币种
+    """
     global recording
     if not recording:
         recording = True
         loop = asyncio.get_event_loop()
         while True:
             try:
-                loop.run_until_complete(record(accountid))
+                if mode == 'ws':
+                    try:
+                        loop.run_until_complete(record_ws(accountid, interval, on_change))
+                    except asyncio.TimeoutError:
+                        print(lang.websocket_fallback)
+                        # REST轮询10分钟后重试websocket
+                        loop.run_until_complete(asyncio.wait_for(record(accountid, interval), 600))
+                else:
+                    loop.run_until_complete(record(accountid, interval))
+            except asyncio.TimeoutError:
+                pass
             except aiohttp.ClientError:
                 print(lang.network_interruption)
                 time.sleep(30)
 
 
-async def record(accountid=3):
+async def record_funding(fundingRate: 'funding_rate.FundingRate', funding: Record):
+    """记录最近资金费，清理列式存储中48小时前行情
+
+    :return: 合约列表
+    :rtype: List[str]
+    """
+    publicAPI = fundingRate.publicAPI
+    funding_rate_list = []
+    instrumentsID = await fundingRate.get_instruments_ID()
+    tasks = [publicAPI.get_historical_funding_rate(instId=swap_ID) for swap_ID in instrumentsID]
+    res = await asyncio.gather(*tasks, return_exceptions=True)
+    for swap_ID, historical_funding_rate in zip(instrumentsID, res):
+        if isinstance(historical_funding_rate, AssertionError):
+            continue
+        instrument = swap_ID[:swap_ID.find('-')]
+        for n in historical_funding_rate:
+            # 尚未结算的一期realizedRate为空，不记为0
+            if not n.get('realizedRate'):
+                continue
+            funding_rate_list.append(dict(instrument=instrument, timestamp=utcfrommillisecs(n['fundingTime']),
+                                          funding=safe_float(n['realizedRate'])))
+    await funding.bulk_upsert(funding_rate_list, FUNDING_KEYS)
+    await asyncio.get_running_loop().run_in_executor(store_executor, truncate_stores)
+    return instrumentsID
+
+
+async def history_closes(publicAPI: PublicAPI, instId: str, start: int, end: int) -> Dict[int, float]:
+    """[start, end)内1分钟K线收盘价
+
+    :param publicAPI: 公共API
+    :param instId: 产品ID
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒
+    :return: K线开始时间到收盘价的映射
+    """
+    closes = dict()
+    after = end
+    while after > start:
+        # 按时间倒序，返回早于after的至多100根
+        candles = await publicAPI.get_history_candles(instId, after=str(after), bar='1m', limit='100')
+        if not candles:
+            break
+        for n in candles:
+            if (timestamp := int(n[0])) >= start:
+                closes[timestamp] = float(n[4])
+        after = int(candles[-1][0])
+    return closes
+
+
+def half_spreads(coin: str, start: int, end: int) -> Tuple[float, float]:
+    """空档前后一小时采样的现货、合约相对半价差中位数，没有采样时为0
+
+    :param coin: 币种
+    :param start: 空档前最后一条采样时间，毫秒
+    :param end: 空档后第一条采样时间，毫秒
+    """
+    window = PremiumStore.get(coin).window(start - 3600_000, end + 3600_000,
+                                           ('spot_bid', 'spot_ask', 'swap_bid', 'swap_ask'))
+    if not len(window['spot_bid']):
+        return 0., 0.
+    spot = np.median((window['spot_ask'] - window['spot_bid']) / (window['spot_ask'] + window['spot_bid']))
+    swap = np.median((window['swap_ask'] - window['swap_bid']) / (window['swap_ask'] + window['swap_bid']))
+    return float(spot), float(swap)
+
+
+async def backfill_gap(publicAPI: PublicAPI, swap_ID: str, start: int, end: int):
+    """用现货和合约1分钟K线收盘价回补(start, end)之间的空档，买卖价按空档前后的价差中位数展开
+
+    :param publicAPI: 公共API
+    :param swap_ID: 合约ID
+    :param start: 空档前最后一条采样时间，毫秒
+    :param end: 空档后第一条采样时间，毫秒
+    :return: 补录条数
+    """
+    spot_ID = swap_ID[:swap_ID.find('-SWAP')]
+    # 只取整根K线位于空档内的
+    first = start // 60_000 * 60_000 + 60_000
+    spot, swap = await asyncio.gather(history_closes(publicAPI, spot_ID, first, end - 60_000 + 1),
+                                      history_closes(publicAPI, swap_ID, first, end - 60_000 + 1))
+    timestamp = np.array(sorted(spot.keys() & swap.keys()), dtype=np.int64)
+    spot_price = np.array([spot[n] for n in timestamp.tolist()], dtype=np.float64)
+    swap_price = np.array([swap[n] for n in timestamp.tolist()], dtype=np.float64)
+    valid = spot_price > 0
+    timestamp, spot_price, swap_price = timestamp[valid], spot_price[valid], swap_price[valid]
+    coin = swap_ID[:swap_ID.find('-')]
+    spot_spread, swap_spread = half_spreads(coin, start, end)
+    spot_bid, spot_ask = spot_price * (1 - spot_spread), spot_price * (1 + spot_spread)
+    swap_bid, swap_ask = swap_price * (1 - swap_spread), swap_price * (1 + swap_spread)
+    insert_premium(coin, dict(timestamp=timestamp, spot_bid=spot_bid, spot_ask=spot_ask, swap_bid=swap_bid,
+                              swap_ask=swap_ask, open_pd=(swap_bid - spot_ask) / spot_ask,
+                              close_pd=(swap_ask - spot_bid) / spot_bid))
+    return len(timestamp)
+
+
+async def backfill(publicAPI: PublicAPI, instrumentsID: List[str], hours=backfill_hours, gap=max_gap, concurrency=5):
+    """检查最近几小时各币种的行情空档并用K线回补
+
+    :param publicAPI: 公共API
+    :param instrumentsID: 合约列表
+    :param hours: 检查最近几小时
+    :param gap: 相邻采样最大间隔，秒
+    :param concurrency: 同时请求的币种数
+    """
+    end = int(time.time() * 1000)
+    start = end - hours * 3600_000
+    tasks = [(swap_ID, a, b) for swap_ID in instrumentsID
+             for a, b in PremiumStore.get(swap_ID[:swap_ID.find('-')]).gaps(start, end, gap * 1000)]
+    if not tasks:
+        return
+    filled = 0
+    for i in range(0, len(tasks), concurrency):
+        res = await asyncio.gather(*[backfill_gap(publicAPI, *n) for n in tasks[i:i + concurrency]],
+                                   return_exceptions=True)
+        filled += sum(n for n in res if isinstance(n, int))
+    print(lang.backfill_done.format(filled, len(tasks)))
+
+
+async def store_premium(joined: dict):
+    """在存储线程中写入一次采样，不阻塞事件循环
+
+    :param joined: join_tickers或QuoteTable.snapshot返回值
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(store_executor, append_premium, joined)
+
+
+async def record(accountid=3, interval=10):
+    """轮询REST行情
+
+    :param accountid: 账号id
+    :param interval: 采样间隔，秒
+    """
     print(lang.record_ticker)
+    Record.ensure_indexes()
     ticker = Record('Ticker')
     funding = Record('Funding')
     fundingRate = funding_rate.FundingRate(accountid)
     instrumentsID = await fundingRate.get_instruments_ID()
     publicAPI = fundingRate.publicAPI
-    ten_seconds = Looper(interval=10)
+    await backfill(publicAPI, instrumentsID)
+    ten_seconds = Looper(interval=interval)
     funding_time = FundingTime()
-    async for event in EventChain(ten_seconds, funding_time):
-        timestamp = datetime.utcnow()
-        # 每8小时记录资金费
-        if event == funding_time:
-            funding_rate_list = []
-            instrumentsID = await fundingRate.get_instruments_ID()
-            tasks = [publicAPI.get_historical_funding_rate(instId=swap_ID) for swap_ID in instrumentsID]
-            res = await asyncio.gather(*tasks, return_exceptions=True)
-            for swap_ID, historical_funding_rate in zip(instrumentsID, res):
-                if isinstance(historical_funding_rate, AssertionError):
-                    continue
-                instrument = swap_ID[:swap_ID.find('-')]
-                pipeline = [{'$match': {'instrument': instrument}}]
-                # Results in DB
-                db_funding = [n for n in funding.mycol.aggregate(pipeline)]
-                for n in historical_funding_rate:
-                    timestamp = utcfrommillisecs(n['fundingTime'])
-                    realized_rate = safe_float(n['realizedRate'])
-                    for item in db_funding:
-                        if item['funding'] == realized_rate:
-                            if item['timestamp'] == timestamp:
-                                break
-                    else:
-                        mydict = {'instrument': instrument, 'timestamp': timestamp,
-                                  'funding': realized_rate}
-                        funding_rate_list.append(mydict)
-            if funding_rate_list:
-                funding.mycol.insert_many(funding_rate_list)
-            myquery = {'timestamp': {'$lt': timestamp - timedelta(hours=48)}}
-            ticker.mycol.delete_many(myquery)
-        elif event == ten_seconds:
-            assert (spot_ticker := await publicAPI.get_tickers('SPOT'))
-            assert (swap_ticker := await publicAPI.get_tickers('SWAP'))
-            mylist = []
-            for swap_ID in instrumentsID:
-                spot_ID = swap_ID[:swap_ID.find('-SWAP')]
-                coin = spot_ID[:spot_ID.find('-USDT')]
-                spot_ask = spot_bid = swap_bid = swap_ask = 0.
-                for i, n in enumerate(spot_ticker):
-                    if n['instId'] == spot_ID:
-                        timestamp = utcfrommillisecs(n['ts'])
-                        spot_ask = safe_float(n['askPx'])
-                        spot_bid = safe_float(n['bidPx'])
-                        spot_ticker.pop(i)
-                        break
-                for i, n in enumerate(swap_ticker):
-                    if n['instId'] == swap_ID:
-                        swap_ask = safe_float(n['askPx'])
-                        swap_bid = safe_float(n['bidPx'])
-                        swap_ticker.pop(i)
-                        break
-                if spot_ask and spot_bid:
-                    open_pd = (swap_bid - spot_ask) / spot_ask
-                    close_pd = (swap_ask - spot_bid) / spot_bid
-                else:
-                    continue
-                mydict = {'instrument': coin, "timestamp": timestamp, 'spot_bid': spot_bid, 'spot_ask': spot_ask,
-                          'swap_bid': swap_bid, 'swap_ask': swap_ask, 'open_pd': open_pd, 'close_pd': close_pd}
-                mylist.append(mydict)
-            ticker.mycol.insert_many(mylist)
-        else:
-            raise ValueError
+    writer = WriteBehind(ticker.acol, 'Ticker').start()
+    quotes = SharedQuotes.create(instIds(instrumentsID), interval)
+    try:
+        async for event in EventChain(ten_seconds, funding_time):
+            # 每8小时记录资金费
+            if event == funding_time:
+                instrumentsID = await record_funding(fundingRate, funding)
+            elif event == ten_seconds:
+                assert (spot_ticker := await publicAPI.get_tickers('SPOT'))
+                assert (swap_ticker := await publicAPI.get_tickers('SWAP'))
+                for n in spot_ticker + swap_ticker:
+                    quotes.publish(n)
+                joined = join_tickers(instrumentsID, spot_ticker, swap_ticker)
+                await store_premium(joined)
+                await writer.put(ticker_docs(joined))
+            else:
+                raise ValueError
+    finally:
+        quotes.close(unlink=True)
+        await writer.close()
+
+
+async def record_ws(accountid=3, interval=1, on_change=False, stale=30):
+    """订阅全币种tickers频道，按间隔采样记录行情
+
+    :param accountid: 账号id
+    :param interval: 采样间隔，秒
+    :param on_change: 只记录报价有变化的币种
+    :param stale: 超过几秒无推送则抛出asyncio.TimeoutError
+    """
+    print(lang.record_ticker)
+    Record.ensure_indexes()
+    ticker = Record('Ticker')
+    funding = Record('Funding')
+    fundingRate = funding_rate.FundingRate(accountid)
+    instrumentsID = await fundingRate.get_instruments_ID()
+    await backfill(fundingRate.publicAPI, instrumentsID)
+    apikey = Key(accountid)
+    websocketAPI = OkxWebsocket(apikey.api_key, apikey.secret_key, apikey.passphrase, test=accountid == 3)
+    subscription = await websocketAPI.subscribe_public(
+        [TickersChannel(channel='tickers', instId=instId) for instId in instIds(instrumentsID)])
+    table = QuoteTable(instrumentsID)
+    sample = Looper(interval=interval)
+    funding_time = FundingTime()
+    writer = WriteBehind(ticker.acol, 'Ticker').start()
+    quotes = SharedQuotes.create(instIds(instrumentsID), interval)
+    try:
+        async for event in EventChain(subscription, sample, funding_time):
+            # 每8小时记录资金费
+            if event == funding_time:
+                await record_funding(fundingRate, funding)
+            elif event == sample:
+                if time.monotonic() - table.last_update > stale:
+                    raise asyncio.TimeoutError
+                quotes.heartbeat()
+                timestamp = int(time.time() * 1000)
+                joined = table.snapshot(timestamp, on_change)
+                await store_premium(joined)
+                await writer.put(ticker_docs(joined))
+            else:
+                for n in event['data']:
+                    table.update(n)
+                    quotes.publish(n)
+    finally:
+        quotes.close(unlink=True)
+        await writer.close()
+
+
+if __name__ == '__main__':
+    # 独立行情服务：python -m src.record [账号id]
+    record_ticker(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,106 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import Dict, Optional
+import numpy as np
+
+# 绘图进程池，首次绘图时创建
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def executor() -> ProcessPoolExecutor:
+    """绘图进程池，spawn启动，子进程只导入本模块及matplotlib
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def new_figure(language: str):
+    """不经pyplot创建Agg画布，不需要显示器也不阻塞
+    """
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    if language == 'cn':
+        matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+        matplotlib.rcParams['axes.unicode_minus'] = False
+    matplotlib.rcParams['font.size'] = 12
+    fig = Figure(figsize=(16, 8))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def save(fig, path: str) -> str:
+    """按扩展名保存为PNG或SVG
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fig.savefig(path)
+    return path
+
+
+def premium_scatter(path: str, data: Dict[str, np.ndarray], open_pd: Optional[float], close_pd: Optional[float],
+                    labels: Dict[str, str],
+                    language='cn', utcoffset=0) -> str:
+    """期现差价散点图
+
+    :param path: 输出文件，.png或.svg
+    :param data: timestamp（毫秒）、open_pd、close_pd
+    :param open_pd: 开仓阈值，None时不画
+    :param close_pd: 平仓阈值，None时不画
+    :param labels: pd_open, pd_close, time, premium, title, open_threshold, close_threshold
+    :param language: 'cn'时用中文字体
+    :param utcoffset: 本地时间与UTC相差毫秒
+    :return: path
+    """
+    fig = new_figure(language)
+    ax = fig.add_subplot()
+    timestamp = (np.asarray(data['timestamp'], dtype=np.int64) + utcoffset).astype('datetime64[ms]')
+    ax.plot(timestamp, data['open_pd'], '.', color='g', label=labels['pd_open'])
+    if open_pd is not None:
+        ax.axhline(y=open_pd, color='g', linestyle='-', label=labels['open_threshold'])
+    ax.plot(timestamp, data['close_pd'], '.', color='r', label=labels['pd_close'])
+    if close_pd is not None:
+        ax.axhline(y=close_pd, color='r', linestyle='-', label=labels['close_threshold'])
+    ax.yaxis.set_major_formatter('{x:.3%}')
+    ax.set_xlabel(labels['time'], fontsize=14)
+    ax.set_ylabel(labels['premium'], fontsize=14)
+    ax.legend(loc='best', fontsize=14)
+    ax.set_title(labels['title'], fontsize=18)
+    return save(fig, path)
+
+
+def gaussian_dist(path: str, stat: dict, color: str, labels: Dict[str, str], language='cn') -> str:
+    """期现差价分布与同均值、标准差的正态分布对比图
+
+    :param path: 输出文件，.png或.svg
+    :param stat: Stat.premium_dist返回值
+    :param color: 散点颜色
+    :param labels: historical_data, gaussian_dist, average, probability, xlabel, title
+    :param language: 'cn'时用中文字体
+    :return: path
+    """
+    fig = new_figure(language)
+    ax = fig.add_subplot()
+    avg, std, width = stat['avg'], stat['std'], stat['width']
+    ax.plot(stat['premiums'], stat['prob'], '.', color=color, label=labels['historical_data'])
+    ax.axvline(avg, color='orange', label=labels['average'])
+    # 差价恒定时标准差或组距为0，只画历史分布
+    if std > 0 and width > 0:
+        x = np.arange(stat['min'], stat['max'], width / 10)
+        y = np.exp(- np.square(x - avg) / 2. / std ** 2) / std / np.sqrt(2 * np.pi) * width
+        ax.plot(x, y, '-', color='b', label=labels['gaussian_dist'])
+        for k, name in zip((1, 2, 3), (r'$\sigma$ ', r'$2\sigma$ ', r'$3\sigma$ ')):
+            # 竖线高度为正态分布在avg ± kσ处的密度
+            ymax = np.exp(- k * k / 2.) / std / np.sqrt(2 * np.pi) * width
+            label = name + labels['probability'] + f": {stat[f'frequency{k}']:.2%}"
+            ax.vlines([avg + k * std, avg - k * std], 0, ymax, color='m', label=label)
+    ax.set_xlabel(labels['xlabel'], fontsize=14)
+    ax.yaxis.set_major_formatter('{x:.0%}')
+    ax.xaxis.set_major_formatter('{x:.3%}')
+    ax.set_ylabel(labels['probability'], fontsize=14)
+    ax.set_ylim(bottom=0)
+    ax.legend(loc='best', fontsize=16)
+    ax.set_title(labels['title'], fontsize=18)
+    return save(fig, path)
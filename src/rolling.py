@@ -0,0 +1,160 @@
+from src.store import PremiumStore
+from src.utils import *
+import numpy as np
+
+
+class RollingStat:
+    """定长时间窗口内期现差价的滚动统计\n
+    均值、方差按Welford算法增删，最小、最大值用按采样序号排列的单调队列，有采样的分钟用队列计数。
+    每次查询只读入列式存储新追加的行并移出过期行，统计值O(1)得出。
+    """
+    stats: Dict[tuple, 'RollingStat'] = dict()
+
+    def __init__(self, hours: float):
+        """
+        :param hours: 窗口小时数
+        """
+        self.duration = int(hours * 3600_000)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = self.m2 = 0.
+        self.last = None
+        # 已移入的采样数，第n条采样的序号为n - 1；同一时间戳可有多条采样，按序号移出
+        self.added = 0
+        # (序号, value)
+        self.mins: collections.deque = collections.deque()
+        self.maxs: collections.deque = collections.deque()
+        self.minutes: collections.deque = collections.deque()
+        self.evicted = 0
+
+    def add(self, timestamp: int, value: float):
+        """移入一条采样
+        """
+        seq = self.added
+        self.added += 1
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((seq, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((seq, value))
+        if not self.minutes or self.minutes[-1] != timestamp // 60_000:
+            self.minutes.append(timestamp // 60_000)
+        self.last = value
+
+    def remove(self, value: float):
+        """移出最早一条采样
+        """
+        seq = self.added - self.count
+        self.count -= 1
+        self.evicted += 1
+        if not self.count:
+            self.mean = self.m2 = 0.
+        else:
+            delta = value - self.mean
+            self.mean -= delta / self.count
+            self.m2 -= delta * (value - self.mean)
+        if self.mins and self.mins[0][0] <= seq:
+            self.mins.popleft()
+        if self.maxs and self.maxs[0][0] <= seq:
+            self.maxs.popleft()
+
+    def expire(self, start: int):
+        """移出start分钟之前的分钟计数
+        """
+        while self.minutes and self.minutes[0] < start // 60_000:
+            self.minutes.popleft()
+
+    def result(self, now: int):
+        """统计值，字段同store.rollup_stat
+
+        :param now: 当前时间，毫秒
+        :rtype: dict
+        """
+        if not self.count:
+            return None
+        std = float(np.sqrt(max(self.m2, 0.) / (self.count - 1))) if self.count > 1 else 0.
+        minutes = (now - 1) // 60_000 - (now - self.duration + 1) // 60_000 + 1
+        return dict(avg=self.mean, std=std, max=self.maxs[0][1], min=self.mins[0][1], count=self.count,
+                    last=self.last, coverage=min(len(self.minutes) / minutes, 1.))
+
+
+class PremiumRollingStat(RollingStat):
+    """单一币种单列的滚动统计，由PremiumStore追加的行驱动
+    """
+
+    def __init__(self, coin: str, field: str, hours: float):
+        """
+        :param coin: 币种
+        :param field: 'open_pd'或'close_pd'
+        :param hours: 窗口小时数
+        """
+        self.store = PremiumStore.get(coin)
+        self.field = field
+        # 窗口起点时间，窗口内首行行号、已读入的行数及存储文件
+        self.start = None
+        self.head = self.tail = 0
+        self.inode = None
+        super().__init__(hours)
+
+    @classmethod
+    def get(cls, coin: str, field: str, hours: float) -> 'PremiumRollingStat':
+        """每个币种、列、窗口每进程一个实例
+        """
+        if (stat := cls.stats.get((coin, field, hours))) is None:
+            stat = cls.stats[(coin, field, hours)] = cls(coin, field, hours)
+        return stat
+
+    def load(self, start: int, now: int):
+        """从存储整窗读入
+        """
+        self.reset()
+        self.start = start
+        self.head = self.tail = self.store.bounds(start)[0]
+        self.extend(now)
+
+    def extend(self, now: int):
+        """按行号读入上次之后追加的行，与已读入的最后一行时间相同的行也不遗漏
+        """
+        length = len(self.store)
+        timestamp = self.store.column('timestamp', length)[self.tail:]
+        values = self.store.column(self.field, length)[self.tail:]
+        for n, value in zip(timestamp.tolist(), values.tolist()):
+            self.add(n, value)
+        self.tail = length
+
+    def update(self, now: Optional[int] = None):
+        """读入新追加的行，移出窗口外的行
+
+        :param now: 当前时间，毫秒
+        :return: 存储未覆盖窗口时返回None
+        :rtype: dict
+        """
+        if now is None:
+            now = int(time.time() * 1000)
+        start = now - self.duration
+        if (first := self.store.first()) is None or first > start:
+            self.start = None
+            return None
+        inode = self.store.inode()
+        # 首次读入、存储被truncate或补录替换、移出次数过多累积误差时重新整窗读入
+        if self.start is None or inode != self.inode or self.evicted > max(self.count, 1000) or start < self.start:
+            self.load(start, now)
+            self.inode = inode
+            return self.result(now)
+        if start > self.start:
+            # 移出已读入且时间不晚于新起点的行，尚未读入的过期行直接跳过
+            head = self.store.bounds(start)[0]
+            for value in self.store.column(self.field, self.tail)[self.head:min(head, self.tail)].tolist():
+                self.remove(value)
+            self.head, self.tail = head, max(head, self.tail)
+            self.expire(start + 1)
+        self.start = start
+        self.extend(now)
+        return self.result(now)
@@ -0,0 +1,80 @@
+from src.utils import *
+import numpy as np
+
+
+class TDigest:
+    """定长t-digest分位数摘要\n
+    质心按累计权重分组，组界由k1尺度函数k(q) = asin(2q - 1) / π给出，两端分位数的质心更密。
+    摘要可合并：合并后的质心重新分组即可，质心数不超过size。
+    """
+
+    def __init__(self, size: int, means: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None):
+        """
+        :param size: 最多质心数
+        :param means: 质心均值
+        :param weights: 质心权重
+        """
+        self.size = size
+        self.means = np.empty(0) if means is None else np.asarray(means, dtype=np.float64)
+        self.weights = np.empty(0) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, size: int) -> 'TDigest':
+        """由原始数据生成摘要
+        """
+        values = np.asarray(values, dtype=np.float64)
+        return cls(size).merge(values, np.ones(len(values)))
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> 'TDigest':
+        """由存储的(2, size)数组恢复，权重为0的质心为空位
+        """
+        used = arr[1] > 0
+        return cls(arr.shape[1], arr[0][used], arr[1][used])
+
+    def to_array(self) -> np.ndarray:
+        """(2, size)数组，第一行均值，第二行权重，空位补0
+        """
+        arr = np.zeros((2, self.size))
+        arr[0, :len(self.means)] = self.means
+        arr[1, :len(self.weights)] = self.weights
+        return arr
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def merge(self, means: np.ndarray, weights: np.ndarray) -> 'TDigest':
+        """并入若干质心或原始数据（权重为1）并重新压缩
+
+        :param means: 质心均值
+        :param weights: 质心权重
+        """
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        if not len(means):
+            return self
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # 各质心中点的累计分位数所在k尺度分组
+        q = (np.cumsum(weights) - weights / 2) / total
+        group = ((np.arcsin(2 * q - 1) / np.pi + 0.5) * self.size).astype(np.intp)
+        np.minimum(group, self.size - 1, out=group)
+        group = np.unique(group, return_inverse=True)[1]
+        self.weights = np.bincount(group, weights)
+        self.means = np.bincount(group, means * weights) / self.weights
+        return self
+
+    def merge_digest(self, other: 'TDigest') -> 'TDigest':
+        return self.merge(other.means, other.weights)
+
+    def quantile(self, q) -> np.ndarray:
+        """分位数，质心中点之间线性插值
+
+        :param q: 0至1之间的分位，可为数组
+        """
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan)
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(np.asarray(q) * self.count, centers, self.means)
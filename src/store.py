@@ -0,0 +1,792 @@
+import os
+from src.config import store_dir, rollup_retention, sketch_size, sketch_retention
+from src.sketch import TDigest
+from src.utils import *
+import numpy as np
+
+
+class ColumnStore:
+    """只追加的列式存储\n
+    每列一个定长二进制文件，读取时内存映射，返回零拷贝切片。
+    行按timestamp（毫秒）递增。
+    """
+    columns: Dict[str, type] = dict(timestamp=np.int64)
+
+    def __init__(self, path: str):
+        """
+        :param path: 存储目录
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._maps: Dict[str, tuple] = dict()
+        self._inodes: Dict[str, int] = dict()
+        # 写入前是否已检查过中断的写入
+        self._checked = False
+
+    def file(self, name: str):
+        return os.path.join(self.path, name + '.bin')
+
+    def __len__(self):
+        """各列完整写入的行数
+        """
+        length = None
+        for name, dtype in self.columns.items():
+            try:
+                stat = os.stat(self.file(name))
+            except FileNotFoundError:
+                return 0
+            self._inodes[name] = stat.st_ino
+            n = stat.st_size // np.dtype(dtype).itemsize
+            length = n if length is None else min(length, n)
+        return length or 0
+
+    def inode(self) -> Optional[int]:
+        """timestamp列文件inode，truncate或replace后改变
+        """
+        try:
+            return os.stat(self.file('timestamp')).st_ino
+        except FileNotFoundError:
+            return None
+
+    def version(self):
+        """数据版本，追加、truncate或replace后改变
+        """
+        return len(self), self._inodes.get('timestamp')
+
+    def column(self, name: str, length: Optional[int] = None) -> np.ndarray:
+        """整列只读映射
+
+        :param name: 列名
+        :param length: 行数，默认当前长度
+        """
+        if length is None:
+            length = len(self)
+        if not length:
+            return np.empty(0, dtype=self.columns[name])
+        mapped, inode = self._maps.get(name, (None, None))
+        # 文件增长或被truncate替换后重新映射
+        if mapped is None or len(mapped) < length or inode != self._inodes[name]:
+            mapped = np.memmap(self.file(name), dtype=self.columns[name], mode='r')
+            self._maps[name] = mapped, self._inodes[name]
+        return mapped[:length]
+
+    def append(self, rows: Dict[str, Any]):
+        """追加若干行
+
+        :param rows: 列名到数组的映射
+        """
+        self.check()
+        # 每批打开一次，不长期占用文件句柄；timestamp最后写入
+        for name in sorted(self.columns, key=lambda x: x == 'timestamp'):
+            with open(self.file(name), 'ab') as f:
+                f.write(np.asarray(rows[name], dtype=np.dtype(self.columns[name]).base).tobytes())
+
+    def check(self):
+        """首次写入前完成中断的truncate或replace，并把各列截到最短列的行数\n
+        只在写入进程中调用，读取进程不改动文件。
+        """
+        if self._checked:
+            return
+        self._checked = True
+        files = {name: self.file(name) for name in self.columns}
+        temps = [file for file in files.values() if os.path.exists(file + '.tmp')]
+        # 有列已改名为.old说明.tmp已全部写完并开始替换，继续换入，否则丢弃
+        if any(os.path.exists(file + '.old') and not os.path.exists(file) for file in files.values()):
+            for file in temps:
+                os.replace(file + '.tmp', file)
+        else:
+            for file in temps:
+                os.remove(file + '.tmp')
+        for file in files.values():
+            if os.path.exists(file + '.old'):
+                os.remove(file + '.old')
+        length = len(self)
+        for name, file in files.items():
+            size = length * np.dtype(self.columns[name]).itemsize
+            if os.path.exists(file) and os.path.getsize(file) > size:
+                os.truncate(file, size)
+
+    def swap(self) -> bool:
+        """用已写好的各列.tmp替换全部列\n
+        先把各列改名为.old再换入.tmp，改名失败时还原，不会只替换一部分列。
+
+        :return: 是否已替换
+        """
+        self.close()
+        files = {name: self.file(name) for name in self.columns}
+        moved = []
+        try:
+            for file in files.values():
+                if os.path.exists(file):
+                    os.replace(file, file + '.old')
+                    moved.append(file)
+        except OSError:
+            # Windows下文件被其他进程映射，还原后下次再处理
+            for file in moved:
+                os.replace(file + '.old', file)
+            for file in files.values():
+                os.remove(file + '.tmp')
+            return False
+        for file in files.values():
+            os.replace(file + '.tmp', file)
+        for file in moved:
+            try:
+                os.remove(file + '.old')
+            except OSError:
+                pass
+        return True
+
+    def bounds(self, start: int, end: Optional[int] = None, length: Optional[int] = None):
+        """时间窗口(start, end]对应的行号区间
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        :param length: 行数，默认当前长度
+        """
+        timestamp = self.column('timestamp', length)
+        i = np.searchsorted(timestamp, start, side='right')
+        j = len(timestamp) if end is None else np.searchsorted(timestamp, end, side='right')
+        return int(i), int(j)
+
+    def window(self, start: int, end: Optional[int] = None, columns=None) -> Dict[str, np.ndarray]:
+        """时间窗口(start, end]内的数据，零拷贝
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        :param columns: 列名，默认全部
+        """
+        length = len(self)
+        i, j = self.bounds(start, end, length)
+        return {name: self.column(name, length)[i:j] for name in (columns or self.columns)}
+
+    def first(self) -> Optional[int]:
+        """最早时间戳
+        """
+        return int(timestamp[0]) if len(timestamp := self.column('timestamp')) else None
+
+    def replace(self, start: int, end: int, rows: Dict[str, Any]):
+        """用rows替换[start, end)内的数据，rows按时间递增且位于区间内
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        :param rows: 列名到数组的映射
+        """
+        self.check()
+        length = len(self)
+        i, j = self.bounds(start - 1, end - 1, length)
+        data = {name: np.concatenate([self.column(name, length)[:i], np.asarray(rows[name], dtype=np.dtype(dtype).base),
+                                      self.column(name, length)[j:]]) for name, dtype in self.columns.items()}
+        for name, arr in data.items():
+            arr.tofile(self.file(name) + '.tmp')
+        self.swap()
+
+    def gaps(self, start: int, end: int, max_gap: int) -> List[Tuple[int, int]]:
+        """(start, end)内相邻采样间隔超过max_gap的空档
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        :param max_gap: 最大间隔，毫秒
+        :return: 空档两端已有采样的时间(前, 后)，无采样时为start或end
+        """
+        timestamp = self.window(start, end - 1, ('timestamp',))['timestamp']
+        edges = np.r_[start, timestamp, end]
+        holes = np.flatnonzero(np.diff(edges) > max_gap)
+        return [(int(edges[i]), int(edges[i + 1])) for i in holes]
+
+    def truncate(self, before: int):
+        """删除before之前的数据
+
+        :param before: 时间，毫秒
+        """
+        self.check()
+        length = len(self)
+        i = int(np.searchsorted(self.column('timestamp', length), before))
+        if not i:
+            return
+        # 先写完全部.tmp再统一替换
+        for name in self.columns:
+            with open(self.file(name), 'rb') as f:
+                f.seek(i * np.dtype(self.columns[name]).itemsize)
+                data = f.read((length - i) * np.dtype(self.columns[name]).itemsize)
+            with open(self.file(name) + '.tmp', 'wb') as f:
+                f.write(data)
+        self.swap()
+
+    def close(self):
+        self._maps.clear()
+
+
+class PremiumStore(ColumnStore):
+    """单一币种期现差价列式存储
+    """
+    columns = dict(timestamp=np.int64, spot_bid=np.float64, spot_ask=np.float64, swap_bid=np.float64,
+                   swap_ask=np.float64, open_pd=np.float64, close_pd=np.float64)
+    stores: Dict[str, 'PremiumStore'] = dict()
+
+    def __init__(self, coin: str):
+        super().__init__(os.path.join(store_dir, 'premium', coin))
+        self.coin = coin
+
+    @classmethod
+    def get(cls, coin: str) -> 'PremiumStore':
+        """每个币种每进程一个实例，复用内存映射
+        """
+        if (store := cls.stores.get(coin)) is None:
+            store = cls.stores[coin] = cls(coin)
+        return store
+
+    @classmethod
+    def instruments(cls) -> List[str]:
+        """已存储的币种
+        """
+        path = os.path.join(store_dir, 'premium')
+        return os.listdir(path) if os.path.isdir(path) else []
+
+
+class DepthStore(ColumnStore):
+    """单一币种买一卖一挂单量，与PremiumStore同一时间戳写入\n
+    现货为币数，合约为张数。K线回补的行情没有挂单量，不写入。
+    """
+    columns = dict(timestamp=np.int64, spot_bid_sz=np.float64, spot_ask_sz=np.float64, swap_bid_sz=np.float64,
+                   swap_ask_sz=np.float64)
+    stores: Dict[str, 'DepthStore'] = dict()
+
+    def __init__(self, coin: str):
+        super().__init__(os.path.join(store_dir, 'depth', coin))
+        self.coin = coin
+
+    @classmethod
+    def get(cls, coin: str) -> 'DepthStore':
+        if (store := cls.stores.get(coin)) is None:
+            store = cls.stores[coin] = cls(coin)
+        return store
+
+    @classmethod
+    def instruments(cls) -> List[str]:
+        path = os.path.join(store_dir, 'depth')
+        return os.listdir(path) if os.path.isdir(path) else []
+
+
+class RollupStore(ColumnStore):
+    """单一币种期现差价定长时间段汇总
+
+    每行一个[timestamp, timestamp + 时长)时间段，记录条数、有采样的分钟数及各列的和、平方和、最小、最大、最后值。
+    只写入已结束的时间段，当前时间段在内存中累加。
+    """
+    resolutions = {'1m': 60_000, '15m': 900_000, '1h': 3_600_000}
+    fields = ('open_pd', 'close_pd')
+    stats = ('sum', 'sumsq', 'min', 'max', 'last')
+    columns = dict(timestamp=np.int64, count=np.int64, minutes=np.int64,
+                   open_pd_sum=np.float64, open_pd_sumsq=np.float64, open_pd_min=np.float64, open_pd_max=np.float64,
+                   open_pd_last=np.float64, close_pd_sum=np.float64, close_pd_sumsq=np.float64,
+                   close_pd_min=np.float64, close_pd_max=np.float64, close_pd_last=np.float64)
+    stores: Dict[tuple, 'RollupStore'] = dict()
+    # 增加minutes列后行宽改变，换用新目录，不读旧的rollup目录
+    directory = 'rollup_v2'
+
+    def __init__(self, coin: str, resolution: str):
+        """
+        :param coin: 币种
+        :param resolution: '1m', '15m'或'1h'
+        """
+        super().__init__(os.path.join(store_dir, self.directory, resolution, coin))
+        self.coin = coin
+        self.resolution = resolution
+        self.duration = self.resolutions[resolution]
+        # 当前时间段起点、条数、分钟数、最后一条所在分钟及各列汇总
+        self.bucket: Optional[int] = None
+        self.count = self.minutes = self.minute = 0
+        self.moments: List[List[float]] = []
+
+    @classmethod
+    def get(cls, coin: str, resolution: str) -> 'RollupStore':
+        if (store := cls.stores.get((coin, resolution))) is None:
+            store = cls.stores[(coin, resolution)] = cls(coin, resolution)
+        return store
+
+    @classmethod
+    def instruments(cls, resolution: str) -> List[str]:
+        path = os.path.join(store_dir, cls.directory, resolution)
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def end(self, length: Optional[int] = None) -> Optional[int]:
+        """已写入时间段的截止时间
+        """
+        timestamp = self.column('timestamp', length)
+        return int(timestamp[-1]) + self.duration if len(timestamp) else None
+
+    def seed(self, timestamp: int):
+        """首次更新时从原始数据补齐未写入的时间段，并恢复当前时间段
+
+        :param timestamp: 本次采样时间，毫秒，此前的原始数据已写入
+        """
+        self.bucket = timestamp // self.duration * self.duration
+        premium = PremiumStore.get(self.coin)
+        length = len(premium)
+        start = self.end()
+        i = 0 if start is None else premium.bounds(start - 1, length=length)[0]
+        j = premium.bounds(timestamp - 1, length=length)[0]
+        raw = {name: premium.column(name, length)[i:j] for name in ('timestamp',) + self.fields}
+        closed = raw['timestamp'] < self.bucket
+        if closed.any():
+            self.append(bucket_moments({name: arr[closed] for name, arr in raw.items()}, self.duration))
+        self.count = 0
+        for timestamp, *values in zip(*(raw[name][~closed].tolist() for name in raw)):
+            self.add(timestamp, values)
+
+    def rebuild(self, start: int, end: int):
+        """原始数据[start, end)有补录后重算覆盖的已写入时间段，并从原始数据恢复当前时间段
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        """
+        start = start // self.duration * self.duration
+        if (stored := self.end()) is not None and start < stored:
+            end = min(-(-end // self.duration) * self.duration, stored)
+            premium = PremiumStore.get(self.coin)
+            raw = premium.window(start - 1, end - 1, ('timestamp',) + self.fields)
+            self.replace(start, end, bucket_moments(raw, self.duration))
+        self.bucket = None
+
+    def add(self, timestamp: int, values):
+        """累加一条采样到当前时间段
+
+        :param timestamp: 采样时间，毫秒
+        :param values: 各列数值
+        """
+        minute = timestamp // 60_000
+        if not self.count:
+            self.moments = [[value, value * value, value, value, value] for value in values]
+            self.minutes = 1
+        else:
+            if minute != self.minute:
+                self.minutes += 1
+            for n, value in zip(self.moments, values):
+                n[0] += value
+                n[1] += value * value
+                if value < n[2]:
+                    n[2] = value
+                if value > n[3]:
+                    n[3] = value
+                n[4] = value
+        self.minute = minute
+        self.count += 1
+
+    def update(self, timestamp: int, values):
+        """写入一条采样，进入新时间段时写入上一段
+
+        :param timestamp: 采样时间，毫秒
+        :param values: 各列数值
+        """
+        if self.bucket is None:
+            self.seed(timestamp)
+        bucket = timestamp // self.duration * self.duration
+        if bucket < self.bucket:
+            return
+        if bucket > self.bucket:
+            if self.count:
+                row = dict(timestamp=[self.bucket], count=[self.count], minutes=[self.minutes])
+                for field, moments in zip(self.fields, self.moments):
+                    row.update({f'{field}_{stat}': [n] for stat, n in zip(self.stats, moments)})
+                self.append(row)
+            self.bucket, self.count = bucket, 0
+        self.add(timestamp, values)
+
+
+class SketchStore(ColumnStore):
+    """单一币种期现差价每小时分位数摘要\n
+    每行一个整点小时，开平仓差价各一个定长t-digest，存为(2, sketch_size)的质心均值与权重。
+    小时结束后由原始数据一次生成，逐条采样只比较所在小时；长窗口分位数合并各小时摘要得出。
+    """
+    duration = 3_600_000
+    fields = ('open_pd', 'close_pd')
+    columns = dict(timestamp=np.int64, count=np.int64, open_pd=np.dtype((np.float64, (2, sketch_size))),
+                   close_pd=np.dtype((np.float64, (2, sketch_size))))
+    stores: Dict[str, 'SketchStore'] = dict()
+
+    def __init__(self, coin: str):
+        super().__init__(os.path.join(store_dir, 'sketch', coin))
+        self.coin = coin
+        # 当前小时起点
+        self.bucket: Optional[int] = None
+
+    @classmethod
+    def get(cls, coin: str) -> 'SketchStore':
+        if (store := cls.stores.get(coin)) is None:
+            store = cls.stores[coin] = cls(coin)
+        return store
+
+    @classmethod
+    def instruments(cls) -> List[str]:
+        path = os.path.join(store_dir, 'sketch')
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def end(self, length: Optional[int] = None) -> Optional[int]:
+        """已写入小时的截止时间
+        """
+        timestamp = self.column('timestamp', length)
+        return int(timestamp[-1]) + self.duration if len(timestamp) else None
+
+    def sync(self, before: int):
+        """由原始数据写入before之前已结束、尚未写入的小时
+
+        :param before: 整点时间，毫秒
+        """
+        start = self.end()
+        raw = PremiumStore.get(self.coin).window(-1 if start is None else start - 1, before - 1,
+                                                 ('timestamp',) + self.fields)
+        self.append(bucket_digests(raw, self.duration))
+
+    def update(self, timestamp: int):
+        """写入一条采样后调用，进入新小时时写入上一小时
+
+        :param timestamp: 采样时间，毫秒
+        """
+        bucket = timestamp // self.duration * self.duration
+        if self.bucket is None or bucket > self.bucket:
+            self.sync(bucket)
+            self.bucket = bucket
+
+    def rebuild(self, start: int, end: int):
+        """原始数据[start, end)有补录后重算覆盖的已写入小时
+
+        :param start: 起始时间，毫秒
+        :param end: 截止时间，毫秒
+        """
+        start = start // self.duration * self.duration
+        if (stored := self.end()) is not None and start < stored:
+            end = min(-(-end // self.duration) * self.duration, stored)
+            raw = PremiumStore.get(self.coin).window(start - 1, end - 1, ('timestamp',) + self.fields)
+            self.replace(start, end, bucket_digests(raw, self.duration))
+
+
+class CandleStore(ColumnStore):
+    """单一产品单一周期已完结K线，跨进程、跨运行复用，只从交易所补取末尾缺少的部分
+    """
+    columns = dict(timestamp=np.int64, open=np.float64, high=np.float64, low=np.float64, close=np.float64)
+    stores: Dict[tuple, 'CandleStore'] = dict()
+
+    def __init__(self, instId: str, bar: str):
+        """
+        :param instId: 产品ID
+        :param bar: K线周期，如'15m'、'4H'、'1D'
+        """
+        super().__init__(os.path.join(store_dir, 'candle', bar, instId))
+        self.instId = instId
+        self.bar = bar
+        self.duration = bar_duration(bar)
+
+    @classmethod
+    def get(cls, instId: str, bar: str) -> 'CandleStore':
+        if (store := cls.stores.get((instId, bar))) is None:
+            store = cls.stores[(instId, bar)] = cls(instId, bar)
+        return store
+
+    def end(self, length: Optional[int] = None) -> Optional[int]:
+        """已存K线的截止时间
+        """
+        timestamp = self.column('timestamp', length)
+        return int(timestamp[-1]) + self.duration if len(timestamp) else None
+
+    def extend(self, candles: List[List]):
+        """写入交易所返回的K线，跳过未完结及已存的
+
+        :param candles: [ts, o, h, l, c, ...]，顺序不限
+        """
+        now = int(time.time() * 1000)
+        end = self.end() or 0
+        arr = np.asarray([n[:5] for n in candles], dtype=np.float64).reshape(-1, 5)
+        timestamp = arr[:, 0].astype(np.int64)
+        keep = (timestamp >= end) & (timestamp + self.duration <= now)
+        timestamp, index = np.unique(timestamp[keep], return_index=True)
+        arr = arr[keep][index]
+        self.append(dict(timestamp=timestamp, open=arr[:, 1], high=arr[:, 2], low=arr[:, 3], close=arr[:, 4]))
+
+    def tail(self, count: int) -> Dict[str, np.ndarray]:
+        """最近count根K线，按时间递增
+        """
+        length = len(self)
+        return {name: self.column(name, length)[max(length - count, 0):] for name in self.columns}
+
+
+def bar_duration(bar: str) -> int:
+    """K线周期毫秒数
+
+    :param bar: 如'1m'、'4H'、'1D'、'1W'
+    """
+    units = dict(m=60_000, H=3_600_000, D=86_400_000, W=604_800_000)
+    return int(bar[:-1]) * units[bar[-1]]
+
+
+def bucket_moments(raw: Dict[str, np.ndarray], duration: int) -> Dict[str, np.ndarray]:
+    """按时间段汇总原始数据
+
+    :param raw: timestamp及各列，按时间递增
+    :param duration: 时间段长度，毫秒
+    :return: RollupStore的各列
+    """
+    if not len(raw['timestamp']):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in RollupStore.columns.items()}
+    buckets = raw['timestamp'] // duration * duration
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)]
+    minutes = raw['timestamp'] // 60_000
+    new_minute = np.r_[True, minutes[1:] != minutes[:-1]]
+    rows = dict(timestamp=buckets[starts], count=ends - starts, minutes=np.add.reduceat(new_minute, starts))
+    for field in RollupStore.fields:
+        arr = raw[field]
+        rows.update({f'{field}_sum': np.add.reduceat(arr, starts), f'{field}_sumsq': np.add.reduceat(arr * arr, starts),
+                     f'{field}_min': np.minimum.reduceat(arr, starts), f'{field}_max': np.maximum.reduceat(arr, starts),
+                     f'{field}_last': arr[ends - 1]})
+    return rows
+
+
+def bucket_digests(raw: Dict[str, np.ndarray], duration: int) -> Dict[str, np.ndarray]:
+    """按时间段生成分位数摘要
+
+    :param raw: timestamp及各列，按时间递增
+    :param duration: 时间段长度，毫秒
+    :return: SketchStore的各列
+    """
+    buckets = raw['timestamp'] // duration * duration
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]) if len(buckets) else np.empty(0, dtype=np.intp)
+    ends = np.r_[starts[1:], len(buckets)]
+    rows = dict(timestamp=buckets[starts], count=ends - starts)
+    for field in SketchStore.fields:
+        rows[field] = np.asarray([TDigest.from_values(raw[field][i:j], sketch_size).to_array()
+                                  for i, j in zip(starts.tolist(), ends.tolist())]).reshape(-1, 2, sketch_size)
+    return rows
+
+
+def append_premium(joined: dict):
+    """按币种写入一次采样，有挂单量时一并写入，并更新各级汇总
+
+    :param joined: record.join_tickers返回值
+    """
+    for i, coin in enumerate(joined['instrument']):
+        PremiumStore.get(coin).append({name: joined[name][i:i + 1] for name in PremiumStore.columns})
+        if 'spot_bid_sz' in joined:
+            DepthStore.get(coin).append({name: joined[name][i:i + 1] for name in DepthStore.columns})
+        timestamp = int(joined['timestamp'][i])
+        values = [float(joined[field][i]) for field in RollupStore.fields]
+        for resolution in RollupStore.resolutions:
+            RollupStore.get(coin, resolution).update(timestamp, values)
+        SketchStore.get(coin).update(timestamp)
+
+
+def insert_premium(coin: str, rows: Dict[str, np.ndarray]):
+    """补录一个币种的采样，并更新各级汇总
+
+    :param coin: 币种
+    :param rows: PremiumStore各列，按时间递增
+    """
+    if not len(timestamp := rows['timestamp']):
+        return
+    premium = PremiumStore.get(coin)
+    length = len(premium)
+    if not length or timestamp[0] > premium.column('timestamp', length)[-1]:
+        # 位于末尾，按采样顺序写入
+        premium.append(rows)
+        for i, n in enumerate(timestamp.tolist()):
+            values = [float(rows[field][i]) for field in RollupStore.fields]
+            for resolution in RollupStore.resolutions:
+                RollupStore.get(coin, resolution).update(n, values)
+            SketchStore.get(coin).update(n)
+        return
+    start, end = int(timestamp[0]), int(timestamp[-1]) + 1
+    existing = premium.window(start - 1, end - 1)
+    order = np.argsort(np.r_[existing['timestamp'], timestamp], kind='stable')
+    premium.replace(start, end, {name: np.r_[existing[name], rows[name]][order] for name in PremiumStore.columns})
+    for resolution in RollupStore.resolutions:
+        RollupStore.get(coin, resolution).rebuild(start, end)
+    SketchStore.get(coin).rebuild(start, end)
+
+
+def truncate_stores():
+    """按保留期限清理原始数据及汇总
+    """
+    now = int(time.time() * 1000)
+    for coin in PremiumStore.instruments():
+        PremiumStore.get(coin).truncate(now - 48 * 3600_000)
+    for coin in DepthStore.instruments():
+        DepthStore.get(coin).truncate(now - 48 * 3600_000)
+    for resolution, days in rollup_retention.items():
+        if days:
+            for coin in RollupStore.instruments(resolution):
+                RollupStore.get(coin, resolution).truncate(now - days * 86400_000)
+    if sketch_retention:
+        for coin in SketchStore.instruments():
+            SketchStore.get(coin).truncate(now - sketch_retention * 86400_000)
+
+
+def segment_moments(store: ColumnStore, field: str, start: int, end: int, length: int):
+    """[start, end)内汇总值(count, sum, sumsq, min, max, last, minutes)
+
+    :param store: PremiumStore或RollupStore
+    :param field: 列名
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒
+    :param length: 行数
+    """
+    i, j = store.bounds(start - 1, end - 1, length)
+    if i >= j:
+        return None
+    if isinstance(store, RollupStore):
+        count = int(store.column('count', length)[i:j].sum())
+        total, sumsq, low, high, last = [store.column(f'{field}_{stat}', length)[i:j] for stat in RollupStore.stats]
+        return (count, float(total.sum()), float(sumsq.sum()), float(low.min()), float(high.max()), float(last[-1]),
+                int(store.column('minutes', length)[i:j].sum()))
+    arr = store.column(field, length)[i:j]
+    minutes = len(np.unique(store.column('timestamp', length)[i:j] // 60_000))
+    return j - i, float(arr.sum()), float(np.dot(arr, arr)), float(arr.min()), float(arr.max()), float(arr[-1]), minutes
+
+
+def rollup_stat(coin: str, field: str, start: int, end: Optional[int] = None):
+    """时间窗口(start, end]内期现差价统计值\n
+    窗口中间用能整段覆盖的最粗汇总，两端逐级用更细的汇总，最后用原始数据。
+    原始数据已清理时，窗口起点向前对齐到仍有数据的最细一级。
+
+    :param coin: 币种
+    :param field: 'open_pd'或'close_pd'
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒，默认至今
+    :return: avg, std, max, min, count, last及有采样的分钟占比coverage，数据未覆盖窗口起点时返回None
+    :rtype: dict
+    """
+    levels = [PremiumStore.get(coin)] + [RollupStore.get(coin, n) for n in RollupStore.resolutions]
+    lengths = [len(n) for n in levels]
+    firsts = [int(n.column('timestamp', length)[0]) if length else np.inf for n, length in zip(levels, lengths)]
+    # 区间统一为[lo, hi)
+    lo = start + 1
+    hi = (np.iinfo(np.int64).max if end is None else end + 1)
+    if min(firsts) > lo:
+        return None
+
+    def cover(lo, hi, k):
+        if lo >= hi:
+            return []
+        if not k:
+            return [segment_moments(levels[0], field, lo, hi, lengths[0])]
+        store = levels[k]
+        duration = store.duration
+        a = -(-lo // duration) * duration if min(firsts[:k]) <= lo else lo // duration * duration
+        b = min(hi // duration * duration, store.end(lengths[k]) or a)
+        if a >= b:
+            return cover(lo, hi, k - 1)
+        return cover(lo, a, k - 1) + [segment_moments(store, field, a, b, lengths[k])] + cover(b, hi, k - 1)
+
+    segments = [n for n in cover(lo, hi, len(levels) - 1) if n]
+    if not segments:
+        return None
+    count = sum(n[0] for n in segments)
+    total = sum(n[1] for n in segments)
+    sumsq = sum(n[2] for n in segments)
+    variance = max(sumsq - total * total / count, 0.) / (count - 1) if count > 1 else 0.
+    minutes = (min(hi, int(time.time() * 1000)) - 1) // 60_000 - lo // 60_000 + 1
+    coverage = min(sum(n[6] for n in segments) / minutes, 1.) if minutes > 0 else 1.
+    return dict(avg=total / count, std=float(np.sqrt(variance)), max=max(n[4] for n in segments),
+                min=min(n[3] for n in segments), count=count, last=segments[-1][5], coverage=coverage)
+
+
+def raw_stat(coin: str, field: str, start: int, end: Optional[int] = None):
+    """时间窗口(start, end]内期现差价统计值，只读原始数据，一次整段计算
+
+    :param coin: 币种
+    :param field: 'open_pd'或'close_pd'
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒，默认至今
+    :return: 字段同rollup_stat，原始数据未覆盖窗口起点或窗口内无数据时返回None
+    :rtype: dict
+    """
+    premium = PremiumStore.get(coin)
+    if not (length := len(premium)) or premium.column('timestamp', length)[0] > start:
+        return None
+    i, j = premium.bounds(start, end, length)
+    if i >= j:
+        return None
+    now = int(time.time() * 1000)
+    hi = now if end is None else min(end + 1, now)
+    minutes = (hi - 1) // 60_000 - (start + 1) // 60_000 + 1
+    stamps = premium.column('timestamp', length)[i:j] // 60_000
+    coverage = min((1 + int(np.count_nonzero(np.diff(stamps)))) / minutes, 1.) if minutes > 0 else 1.
+    arr = premium.column(field, length)[i:j]
+    return dict(avg=float(arr.mean()), std=float(arr.std(ddof=1)) if j - i > 1 else 0., max=float(arr.max()),
+                min=float(arr.min()), count=j - i, last=float(arr[-1]), coverage=coverage)
+
+
+def universe_stat(start: int, end: Optional[int] = None):
+    """所有已存储币种时间窗口(start, end]内开平仓期现差价统计值\n
+    原始数据覆盖窗口的币种按列整段计算，一次取出两列；否则逐列用rollup_stat。
+
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒，默认至今
+    :return: {币种: {'open_pd': 统计值, 'close_pd': 统计值}}，字段同rollup_stat，数据未覆盖窗口的币种不在其中
+    :rtype: Dict[str, dict]
+    """
+    fields = RollupStore.fields
+    now = int(time.time() * 1000)
+    hi = now if end is None else min(end + 1, now)
+    minutes = (hi - 1) // 60_000 - (start + 1) // 60_000 + 1
+    result = dict()
+    for coin in PremiumStore.instruments():
+        premium = PremiumStore.get(coin)
+        if not (length := len(premium)):
+            continue
+        timestamp = premium.column('timestamp', length)
+        if timestamp[0] > start:
+            stats = [rollup_stat(coin, field, start, end) for field in fields]
+            if None not in stats:
+                result[coin] = dict(zip(fields, stats))
+            continue
+        i, j = premium.bounds(start, end, length)
+        if i >= j:
+            continue
+        stamps = timestamp[i:j] // 60_000
+        coverage = min((1 + int(np.count_nonzero(np.diff(stamps)))) / minutes, 1.) if minutes > 0 else 1.
+        arr = np.stack([premium.column(field, length)[i:j] for field in fields])
+        avg, low, high = arr.mean(axis=1), arr.min(axis=1), arr.max(axis=1)
+        std = arr.std(axis=1, ddof=1) if j - i > 1 else np.zeros(len(fields))
+        result[coin] = {field: dict(avg=float(avg[k]), std=float(std[k]), max=float(high[k]), min=float(low[k]),
+                                    count=j - i, last=float(arr[k, -1]), coverage=coverage)
+                        for k, field in enumerate(fields)}
+    return result
+
+
+def sketch_quantile(coin: str, field: str, q, start: int, end: Optional[int] = None):
+    """时间窗口(start, end]内期现差价分位数\n
+    窗口中间合并整点小时摘要，两端及尚未写入摘要的部分用原始数据。
+    原始数据已清理时，窗口起点向前对齐到整点。
+
+    :param coin: 币种
+    :param field: 'open_pd'或'close_pd'
+    :param q: 0至1之间的分位，可为数组
+    :param start: 起始时间，毫秒
+    :param end: 截止时间，毫秒，默认至今
+    :return: 分位数，数据未覆盖窗口起点时返回None
+    :rtype: np.ndarray
+    """
+    premium, sketch = PremiumStore.get(coin), SketchStore.get(coin)
+    length = len(sketch)
+    first = premium.first()
+    sketch_first = int(sketch.column('timestamp', length)[0]) if length else None
+    # 区间统一为[lo, hi)
+    lo = start + 1
+    hi = np.iinfo(np.int64).max if end is None else end + 1
+    if (first is None or first > lo) and (sketch_first is None or sketch_first > lo):
+        return None
+    duration = sketch.duration
+    a = -(-lo // duration) * duration if first is not None and first <= lo else lo // duration * duration
+    b = min(hi // duration * duration, sketch.end(length) or a)
+    digest = TDigest(sketch_size)
+    if a < b:
+        i, j = sketch.bounds(a - 1, b - 1, length)
+        arr = sketch.column(field, length)[i:j]
+        used = arr[:, 1] > 0
+        digest.merge(arr[:, 0][used], arr[:, 1][used])
+    else:
+        a = b = lo
+    for x, y in ((lo, a), (b, hi)):
+        if x < y:
+            values = premium.window(x - 1, y - 1, (field,))[field]
+            digest.merge(values, np.ones(len(values)))
+    return digest.quantile(q) if digest.count else None
@@ -0,0 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import src.backtest as backtest
+from src.config import store_dir
+from src.utils import *
+from src.lang import *
+import numpy as np
+
+# 默认参数网格：标准差倍数、阈值统计小时数、几小时后加速、杠杆、Monitor杠杆区间
+DEFAULT_GRID = dict(k=(1., 1.5, 2., 2.5, 3.), window=(2., 4., 8.), accelerate_after=(0., 1., 2., 4.),
+                    leverage=(1., 2., 3.), band=(0.5, 1.))
+
+# sweep返回的各项
+SWEEP_FIELDS = ('pnl', 'rate', 'rebalances')
+# 子进程内已映射的行情，键为目录
+_mapped: Dict[str, Dict[str, np.ndarray]] = dict()
+
+
+def expand(grid: Dict[str, tuple]) -> List[dict]:
+    """参数网格展开为参数组合列表
+    """
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def save_history(history: Dict[str, np.ndarray], path: str):
+    """行情各列保存为.npy，供子进程内存映射
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, arr in history.items():
+        np.save(os.path.join(path, name + '.npy'), arr)
+
+
+def mapped_history(path: str) -> Dict[str, np.ndarray]:
+    """只读映射save_history保存的行情，每个子进程每个目录只打开一次
+    """
+    if (history := _mapped.get(path)) is None:
+        history = _mapped[path] = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                   for name in ('timestamp',) + backtest.PRICE_FIELDS + backtest.SIZE_FIELDS}
+    return history
+
+
+def sweep_rows(path: str, offset: int, rows: Tuple[int, int], funding: Dict[str, np.ndarray],
+               specs: Dict[str, np.ndarray], start: int, combos: List[dict],
+               fixed: dict) -> Tuple[Tuple[int, int], Dict[str, np.ndarray]]:
+    """子进程：对一批币种依次重放每组参数
+
+    :param path: save_history目录
+    :param offset: 该目录第一行在全部币种中的序号
+    :param rows: 目录内的行号区间
+    :param funding: 这些币种的资金费率
+    :param specs: 这些币种的lot及contract_val
+    :param start: 开始建仓时间，毫秒
+    :param combos: 参数组合
+    :param fixed: 其余replay参数
+    :return: 全部币种中的行号区间及pnl、rate、rebalances，均为(行数, 组合数)
+    """
+    history = {name: arr[rows[0]:rows[1]] for name, arr in mapped_history(path).items()}
+    result = {name: np.empty((rows[1] - rows[0], len(combos))) for name in SWEEP_FIELDS}
+    for j, params in enumerate(combos):
+        replayed = backtest.replay(history, funding, start, **{**fixed, **params, **specs})
+        for name, arr in result.items():
+            arr[:, j] = replayed[name]
+    return (offset + rows[0], offset + rows[1]), result
+
+
+def executor(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """回测进程池，spawn启动，子进程不继承事件循环及数据库连接
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+@call_coroutine
+async def sweep(hours=48., grid: Optional[Dict[str, tuple]] = None, coins: Optional[List[str]] = None,
+                end: Optional[int] = None, batch=32, chunk=4, workers: Optional[int] = None, top=3, account=3,
+                **fixed):
+    """在进程池中对每个币种网格搜索replay参数\n
+    每次读取batch个币种的行情并保存为.npy，子进程内存映射后按行切片，不复制；读取下一批时前一批已在计算。
+    每完成chunk个币种即打印其中各币种收益最高的top组参数。
+
+    :param hours: 回测几小时
+    :param grid: 参数名到候选值，默认DEFAULT_GRID
+    :param coins: 币种列表，默认列式存储中的全部币种
+    :param end: 截止时间，毫秒，默认现在
+    :param batch: 每次读取的币种数
+    :param chunk: 每个任务的币种数
+    :param workers: 进程数，默认CPU核数
+    :param top: 每个币种打印几组
+    :param account: 读取合约规格的账号id
+    :param fixed: 其余replay参数，如usdt_size、open_diff、close_diff、hold
+    :return: instrument、combos及pnl、rate、rebalances，均为(币种数, 组合数)
+    :rtype: dict
+    """
+    grid = grid or DEFAULT_GRID
+    combos = expand(grid)
+    if end is None:
+        end = int(time.time() * 1000)
+    start = end - int(hours * 3600_000)
+    coins = backtest.PremiumStore.instruments() if coins is None else coins
+    fixed = {**dict(open_diff=None, close_diff=None), **fixed}
+    # 按最长的统计窗口向前多读
+    lookback = int(max(grid.get('window', (fixed.get('window', 4.),))) * 3600_000)
+    result = dict(instrument=list(coins), combos=combos)
+    result.update({name: np.full((len(coins), len(combos)), np.nan) for name in SWEEP_FIELDS})
+    path = tempfile.mkdtemp(prefix='sweep-', dir=store_dir if os.path.isdir(store_dir) else None)
+    fprint(lang.sweep_start.format(len(coins), len(combos)))
+    fprint(lang.sweep_title + ''.join(f'{name:>10s}' for name in grid))
+    try:
+        with executor(workers) as pool:
+            futures = []
+            for i in range(0, len(coins), batch):
+                part = coins[i:i + batch]
+                history, funding, (lot, contract_val) = await asyncio.gather(
+                    backtest.load_history(part, start - lookback, end), backtest.load_funding(part, start, end),
+                    backtest.contract_specs(part, account))
+                save_history(history, part_path := os.path.join(path, str(i)))
+                del history
+                futures += [asyncio.wrap_future(pool.submit(
+                    sweep_rows, part_path, i, (j, min(j + chunk, len(part))),
+                    {name: arr[j:j + chunk] for name, arr in funding.items()},
+                    dict(lot=lot[j:j + chunk], contract_val=contract_val[j:j + chunk]), start, combos, fixed))
+                    for j in range(0, len(part), chunk)]
+            for future in asyncio.as_completed(futures):
+                (i, j), replayed = await future
+                for name, arr in replayed.items():
+                    result[name][i:j] = arr
+                for row in range(i, j):
+                    for n in np.argsort(-np.nan_to_num(result['pnl'][row], nan=-np.inf))[:top].tolist():
+                        fprint(f"{coins[row]:8s}{result['pnl'][row, n]:10.2f}{result['rate'][row, n]:9.2%}"
+                              f"{result['rebalances'][row, n]:6.0f}"
+                              + ''.join(f'{combos[n][name]:10g}' for name in grid))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return result
+
+
+def print_ranking(result: dict, top=20):
+    """按全部币种平均收益率从高到低打印参数组合
+    """
+    mean = result['rate'].mean(axis=0)
+    names = list(result['combos'][0]) if result['combos'] else []
+    fprint(lang.sweep_ranking + ''.join(f'{name:>10s}' for name in names))
+    for n in np.argsort(-np.nan_to_num(mean, nan=-np.inf))[:top].tolist():
+        fprint(f'{mean[n]:9.3%}' + ''.join(f"{result['combos'][n][name]:10g}" for name in names))
+
+
+if __name__ == '__main__':
+    # 参数扫描：python -m src.sweep [小时数] [进程数]
+    arguments = dict(hours=float(sys.argv[1])) if len(sys.argv) > 1 else dict()
+    if len(sys.argv) > 2:
+        arguments['workers'] = int(sys.argv[2])
+    print_ranking(sweep(**arguments))
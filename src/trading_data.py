@@ -1,10 +1,20 @@
+import os
 from okx.async_okx_v5.public import PublicAPI
 import src.record as record
+from src.config import min_coverage, plot_dir, plot_format, record_interval, stat_cache_size, stat_cache_ttl, \
+    threshold_mode
+import src.render as render
+from src.ratelimit import LOW, RateLimited
+from src.store import CandleStore, PremiumStore, bar_duration, raw_stat, rollup_stat, sketch_quantile, \
+    universe_stat
+from src.rolling import PremiumRollingStat
 from src.utils import *
 from src.lang import *
-import matplotlib.pyplot as plt
 import numpy as np
 
+# 进程内Stat统计值缓存，键为(币种, 列, 小时数, 'stat'、直方图区间数或分位)
+stat_cache = TTLCache(stat_cache_size, stat_cache_ttl)
+
 
 def true_range(candle: np.ndarray, previous: np.ndarray) -> np.ndarray:
     """相对振幅
@@ -46,10 +56,29 @@ def average_true_range(candles: List[List], days, bar='4H'):
     return np.mean(tr)
 
 
+def stacked_true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """多个币种同时计算相对振幅
+
+    :param high: 最高价，每行一个币种，按时间递增，缺失为NaN
+    :param low: 最低价
+    :param close: 收盘价
+    :return: 比输入少一列
+    """
+    previous = close[:, :-1]
+    tr = np.fmax(high[:, 1:] - low[:, 1:], np.fmax(np.abs(high[:, 1:] - previous), np.abs(low[:, 1:] - previous)))
+    return tr / previous
+
+
+def normal_cdf(k: float) -> float:
+    """标准正态分布函数Φ(k)
+    """
+    return 0.5 * (1 + math.erf(k / math.sqrt(2)))
+
+
 class Stat:
     """交易数据统计功能类
     """
-    publicAPI = PublicAPI()
+    publicAPI = RateLimited(PublicAPI(), LOW)
 
     def __init__(self, coin: str = None):
         self.coin = coin
@@ -58,317 +87,423 @@ class Stat:
             self.spot_ID = coin + '-USDT'
             self.swap_ID = coin + '-USDT-SWAP'
 
+    async def cached_candles(self, instId: str, bar: str, count: int) -> Dict[str, np.ndarray]:
+        """最近count根已完结K线，先读本地缓存，只补取缓存之后的部分
+
+        :param instId: 产品ID
+        :param bar: K线周期
+        :param count: 根数
+        :return: CandleStore各列，按时间递增
+        """
+        store = CandleStore.get(instId, bar)
+        current = int(time.time() * 1000) // store.duration * store.duration
+        since = max(store.end() or 0, current - count * store.duration)
+        candles, after = [], str(current)
+        # 缓存已到当前未完结K线之前时不请求
+        while since < current:
+            # 按时间倒序，返回早于after的至多100根
+            page = await self.publicAPI.get_history_candles(instId, after=after, bar=bar, limit='100')
+            candles += page
+            if len(page) < 100 or int(page[-1][0]) <= since:
+                break
+            after = page[-1][0]
+        store.extend(candles)
+        return store.tail(count)
+
     # @debug_timer
-    async def profitability(self, funding_rate_list, days=7) -> List[dict]:
-        """显示各币种资金费率除以波动率
+    async def profitability(self, coins: List[str], funding_rate: np.ndarray, days=7, bar='4H') -> np.ndarray:
+        """各币种资金费率除以波动率，K线读本地缓存，所有币种一起计算平均相对振幅
+
+        :param coins: 币种列表
+        :param funding_rate: 各币种平均资金费率
+        :param days: 最近几天
+        :param bar: K线周期
+        :return: 各币种int(资金费率 / sqrt(平均相对振幅) * 10000)，没有K线时为0
         """
-        task_list = [
-            self.publicAPI.get_candles_for_days(n['instrument'] + '-USDT', days, '4H') for n in funding_rate_list]
-        gather_result = await asyncio.gather(*task_list)
-        for n in range(len(funding_rate_list)):
-            atr = average_true_range(gather_result[n], days, '4H')
-            funding_rate_list[n]['profitability'] = int(funding_rate_list[n]['funding_rate'] / np.sqrt(atr) * 10000)
-        funding_rate_list.sort(key=lambda x: x['profitability'], reverse=True)
-        funding_rate_list = funding_rate_list[:10]
-        fprint(coin_funding_value)
-        for n in funding_rate_list:
-            fprint(f"{n['instrument']:9s}{n['funding_rate']:7.3%}"
-                   f"{n['funding_rate'] * 3 * 365:8.2%}{n['profitability']:8d}")
-        return funding_rate_list
+        count = days * 86400_000 // bar_duration(bar) + 1
+        gather_result = await asyncio.gather(*[self.cached_candles(coin + '-USDT', bar, count) for coin in coins])
+        # 每行一个币种，右对齐到最近一根，不足的在前面补NaN
+        stacked = {name: np.full((len(coins), count), np.nan) for name in ('high', 'low', 'close')}
+        for i, candles in enumerate(gather_result):
+            for name, arr in stacked.items():
+                arr[i, count - len(candles[name]):] = candles[name]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tr = stacked_true_range(stacked['high'], stacked['low'], stacked['close'])
+            valid = np.count_nonzero(~np.isnan(tr), axis=1)
+            atr = np.nansum(tr, axis=1) / np.maximum(valid, 1)
+            ratio = np.asarray(funding_rate, dtype=np.float64) / np.sqrt(atr) * 10000
+        return np.where((valid > 0) & (atr > 0), ratio, 0.).astype(np.int64)
 
     async def historical_volatility(self, instId):
         pass
 
-    def open_dist(self, hours=4):
-        """开仓期现差价正态分布统计
+    async def premium_array(self, hours, field) -> np.ndarray:
+        """近期期现差价数组，优先读列式存储
+
+        :param hours: 最近几小时
+        :param field: 'open_pd'或'close_pd'
         """
+        if window := self.store_window(hours, (field,)):
+            return window[field]
         Ticker = record.Record('Ticker')
         timestamp = datetime.utcnow() - timedelta(hours=hours)
-
         pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}},
-                    {'$group': {'_id': '$instrument', 'avg': {'$avg': '$open_pd'}, 'std': {'$stdDevSamp': '$open_pd'},
-                                'max': {'$max': '$open_pd'}, 'min': {'$min': '$open_pd'}, 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        avg = result['avg']
-        std = result['std']
-        total = result['count']
-        p1sigma = avg + std
-        m1sigma = avg - std
-        p2sigma = avg + 2 * std
-        m2sigma = avg - 2 * std
-        p3sigma = avg + 3 * std
-        m3sigma = avg - 3 * std
-
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'open_pd': {'$lt': p1sigma, '$gt': m1sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count1 = result['count']
-        frequency1 = count1 / total
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'open_pd': {'$lt': p2sigma, '$gt': m2sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count2 = result['count']
-        frequency2 = count2 / total
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'open_pd': {'$lt': p3sigma, '$gt': m3sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count3 = result['count']
-        frequency3 = count3 / total
-        return dict(avg=avg, std=std, frequency1=frequency1, frequency2=frequency2, frequency3=frequency3)
-
-    def close_dist(self, hours=4):
+                    {'$project': {'_id': 0, field: 1}}]
+        return np.fromiter((x[field] for x in await Ticker.acol.aggregate(pipeline)), dtype=np.float64)
+
+    @call_coroutine
+    async def premium_dist(self, hours=4, field='open_pd', bin_num=40):
+        """一次取出窗口数据，计算统计值、1至3倍标准差内频率及直方图
+
+        :param hours: 最近几小时
+        :param field: 'open_pd'或'close_pd'
+        :param bin_num: 直方图区间数
+        :return: avg, std, max, min, count, frequency1-3, premiums区间中点, prob区间频率, width区间宽度
+        :rtype: dict
+        """
+        key = (self.coin, field, hours, bin_num)
+        version = PremiumStore.get(self.coin).version()
+        if (stat := stat_cache.get(key, version)) is not None:
+            return stat
+        arr = await self.premium_array(hours, field)
+        if not (count := len(arr)):
+            return None
+        avg = float(arr.mean())
+        std = float(arr.std(ddof=1)) if count > 1 else 0.
+        # 区间(avg - kσ, avg + kσ)不含端点
+        deviation = np.abs(arr - avg)
+        frequency = [np.count_nonzero(deviation < k * std) / count if std else 1. for k in (1, 2, 3)]
+        low, high = float(arr.min()), float(arr.max())
+        width = (high - low) / bin_num
+        # 等宽区间，最大值计入最后一个区间
+        binning = ((arr - low) * (1 / width)).astype(np.intp) if width else np.zeros(count, dtype=np.intp)
+        np.minimum(binning, bin_num - 1, out=binning)
+        prob = np.bincount(binning, minlength=bin_num) / count
+        stat = dict(avg=avg, std=std, max=high, min=low, count=count, frequency1=frequency[0],
+                    frequency2=frequency[1], frequency3=frequency[2],
+                    premiums=low + (np.arange(bin_num) + 0.5) * width, prob=prob, width=width)
+        stat_cache.put(key, stat, version)
+        return stat
+
+    @call_coroutine
+    async def open_dist(self, hours=4):
+        """开仓期现差价正态分布统计
+        """
+        if stat := await self.premium_dist(hours, 'open_pd'):
+            return {key: stat[key] for key in ('avg', 'std', 'frequency1', 'frequency2', 'frequency3')}
+
+    @call_coroutine
+    async def close_dist(self, hours=4):
         """平仓期现差价正态分布统计
         """
-        Ticker = record.Record('Ticker')
-        timestamp = datetime.utcnow() - timedelta(hours=hours)
+        if stat := await self.premium_dist(hours, 'close_pd'):
+            return {key: stat[key] for key in ('avg', 'std', 'frequency1', 'frequency2', 'frequency3')}
 
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}},
-                    {'$group': {'_id': '$instrument', 'avg': {'$avg': '$close_pd'}, 'std': {'$stdDevSamp': '$close_pd'},
-                                'max': {'$max': '$close_pd'}, 'min': {'$min': '$close_pd'}, 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        avg = result['avg']
-        std = result['std']
-        total = result['count']
-        p1sigma = avg + std
-        m1sigma = avg - std
-        p2sigma = avg + 2 * std
-        m2sigma = avg - 2 * std
-        p3sigma = avg + 3 * std
-        m3sigma = avg - 3 * std
-
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'close_pd': {'$lt': p1sigma, '$gt': m1sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count1 = result['count']
-        frequency1 = count1 / total
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'close_pd': {'$lt': p2sigma, '$gt': m2sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count2 = result['count']
-        frequency2 = count2 / total
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp},
-                                'close_pd': {'$lt': p3sigma, '$gt': m3sigma}}},
-                    {'$group': {'_id': '$instrument', 'count': {'$sum': 1}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)][0]
-        count3 = result['count']
-        frequency3 = count3 / total
-        return dict(avg=avg, std=std, frequency1=frequency1, frequency2=frequency2, frequency3=frequency3)
-
-    def gaussian_dist(self, hours=4, side='o'):
-        Ticker = record.Record('Ticker')
-        timestamp = datetime.utcnow() - timedelta(hours=hours)
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}}]
-        result = [x for x in Ticker.mycol.aggregate(pipeline)]
+    @call_coroutine
+    async def gaussian_dist(self, hours=4, side='o'):
+        """在绘图进程中画出期现差价分布与正态分布对比图，保存到plot_dir
 
-        if side == 'o':
-            arr = np.asarray([x['open_pd'] for x in result], dtype=float)
-        else:
-            arr = np.asarray([x['close_pd'] for x in result], dtype=float)
-        min = np.min(arr)
-        max = np.max(arr)
-        bin_num = 40
-        width = (max - min) / bin_num
-        premiums = np.asarray([min + (i + 0.5) * width for i in range(bin_num)])
-        binning = (arr - min) // width
-        binning = np.asarray(binning, dtype=int)
-        prob = np.zeros(bin_num)
-        bins, counts = np.unique(binning, return_counts=True)
-        for n in range(len(bins)):
-            if bins[n] == bin_num:
-                prob[bin_num - 1] += counts[n]
-            else:
-                prob[bins[n]] = counts[n]
-        prob = prob / np.sum(counts)
-        stat = self.open_dist(hours) if side == 'o' else self.close_dist(hours)
-        avg = stat['avg']
-        std = stat['std']
-        p1sigma = avg + std
-        m1sigma = avg - std
-        p2sigma = avg + 2 * std
-        m2sigma = avg - 2 * std
-        p3sigma = avg + 3 * std
-        m3sigma = avg - 3 * std
-        frequency1 = stat['frequency1']
-        frequency2 = stat['frequency2']
-        frequency3 = stat['frequency3']
-        x = np.arange(min, max, width / 10)
-        y = np.exp(- np.square(x - avg) / 2. / std ** 2) / std / np.sqrt(2 * np.pi) * width
-
-        if language == 'cn':
-            plt.rcParams['font.sans-serif'] = ['SimHei']
-            plt.rcParams['axes.unicode_minus'] = False
-        plt.rcParams['font.size'] = 12
-        plt.figure(figsize=(16, 8))
-        color = 'g' if side == 'o' else 'r'
-        plt.plot(premiums, prob, '.', color=color, label=historical_data)
-        plt.plot(x, y, '-', color='b', label=gaussian_dist)
-
-        plt.axvline(avg, color='orange', label=plot_average.format(avg))
-        ymax = np.exp(- 1. / 2) / std / np.sqrt(2 * np.pi) * width
-        y = np.arange(0, ymax, ymax / 100)
-        plt.plot([p1sigma] * len(y), y, '-', color='m', label=r'$\sigma$ ' + plot_probability + f': {frequency1:.2%}')
-        plt.plot([m1sigma] * len(y), y, '-', color='m')
-        ymax = np.exp(- 4. / 2) / std / np.sqrt(2 * np.pi) * width
-        y = np.arange(0, ymax, ymax / 100)
-        plt.plot([p2sigma] * len(y), y, '-', color='m', label=r'$2\sigma$ ' + plot_probability + f': {frequency2:.2%}')
-        plt.plot([m2sigma] * len(y), y, '-', color='m')
-        ymax = np.exp(- 9. / 2) / std / np.sqrt(2 * np.pi) * width
-        y = np.arange(0, ymax, ymax / 100)
-        plt.plot([p3sigma] * len(y), y, '-', color='m', label=r'$3\sigma$ ' + plot_probability + f': {frequency3:.2%}')
-        plt.plot([m3sigma] * len(y), y, '-', color='m')
-        if side == 'o':
-            plt.xlabel(pd_open, fontsize=14)
-        else:
-            plt.xlabel(pd_close, fontsize=14)
-        plt.gca().yaxis.set_major_formatter('{x:.0%}')
-        plt.gca().xaxis.set_major_formatter('{x:.3%}')
-        plt.ylabel(plot_probability, fontsize=14)
-        plt.ylim(bottom=0)
-        plt.legend(loc='best', fontsize=16)
-        plt.title(plot_title.format(self.coin, hours), fontsize=18)
-        plt.show()
-
-    def recent_ticker(self, hours=4):
-        """返回近期期现差价列表
+        :param hours: 最近几小时
+        :param side: 'o'开仓，'c'平仓
+        :return: 文件路径
+        """
+        if not (stat := await self.premium_dist(hours, 'open_pd' if side == 'o' else 'close_pd')):
+            return None
+        labels = dict(historical_data=historical_data, gaussian_dist=gaussian_dist,
+                      average=plot_average.format(stat['avg']), probability=plot_probability,
+                      xlabel=pd_open if side == 'o' else pd_close, title=plot_title.format(self.coin, hours))
+        path = self.plot_path(f'dist_{side}', hours)
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(render.executor(), functools.partial(
+            render.gaussian_dist, path, stat, 'g' if side == 'o' else 'r', labels, language))
+        fprint(plot_saved.format(path))
+        return path
+
+    def plot_path(self, kind: str, hours) -> str:
+        """图片文件路径
+        """
+        return os.path.join(plot_dir, f"{self.coin}_{kind}_{hours}h_{datetime.now():%Y%m%d-%H%M%S}.{plot_format}")
+
+    def store_window(self, hours, columns):
+        """从列式存储读取近期数据，存储未覆盖整个窗口时返回None
 
         :param hours: 最近几小时
+        :param columns: 列名
+        :rtype: Dict[str, np.ndarray]
         """
-        Ticker = record.Record('Ticker')
-        timestamp = datetime.utcnow() - timedelta(hours=hours)
+        store = PremiumStore.get(self.coin)
+        start = int((time.time() - hours * 3600) * 1000)
+        if (first := store.first()) is None or first > start:
+            return None
+        return store.window(start, columns=columns)
 
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}}]
-        timelist: List[datetime] = []
-        open_pd: List[float] = []
-        close_pd: List[float] = []
-        for x in Ticker.mycol.aggregate(pipeline):
-            utctime: datetime = x['timestamp']
-            localtime = utctime.replace(tzinfo=timezone.utc).astimezone(tz=None)
-            timelist.append(localtime)
-            open_pd.append(x['open_pd'])
-            close_pd.append(x['close_pd'])
-        return dict(timestamp=timelist, open_pd=open_pd, close_pd=close_pd)
-
-    def recent_open_stat(self, hours=4):
-        """返回近期开仓期现差价统计值
+    def store_stat(self, hours, field):
+        """近期统计值，原始数据覆盖窗口时用滚动统计或整段扫描原始数据，超出原始数据保留期才用汇总，都未覆盖时返回None
 
         :param hours: 最近几小时
+        :param field: 'open_pd'或'close_pd'
         :rtype: dict
         """
+        if (stat := PremiumRollingStat.get(self.coin, field, hours).update()) is not None:
+            return stat
+        start = int((time.time() - hours * 3600) * 1000)
+        if (stat := raw_stat(self.coin, field, start)) is not None:
+            return stat
+        return rollup_stat(self.coin, field, start)
+
+    async def recent_arrays(self, hours=4) -> Dict[str, np.ndarray]:
+        """近期期现差价数组，timestamp为毫秒，优先读列式存储
+
+        :param hours: 最近几小时
+        """
+        if window := self.store_window(hours, ('timestamp', 'open_pd', 'close_pd')):
+            return window
         Ticker = record.Record('Ticker')
         timestamp = datetime.utcnow() - timedelta(hours=hours)
-
         pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}},
-                    {'$group': {'_id': '$instrument', 'avg': {'$avg': '$open_pd'}, 'std': {'$stdDevSamp': '$open_pd'},
-                                'max': {'$max': '$open_pd'}, 'min': {'$min': '$open_pd'}}}]
-        return result[0] if (result := [x for x in Ticker.mycol.aggregate(pipeline)]) else None
+                    {'$project': {'_id': 0, 'timestamp': 1, 'open_pd': 1, 'close_pd': 1}}]
+        result = await Ticker.acol.aggregate(pipeline)
+        return dict(timestamp=np.fromiter((int(x['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1000)
+                                           for x in result), dtype=np.int64, count=len(result)),
+                    open_pd=np.fromiter((x['open_pd'] for x in result), dtype=np.float64, count=len(result)),
+                    close_pd=np.fromiter((x['close_pd'] for x in result), dtype=np.float64, count=len(result)))
+
+    @call_coroutine
+    async def recent_ticker(self, hours=4):
+        """返回近期期现差价列表
 
-    def recent_close_stat(self, hours=4):
+        :param hours: 最近几小时
+        """
+        window = await self.recent_arrays(hours)
+        timelist = [datetime.fromtimestamp(n / 1000, tz=timezone.utc).astimezone(tz=None)
+                    for n in window['timestamp'].tolist()]
+        return dict(timestamp=timelist, open_pd=window['open_pd'].tolist(), close_pd=window['close_pd'].tolist())
+
+    async def recent_stat(self, hours, field, coverage=min_coverage):
+        """近期期现差价统计值，结果按(币种, 列, 小时数)缓存，有新行情或超时后重算
+
+        :param hours: 最近几小时
+        :param field: 'open_pd'或'close_pd'
+        :param coverage: 有采样的分钟占比低于此值时返回None
+        :rtype: dict
+        """
+        key = (self.coin, field, hours, 'stat')
+        version = PremiumStore.get(self.coin).version()
+        if (stat := stat_cache.get(key, version)) is None:
+            if (stat := self.store_stat(hours, field)) is None:
+                Ticker = record.Record('Ticker')
+                timestamp = datetime.utcnow() - timedelta(hours=hours)
+                pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}},
+                            {'$group': {'_id': '$instrument', 'avg': {'$avg': '$' + field},
+                                        'std': {'$stdDevSamp': '$' + field}, 'max': {'$max': '$' + field},
+                                        'min': {'$min': '$' + field}}}]
+                stat = result[0] if (result := await Ticker.acol.aggregate(pipeline)) else None
+            if stat is not None:
+                stat_cache.put(key, stat, version)
+        # Mongo结果没有coverage
+        return stat if stat is not None and stat.get('coverage', 1.) >= coverage else None
+
+    @call_coroutine
+    async def recent_open_stat(self, hours=4, coverage=min_coverage):
+        """返回近期开仓期现差价统计值
+
+        :param hours: 最近几小时
+        :param coverage: 有采样的分钟占比低于此值时返回None
+        :rtype: dict
+        """
+        return await self.recent_stat(hours, 'open_pd', coverage)
+
+    @call_coroutine
+    async def recent_close_stat(self, hours=4, coverage=min_coverage):
         """返回近期平仓期现差价统计值
 
         :param hours: 最近几小时
+        :param coverage: 有采样的分钟占比低于此值时返回None
         :rtype: dict
         """
-        Ticker = record.Record('Ticker')
-        timestamp = datetime.utcnow() - timedelta(hours=hours)
+        return await self.recent_stat(hours, 'close_pd', coverage)
 
-        pipeline = [{'$match': {'instrument': self.coin, 'timestamp': {'$gt': timestamp}}},
-                    {'$group': {'_id': '$instrument', 'avg': {'$avg': '$close_pd'}, 'std': {'$stdDevSamp': '$close_pd'},
-                                'max': {'$max': '$close_pd'}, 'min': {'$min': '$close_pd'}}}]
-        return result[0] if (result := [x for x in Ticker.mycol.aggregate(pipeline)]) else None
+    def recent_quantile(self, hours, field, q):
+        """近期期现差价分位数，结果缓存，存储未覆盖窗口时返回None\n
+        原始数据覆盖窗口时直接求分位数，否则由每小时分位数摘要与两端原始数据合并得出。
 
-    def open_time(self, account):
+        :param hours: 最近几小时
+        :param field: 'open_pd'或'close_pd'
+        :param q: 0至1之间的分位
+        :rtype: float
+        """
+        key = (self.coin, field, hours, q)
+        version = PremiumStore.get(self.coin).version()
+        if (value := stat_cache.get(key, version)) is None:
+            if (window := self.store_window(hours, (field,))) and len(window[field]):
+                value = np.quantile(window[field], q)
+            else:
+                value = sketch_quantile(self.coin, field, q, int((time.time() - hours * 3600) * 1000))
+            if value is not None:
+                value = float(value)
+                stat_cache.put(key, value, version)
+        return value
+
+    @call_coroutine
+    async def open_threshold(self, hours=4, k=2., coverage=min_coverage):
+        """开仓期现差价阈值\n
+        threshold_mode为'sigma'时为avg + k * std；为'quantile'时为正态分布下同样概率Φ(k)的历史分位数，不假设差价服从正态分布。
+
+        :param hours: 最近几小时
+        :param k: 标准差倍数
+        :param coverage: 有采样的分钟占比低于此值时返回None
+        :rtype: float
+        """
+        if not (recent := await self.recent_open_stat(hours, coverage)):
+            return None
+        if threshold_mode == 'quantile':
+            if (value := self.recent_quantile(hours, 'open_pd', normal_cdf(k))) is not None:
+                return value
+        return recent['avg'] + k * recent['std']
+
+    @call_coroutine
+    async def close_threshold(self, hours=4, k=2., coverage=min_coverage):
+        """平仓期现差价阈值\n
+        threshold_mode为'sigma'时为avg - k * std；为'quantile'时为正态分布下同样概率1 - Φ(k)的历史分位数。
+
+        :param hours: 最近几小时
+        :param k: 标准差倍数
+        :param coverage: 有采样的分钟占比低于此值时返回None
+        :rtype: float
+        """
+        if not (recent := await self.recent_close_stat(hours, coverage)):
+            return None
+        if threshold_mode == 'quantile':
+            if (value := self.recent_quantile(hours, 'close_pd', 1 - normal_cdf(k))) is not None:
+                return value
+        return recent['avg'] - k * recent['std']
+
+    @call_coroutine
+    async def universe_stat(self, hours=4, coins: Optional[List[str]] = None, coverage=min_coverage):
+        """全部币种近期开平仓期现差价统计值，列式存储一次遍历，未存储的币种用一次按币种分组的聚合
+
+        :param hours: 最近几小时
+        :param coins: 币种列表，默认全部
+        :param coverage: 有采样的分钟占比低于此值的币种不返回
+        :return: {币种: {'open_pd': 统计值, 'close_pd': 统计值}}
+        :rtype: Dict[str, dict]
+        """
+        stats = universe_stat(int((time.time() - hours * 3600) * 1000))
+        if coins is not None:
+            stats = {coin: stats[coin] for coin in coins if coin in stats}
+        # 只有存储中没有的币种才查Mongo，覆盖率不足的币种不再用Mongo补上
+        missing = None if coins is None else [coin for coin in coins if coin not in stats]
+        fallback = (missing is None and not stats) or missing
+        stats = {coin: n for coin, n in stats.items()
+                 if min(n['open_pd']['coverage'], n['close_pd']['coverage']) >= coverage}
+        if fallback:
+            Ticker = record.Record('Ticker')
+            timestamp = datetime.utcnow() - timedelta(hours=hours)
+            match = {'timestamp': {'$gt': timestamp}}
+            if missing:
+                match['instrument'] = {'$in': missing}
+            group = {'_id': '$instrument', 'count': {'$sum': 1}}
+            for field in ('open_pd', 'close_pd'):
+                group.update({f'{field}_avg': {'$avg': '$' + field}, f'{field}_std': {'$stdDevSamp': '$' + field},
+                              f'{field}_max': {'$max': '$' + field}, f'{field}_min': {'$min': '$' + field}})
+            # Mongo结果没有coverage，按采样间隔折算成条数，至少2条才有标准差
+            count = max(2, int(coverage * hours * 3600 / record_interval))
+            pipeline = [{'$match': match}, {'$group': group}, {'$match': {'count': {'$gte': count}}}]
+            for n in await Ticker.acol.aggregate(pipeline):
+                stats[n['_id']] = {field: dict(avg=n[f'{field}_avg'], std=n[f'{field}_std'] or 0.,
+                                               max=n[f'{field}_max'], min=n[f'{field}_min'], count=n['count'])
+                                   for field in ('open_pd', 'close_pd')}
+        return stats
+
+    @call_coroutine
+    async def open_time(self, account):
         """返回开仓时间
 
         :param account: 账号id
         :rtype: datetime
         """
-        Ledger = record.Record('Ledger')
-        pipeline = [{'$match': {'account': account, 'instrument': self.coin, 'title': '开仓'}},
-                    {'$sort': {'_id': -1}}, {'$limit': 1}]
-        open_time = result[0]['timestamp'] if (result := [x for x in Ledger.mycol.aggregate(pipeline)]) else None
-        return open_time if open_time else datetime(2021, 4, 1)
+        summary = await record.Ledger().latest_summary(account, self.coin)
+        return summary['open_time'] if summary else record.LEDGER_EPOCH
 
-    def close_time(self, account):
-        """返回开仓时间
+    @call_coroutine
+    async def close_time(self, account):
+        """返回最近一次开仓后的平仓时间，未平仓时返回当前时间
 
         :param account: 账号id
         :rtype: datetime
         """
-        Ledger = record.Record('Ledger')
-        pipeline = [{'$match': {'account': account, 'instrument': self.coin, 'title': '平仓'}},
-                    {'$sort': {'_id': -1}}, {'$limit': 1}]
-        close_time = result[0]['timestamp'] if (result := [x for x in Ledger.mycol.aggregate(pipeline)]) else None
-        return close_time if close_time else datetime.utcnow()
+        summary = await record.Ledger().latest_summary(account, self.coin)
+        return summary['close_time'] if summary and summary.get('close_time') else datetime.utcnow()
 
-    def history_funding(self, account, days=0):
+    @call_coroutine
+    async def history_pnl(self, account, days=0):
+        """最近累计资金费及成本，一次查询
+
+        :param account: 账号id
+        :param days: 最近几天，0为最近一次开仓算起，读取汇总；-1为全部，累加各次汇总
+        :return: funding, cost, open_time, close_time, position
+        :rtype: dict
+        """
+        Ledger = record.Ledger()
+        if days == 0:
+            summary = await Ledger.latest_summary(account, self.coin) or dict(open_time=record.LEDGER_EPOCH)
+        elif days == -1:
+            summary = await Ledger.total_summary(account, self.coin) or dict()
+            summary['open_time'] = record.LEDGER_EPOCH
+        else:
+            open_time = datetime.utcnow() - timedelta(days=days)
+            pipeline = [{'$match': {'account': account, 'instrument': self.coin, 'timestamp': {'$gt': open_time}}},
+                        {'$group': {'_id': '$instrument', **{key: {'$sum': '$' + key} for key in Ledger.summed}}}]
+            summary = result[0] if (result := await Ledger.acol.aggregate(pipeline)) else dict()
+            summary['open_time'] = open_time
+        return dict(funding=summary.get('funding', 0.),
+                    cost=sum(summary.get(key, 0.) for key in ('spot_notional', 'swap_notional', 'fee')),
+                    open_time=summary['open_time'], close_time=summary.get('close_time'),
+                    position=summary.get('position', 0.))
+
+    @call_coroutine
+    async def history_funding(self, account, days=0):
         """最近累计资金费
 
         :param account: 账号id
         :param days: 最近几天，默认开仓算起
         :rtype: float
         """
-        Ledger = record.Record('Ledger')
-        if days == -1:
-            open_time = datetime(2021, 4, 1)
-        elif days == 0:
-            open_time = self.open_time(account)
-        else:
-            open_time = datetime.utcnow() - timedelta(days=days)
-        pipeline = [{'$match': {'account': account, 'instrument': self.coin, 'timestamp': {'$gt': open_time}}},
-                    {'$group': {'_id': '$instrument', 'sum': {'$sum': '$funding'}}}]
-        return result[0]['sum'] if (result := [x for x in Ledger.mycol.aggregate(pipeline)]) else 0.
+        return (await self.history_pnl(account, days))['funding']
 
-    def history_cost(self, account, days=0):
+    @call_coroutine
+    async def history_cost(self, account, days=0):
         """最近累计成本
 
         :param account: 账号id
         :param days: 最近几天，默认开仓算起
         :rtype: float
         """
-        Ledger = record.Record('Ledger')
-        if days == -1:
-            open_time = datetime(2021, 4, 1)
-        elif days == 0:
-            open_time = self.open_time(account)
-        else:
-            open_time = datetime.utcnow() - timedelta(days=days)
-        pipeline = [{'$match': {'account': account, 'instrument': self.coin, 'timestamp': {'$gt': open_time}}},
-                    {'$group': {'_id': '$instrument', 'spot_notional': {'$sum': '$spot_notional'},
-                                'swap_notional': {'$sum': '$swap_notional'}, 'fee': {'$sum': '$fee'}}}]
-        for x in Ledger.mycol.aggregate(pipeline):
-            return x['spot_notional'] + x['swap_notional'] + x['fee']
-        return 0.
+        return (await self.history_pnl(account, days))['cost']
 
-    def plot(self, hours=4):
-        """画出最近期现差价散点图
+    @call_coroutine
+    async def plot(self, hours=4):
+        """在绘图进程中画出最近期现差价散点图，保存到plot_dir
 
         :param hours: 最近几小时
+        :return: 文件路径
         """
-        recent = self.recent_open_stat(hours)
-        open_pd = recent['avg'] + 2 * recent['std']
-        recent = self.recent_close_stat(hours)
-        close_pd = recent['avg'] - 2 * recent['std']
-        mylist = self.recent_ticker(hours)
-        if language == 'cn':
-            plt.rcParams['font.sans-serif'] = ['SimHei']
-            plt.rcParams['axes.unicode_minus'] = False
-        plt.rcParams['font.size'] = 12
-        plt.figure(figsize=(16, 8))
-        plt.plot(mylist['timestamp'], mylist['open_pd'], '.', color='g', label=pd_open)
-        plt.axhline(y=open_pd, color='g', linestyle='-', label=r'$\mu+2\sigma$')
-        # plt.plot(mylist['timestamp'], [open_pd] * len(mylist['timestamp']), '-', color='g', label=two_std)
-        plt.plot(mylist['timestamp'], mylist['close_pd'], '.', color='r', label=pd_close)
-        plt.axhline(y=close_pd, color='r', linestyle='-', label=r'$\mu-2\sigma$')
-        # plt.plot(mylist['timestamp'], [close_pd] * len(mylist['timestamp']), '-', color='r', label=two_std)
-        # plt.xticks(rotation=45)
-        plt.gca().yaxis.set_major_formatter('{x:.3%}')
-        plt.xlabel(plot_time, fontsize=14)
-        plt.ylabel(plot_premium, fontsize=14)
-        plt.legend(loc='best', fontsize=14)
-        plt.title(plot_title.format(self.coin, hours), fontsize=18)
-        plt.show()
+        # 画图不受覆盖率限制，没有采样时阈值为None，不画阈值线
+        open_pd = await self.open_threshold(hours, 2, coverage=0)
+        close_pd = await self.close_threshold(hours, 2, coverage=0)
+        data = {name: np.array(arr) for name, arr in (await self.recent_arrays(hours)).items()}
+        if threshold_mode == 'quantile':
+            p = normal_cdf(2) * 100
+            open_label, close_label = rf'$P_{{{p:.1f}}}$', rf'$P_{{{100 - p:.1f}}}$'
+        else:
+            open_label, close_label = r'$\mu+2\sigma$', r'$\mu-2\sigma$'
+        labels = dict(pd_open=pd_open, pd_close=pd_close, time=plot_time, premium=plot_premium,
+                      title=plot_title.format(self.coin, hours), open_threshold=open_label,
+                      close_threshold=close_label)
+        utcoffset = int(datetime.now().astimezone().utcoffset().total_seconds() * 1000)
+        path = self.plot_path('premium', hours)
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(render.executor(), functools.partial(
+            render.premium_scatter, path, data, open_pd, close_pd, labels, language, utcoffset))
+        fprint(plot_saved.format(path))
+        return path
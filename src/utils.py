@@ -1,8 +1,7 @@
-from typing import List, ContextManager, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any
 import collections
 import functools
 import inspect
-import multiprocessing
 from datetime import datetime, timedelta, timezone
 import math
 import time
@@ -75,40 +74,6 @@ def round_to(number, divider) -> float:
         return round(number / divider // 1 * divider)
 
 
-class p_Semaphore(ContextManager):
-    """A custom semaphore to be used with REST API with velocity limit by processes
-    """
-
-    def __init__(self, concurrency: int, interval: int):
-        """控制REST API并发连接
-
-        :param concurrency: API limit
-        :param interval: Reset interval
-        """
-        self._interval = interval
-        self._sem = multiprocessing.Semaphore(concurrency)
-        # Queue of inquiry timestamps
-        self._inquiries = multiprocessing.Queue()
-        self._count = multiprocessing.Value('I', lock=True)
-        self._count.value = concurrency
-
-    def __enter__(self):
-        self._sem.acquire()
-        with self._count.get_lock():
-            if self._count.value > 0:
-                self._count.value -= 1
-                return True
-        timelapse = time.monotonic() - self._inquiries.get()
-        # Wait until interval has passed since the first inquiry in queue returned.
-        if timelapse < self._interval:
-            time.sleep(self._interval - timelapse)
-        return True
-
-    def __exit__(self, *args):
-        self._inquiries.put(time.monotonic())
-        self._sem.release()
-
-
 def columned_output(res: List, header: str, ncols: int, format):
     """Print list in `ncols` columns
 
@@ -246,5 +211,95 @@ def call_coroutine(cls):
     return cls
 
 
+class LoopLag:
+    """测量事件循环延迟：每隔interval秒安排回调，记录实际执行时间比预定时间晚多少
+    """
+
+    def __init__(self, interval=0.01, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self._handle = None
+
+    def start(self):
+        self._schedule()
+        return self
+
+    def stop(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        when = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(when, self._measure, when)
+
+    def _measure(self, when):
+        lag = self.loop.time() - when
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+        self._schedule()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+
+class TTLCache:
+    """按最近使用淘汰的过期缓存，条目超过ttl秒或数据版本变化后失效
+    """
+
+    def __init__(self, maxsize=256, ttl=60.):
+        """
+        :param maxsize: 最多条目数
+        :param ttl: 有效秒数
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: collections.OrderedDict = collections.OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version=None, default=None):
+        """
+        :param key: 键
+        :param version: 数据版本，与写入时不同则失效
+        :param default: 未命中时返回值
+        """
+        if (entry := self.data.get(key)) is not None:
+            value, expires, stored = entry
+            if expires > time.monotonic() and stored == version:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value, version=None):
+        self.data[key] = value, time.monotonic() + self.ttl, version
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """删除一个或全部条目
+        """
+        if key is None:
+            self.data.clear()
+        else:
+            self.data.pop(key, None)
+
+    @property
+    def hit_rate(self):
+        return self.hits / total if (total := self.hits + self.misses) else 0.
+
+    def __len__(self):
+        return len(self.data)
+
+
 async def ainput(loop, *args):
     return await asyncio.ensure_future(loop.run_in_executor(None, functools.partial(input, *args)))